@@ -0,0 +1,325 @@
+"""
+A local stand-in for the OpenAI chat completions API, for load tests and
+benchmarks that must not touch the real provider.
+
+Answers are deterministic: every text gets a latent quality per rubric dimension
+from a hash of its content, so evaluations and comparisons of the same texts are
+consistent across calls and runs. Latency, 429s and 5xx errors are injected
+according to MockConfig.
+
+    python -m benchmarks.mock_llm_server --port 8900 --latency-ms 200 --rate-limit-rate 0.02
+"""
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from dataclasses import dataclass, asdict
+from typing import Optional
+from aiohttp import web
+
+DIMENSIONS = ("creativity", "depth", "coherence", "grammar")
+SCALES = {"creativity": 12, "depth": 12, "coherence": 5}
+
+# Prompt caching is modelled like OpenAI's: prefixes of 1024+ tokens, in 128 token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+CHARS_PER_TOKEN = 4
+
+_TEXT_A = re.compile(r"Text A: (.*?)\n\s*(?:Mistakes A:|Text B:)", re.DOTALL)
+_TEXT_B = re.compile(r"Text B: (.*?)(?:\n\s*Mistakes B:|\n\s*Provide|\s*$)", re.DOTALL)
+
+
+@dataclass
+class MockConfig:
+    latency: str = "lognormal"  # "none", "constant", "uniform" or "lognormal"
+    latency_ms: float = 200.0  # constant value, uniform mean or lognormal median
+    latency_sigma: float = 0.5  # lognormal shape; uniform spreads +/- latency_ms * sigma
+    rate_limit_rate: float = 0.0  # fraction of requests answered with 429
+    server_error_rate: float = 0.0  # fraction of requests answered with 500/502/503
+    retry_after: float = 1.0  # Retry-After seconds sent with 429s
+    max_in_flight: int = 0  # answer 429 above this many concurrent requests; 0 disables
+    draw_margin: float = 0.02  # quality difference below which comparisons are a DRAW
+    seed: int = 0
+
+
+def quality(text: str, dimension: str) -> float:
+    """
+    Latent quality of a text on one dimension, in [0, 1).
+    """
+    digest = hashlib.blake2b(f"{dimension}\x00{text.strip()}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64
+
+
+def score(text: str, dimension: str) -> int:
+    return 1 + int(quality(text, dimension) * SCALES[dimension])
+
+
+def grammar_mistakes(text: str):
+    """
+    Between zero and three made-up mistakes; a higher grammar quality means more mistakes.
+    """
+    words = [match for match in re.finditer(r"\S+", text)]
+    count = min(len(words), int(quality(text, "grammar") * 4))
+    mistakes = []
+    for word in words[:count]:
+        mistakes.append({"start_idx": word.start(), "end_idx": word.end(), "original_text": word.group(),
+                         "corrected_text": word.group().lower(), "mistake_category": "Word choice"})
+    return mistakes
+
+
+def compare(text_a: str, text_b: str, dimension: str, draw_margin: float) -> str:
+    quality_a, quality_b = quality(text_a, dimension), quality(text_b, dimension)
+    if dimension == "grammar":
+        quality_a, quality_b = quality_b, quality_a  # fewer mistakes is better
+    if abs(quality_a - quality_b) < draw_margin:
+        return "DRAW"
+    return "A" if quality_a > quality_b else "B"
+
+
+def _evaluated_text(prompt: str) -> str:
+    # Evaluation prompts, plagiarism and story prompts all end with "Text: <text>"
+    return prompt.rsplit("Text: ", 1)[-1].strip()
+
+
+def _compared_texts(prompt: str):
+    text_a, text_b = _TEXT_A.search(prompt), _TEXT_B.search(prompt)
+    return (text_a.group(1).strip() if text_a else ""), (text_b.group(1).strip() if text_b else "")
+
+
+def classify(prompt: str) -> str:
+    if "Compare the following two texts on four dimensions" in prompt:
+        return "compare_all"
+    if "Evaluate the following text on four dimensions" in prompt:
+        return "evaluate_all"
+    if "List only strict grammatical mistakes" in prompt:
+        return "list_grammar"
+    if "Compare the grammar skills" in prompt:
+        return "compare_grammar"
+    if "Compare the following two texts" in prompt:
+        for dimension, marker in (("creativity", "more creative"), ("depth", "more depth"), ("coherence", "more coherent")):
+            if marker in prompt:
+                return f"compare_{dimension}"
+    for dimension in ("creativity", "depth", "coherence"):
+        if f"Evaluate the {dimension}" in prompt:
+            return f"evaluate_{dimension}"
+    if "plagiarized" in prompt:
+        return "plagiarism"
+    if "story-like" in prompt:
+        return "story"
+    return "unknown"
+
+
+def answer(kind: str, prompt: str, config: MockConfig) -> str:
+    if kind == "compare_all":
+        text_a, text_b = _compared_texts(prompt)
+        return json.dumps({dimension: compare(text_a, text_b, dimension, config.draw_margin) for dimension in DIMENSIONS})
+    if kind.startswith("compare_"):
+        text_a, text_b = _compared_texts(prompt)
+        return compare(text_a, text_b, kind[len("compare_"):], config.draw_margin)
+    text = _evaluated_text(prompt)
+    if kind == "evaluate_all":
+        evaluation = {dimension: score(text, dimension) for dimension in SCALES}
+        evaluation["grammar_mistakes"] = grammar_mistakes(text)
+        return json.dumps(evaluation, ensure_ascii=False)
+    if kind.startswith("evaluate_"):
+        return str(score(text, kind[len("evaluate_"):]))
+    if kind == "list_grammar":
+        return json.dumps(grammar_mistakes(text), ensure_ascii=False)
+    if kind == "plagiarism":
+        return "MEDIUM: Aesop's Fables" if quality(text, "plagiarism") > 0.95 else "LOW"
+    if kind == "story":
+        return str(10 * int(quality(text, "story") * 11))
+    return "OK"
+
+
+class MockLLMServer:
+    """
+    The mock server and its counters. Use create_app() to serve it, or
+    start()/stop() to run it on a background thread from tests and scripts.
+    """
+
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config or MockConfig()
+        self._random = random.Random(self.config.seed)
+        self._prefixes = set()
+        self._in_flight = 0
+        self.reset()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+
+    def reset(self):
+        self.stats = Counter()
+        self.kinds = Counter()
+        self.peak_in_flight = 0
+        self._prefixes.clear()
+
+    def snapshot(self):
+        return {**self.stats, "kinds": dict(self.kinds), "peak_in_flight": self.peak_in_flight,
+                "config": asdict(self.config)}
+
+    def latency(self) -> float:
+        config = self.config
+        if config.latency == "none" or config.latency_ms <= 0:
+            return 0.0
+        if config.latency == "constant":
+            seconds = config.latency_ms
+        elif config.latency == "uniform":
+            spread = config.latency_ms * config.latency_sigma
+            seconds = self._random.uniform(config.latency_ms - spread, config.latency_ms + spread)
+        else:
+            seconds = self._random.lognormvariate(0.0, config.latency_sigma) * config.latency_ms
+        return max(0.0, seconds) / 1000
+
+    def cached_tokens(self, prompt_text: str) -> int:
+        """
+        Tokens of the longest previously seen prompt prefix, counted like provider
+        prompt caching; every prefix of this prompt is remembered for later calls.
+        """
+        step = CACHE_STEP_TOKENS * CHARS_PER_TOKEN
+        cached = 0
+        for end in range(CACHE_MIN_TOKENS * CHARS_PER_TOKEN, len(prompt_text) + 1, step):
+            key = hashlib.blake2b(prompt_text[:end].encode(), digest_size=16).digest()
+            if key in self._prefixes:
+                cached = end // CHARS_PER_TOKEN
+            else:
+                self._prefixes.add(key)
+        return cached
+
+    def _error(self, status, message, error_type, headers=None):
+        return web.json_response({"error": {"message": message, "type": error_type, "code": None}},
+                                 status=status, headers=headers)
+
+    async def chat_completions(self, request: web.Request):
+        self.stats["requests"] += 1
+        self._in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+        try:
+            payload = await request.json()
+            await asyncio.sleep(self.latency())
+            config = self.config
+            over_capacity = config.max_in_flight and self._in_flight > config.max_in_flight
+            if over_capacity or self._random.random() < config.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                return self._error(429, "Rate limit reached for requests (mock)", "requests",
+                                   headers={"Retry-After": str(config.retry_after)})
+            if self._random.random() < config.server_error_rate:
+                self.stats["server_errors"] += 1
+                status = self._random.choice((500, 502, 503))
+                return self._error(status, "The server had an error processing your request (mock)", "server_error")
+            return web.json_response(self.completion(payload))
+        finally:
+            self._in_flight -= 1
+
+    def completion(self, payload):
+        messages = payload.get("messages", [])
+        prompt = messages[-1].get("content", "") if messages else ""
+        kind = classify(prompt)
+        content = answer(kind, prompt, self.config)
+        prompt_text = "".join(message.get("content", "") for message in messages)
+        prompt_tokens = max(1, len(prompt_text) // CHARS_PER_TOKEN)
+        completion_tokens = max(1, len(content) // CHARS_PER_TOKEN)
+        cached_tokens = self.cached_tokens(prompt_text)
+        self.stats["completions"] += 1
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        self.stats["cached_tokens"] += cached_tokens
+        self.kinds[kind] += 1
+        return {
+            "id": f"chatcmpl-mock-{self.stats['completions']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            },
+        }
+
+    async def get_stats(self, request: web.Request):
+        return web.json_response(self.snapshot())
+
+    async def reset_stats(self, request: web.Request):
+        self.reset()
+        return web.json_response({"status": "reset"})
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 ** 2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/chat/completions", self.chat_completions)
+        app.router.add_get("/stats", self.get_stats)
+        app.router.add_post("/reset", self.reset_stats)
+        return app
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve on a background thread with its own event loop. Returns the API base URL.
+        """
+        started = threading.Event()
+        address = {}
+
+        async def serve():
+            self._runner = web.AppRunner(self.create_app())
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, host, port)
+            await site.start()
+            address["port"] = self._runner.addresses[0][1]
+            started.set()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mock-llm-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        return f"http://{host}:{address['port']}/v1"
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+def create_app(config: Optional[MockConfig] = None) -> web.Application:
+    return MockLLMServer(config).create_app()
+
+
+def parse_args(argv=None):
+    defaults = MockConfig()
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", choices=["none", "constant", "uniform", "lognormal"], default=defaults.latency)
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--server-error-rate", type=float, default=defaults.server_error_rate)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--max-in-flight", type=int, default=defaults.max_in_flight)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = MockConfig(latency=args.latency, latency_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+                        rate_limit_rate=args.rate_limit_rate, server_error_rate=args.server_error_rate,
+                        retry_after=args.retry_after, max_in_flight=args.max_in_flight, seed=args.seed)
+    web.run_app(create_app(config), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
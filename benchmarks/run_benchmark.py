@@ -0,0 +1,248 @@
+"""
+End-to-end benchmark of the content-rank and additional-analysis jobs against
+the mock LLM server, so performance changes can be measured offline.
+
+Each scenario (endpoint x essay count) runs in a fresh interpreter with its own
+working directory, so caches, checkpoints and the peak RSS of one scenario don't
+leak into the next. Reported per scenario: wall time, LLM calls per essay (from
+the mock's counters, retries included), peak RSS and event-loop lag.
+
+    python -m benchmarks.run_benchmark --sizes 100,1000 --latency-ms 50 --rate-limit-rate 0.01
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import tempfile
+import subprocess
+import urllib.request
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+ENDPOINTS = ("content-rank", "additional-analysis")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SUBJECTS = ["my summer", "the school trip", "my best friend", "a rainy day", "our science fair", "the old library",
+             "my grandmother's garden", "learning to swim", "the lost puppy", "a day at the beach"]
+_WORDS = ("we went saw played ate found learned helped walked talked laughed built painted read wrote ran jumped "
+          "happy sad big small bright quiet loud new old funny scary beautiful tired excited careful "
+          "friend family teacher house park river tree book game dog cat bird sea mountain city bus "
+          "and but because then after before when so very really also always sometimes").split()
+
+
+def make_essays(count: int, seed: int = 0, duplicate_rate: float = 0.05) -> List[Dict]:
+    """
+    Synthetic student essays of 80-250 words, a few of them lightly edited copies
+    of earlier ones so the similarity checks have near-duplicates to find.
+    """
+    rng = np.random.default_rng(seed)
+    essays = []
+    for index in range(count):
+        if essays and rng.random() < duplicate_rate:
+            words = essays[int(rng.integers(len(essays)))]["answer"].split()
+            words[int(rng.integers(len(words)))] = str(rng.choice(_WORDS))
+            answer = " ".join(words)
+        else:
+            subject = _SUBJECTS[int(rng.integers(len(_SUBJECTS)))]
+            body = " ".join(rng.choice(_WORDS, size=int(rng.integers(80, 250))))
+            answer = f"This is about {subject}. {body}."
+        essays.append({"id": f"essay-{index}", "answer": answer})
+    return essays
+
+
+def job_request(endpoint: str, essays: List[Dict], num_folds=None) -> Dict:
+    if endpoint == "content-rank":
+        return {"texts": essays, "num_folds": num_folds}
+    return {"texts": essays}
+
+
+async def run_scenario(endpoint: str, size: int, num_folds=None, poll_interval: float = 0.5, timeout: float = 24 * 3600) -> Dict:
+    """
+    Drive one job through the app in this process and measure it. The app is
+    imported here, after the caller has pointed OPENAI_API_BASE at the mock.
+    """
+    import httpx
+    from fast_llm_api.main import app
+    from fast_llm_api.helpers.profiling import LoopLagMonitor, phase_recorder
+
+    essays = make_essays(size)
+    monitor = LoopLagMonitor(interval=0.05, warn_after=float("inf"))
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            monitor.start()
+            started = time.perf_counter()
+            response = await client.post(f"/{endpoint}/submit-job", json=job_request(endpoint, essays, num_folds))
+            response.raise_for_status()
+            job_id = response.json()["job_id"]
+            while True:
+                status = (await client.get(f"/{endpoint}/job-status/{job_id}")).json()
+                if status.get("status") in ("completed", "failed"):
+                    break
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"{endpoint} job with {size} essays did not finish in {timeout}s")
+                await asyncio.sleep(poll_interval)
+            wall_time = time.perf_counter() - started
+            result = (await client.get(f"/{endpoint}/job-result/{job_id}", params={"limit": 1})).json()
+            await monitor.stop()
+
+    return {
+        "endpoint": endpoint,
+        "essays": size,
+        "status": status["status"],
+        "error": status.get("error"),
+        "result_total": result.get("total"),
+        "wall_time_s": round(wall_time, 2),
+        "essays_per_s": round(size / wall_time, 2),
+        # ru_maxrss is in KiB on Linux; children covers the analysis process pool
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_rss_children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        "loop_lag_p50_ms": round(monitor.percentile(50) * 1000, 2),
+        "loop_lag_p99_ms": round(monitor.percentile(99) * 1000, 2),
+        "loop_lag_max_ms": round(monitor.max_lag * 1000, 2),
+        "phases": (phase_recorder.job_summary(job_id) or {}).get("totals"),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _http_json(url: str, data: bytes = None) -> Dict:
+    with urllib.request.urlopen(urllib.request.Request(url, data=data), timeout=10) as response:
+        return json.loads(response.read())
+
+
+def start_mock_server(args) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    command = [sys.executable, "-m", "benchmarks.mock_llm_server", "--port", str(port),
+               "--latency", args.latency, "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+               "--rate-limit-rate", str(args.rate_limit_rate), "--server-error-rate", str(args.server_error_rate),
+               "--retry-after", str(args.retry_after), "--max-in-flight", str(args.max_in_flight), "--seed", str(args.seed)]
+    process = subprocess.Popen(command, cwd=REPO_ROOT)
+    server_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            _http_json(f"{server_url}/stats")
+            return process, server_url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Mock LLM server did not start")
+
+
+def scenario_env(server_url: str, args) -> Dict:
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")])),
+        "OPENAI_API_BASE": f"{server_url}/v1",
+        "OPENAI_API_KEY": "mock",
+        "LLM_CACHE_ENABLED": "0",  # every run should reach the provider
+        "RESUME_JOBS_ON_STARTUP": "0",
+        # The mock has no provider quotas; benchmark the app, not the default limits
+        "LLM_REQUESTS_PER_MINUTE": str(args.requests_per_minute),
+        "LLM_TOKENS_PER_MINUTE": str(args.tokens_per_minute),
+        "LLM_RETRY_BASE_DELAY": str(args.retry_base_delay),
+    })
+    return env
+
+
+def run_in_subprocess(endpoint: str, size: int, server_url: str, args) -> Dict:
+    _http_json(f"{server_url}/reset", data=b"")
+    command = [sys.executable, "-m", "benchmarks.run_benchmark", "--scenario", endpoint, str(size)]
+    if args.num_folds is not None:
+        command += ["--num-folds", str(args.num_folds)]
+    with tempfile.TemporaryDirectory(prefix="fast-llm-bench-") as work_dir:
+        completed = subprocess.run(command, cwd=work_dir, env=scenario_env(server_url, args),
+                                   stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL, text=True)
+    if completed.returncode != 0:
+        return {"endpoint": endpoint, "essays": size, "status": "crashed", "error": f"exit code {completed.returncode}"}
+    report = json.loads(completed.stdout.strip().splitlines()[-1])
+    stats = _http_json(f"{server_url}/stats")
+    report.update({
+        "llm_requests": stats.get("requests", 0),
+        "llm_calls_per_essay": round(stats.get("completions", 0) / size, 2),
+        "llm_retries": stats.get("rate_limited", 0) + stats.get("server_errors", 0),
+        "prompt_tokens": stats.get("prompt_tokens", 0),
+        "cached_tokens": stats.get("cached_tokens", 0),
+        "cached_token_share": round(stats.get("cached_tokens", 0) / max(1, stats.get("prompt_tokens", 0)), 3),
+        "completion_tokens": stats.get("completion_tokens", 0),
+        "llm_peak_in_flight": stats.get("peak_in_flight", 0),
+        "llm_calls_by_kind": stats.get("kinds", {}),
+    })
+    return report
+
+
+def print_table(reports: List[Dict]):
+    columns = ["endpoint", "essays", "status", "wall_time_s", "llm_calls_per_essay", "llm_retries",
+               "cached_token_share", "peak_rss_mb", "loop_lag_p99_ms", "loop_lag_max_ms"]
+    rows = [[str(report.get(column, "")) for column in columns] for report in reports]
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark content-rank and additional-analysis jobs against the mock LLM server")
+    parser.add_argument("--sizes", default="100,1000,10000", help="comma separated essay counts")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated subset of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--num-folds", type=int, default=None, help="content-rank folds; defaults to the recommendation")
+    parser.add_argument("--output", help="also write the reports to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's logs")
+    parser.add_argument("--latency", choices=["none", "constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--max-in-flight", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests-per-minute", type=int, default=1_000_000)
+    parser.add_argument("--tokens-per-minute", type=int, default=1_000_000_000)
+    parser.add_argument("--retry-base-delay", type=float, default=0.1)
+    parser.add_argument("--scenario", nargs=2, metavar=("ENDPOINT", "SIZE"), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.scenario:
+        # Child mode: run one scenario against the already configured environment
+        endpoint, size = args.scenario
+        report = asyncio.run(run_scenario(endpoint, int(size), args.num_folds))
+        print(json.dumps(report))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    endpoints = [endpoint.strip() for endpoint in args.endpoints.split(",") if endpoint.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    mock_process, server_url = start_mock_server(args)
+    reports = []
+    try:
+        for endpoint in endpoints:
+            for size in sizes:
+                print(f"Running {endpoint} with {size} essays...", file=sys.stderr)
+                reports.append(run_in_subprocess(endpoint, size, server_url, args))
+    finally:
+        mock_process.terminate()
+        mock_process.wait()
+
+    print_table(reports)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
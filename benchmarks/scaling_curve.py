@@ -0,0 +1,68 @@
+"""
+Fit a scaling curve to pytest-benchmark results and fail on super-linear regressions.
+
+    python -m benchmarks.scaling_curve micro.json
+
+For every benchmark group with an "n" in extra_info, prints the median time per
+size and the exponent k of a least-squares fit of time ~ n^k on a log-log scale.
+Exits non-zero if any group's k is above its "max_exponent".
+"""
+import sys
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+def scaling_exponent(sizes: List[float], times: List[float]) -> float:
+    if len(sizes) < 2:
+        return float("nan")
+    slope, _ = np.polyfit(np.log(sizes), np.log(times), 1)
+    return float(slope)
+
+
+def scaling_curves(report: Dict) -> Dict[str, Tuple[List[Tuple[int, float]], float, float]]:
+    """
+    Group name -> ([(n, median seconds)], fitted exponent, exponent budget).
+    """
+    points = defaultdict(list)
+    budgets = {}
+    for bench in report.get("benchmarks", []):
+        extra = bench.get("extra_info", {})
+        if "n" not in extra:
+            continue
+        group = bench.get("group") or bench["name"]
+        points[group].append((int(extra["n"]), float(bench["stats"]["median"])))
+        if "max_exponent" in extra:
+            budgets[group] = float(extra["max_exponent"])
+    curves = {}
+    for group, group_points in points.items():
+        group_points.sort()
+        exponent = scaling_exponent([n for n, _ in group_points], [t for _, t in group_points])
+        curves[group] = (group_points, exponent, budgets.get(group, float("inf")))
+    return curves
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scaling exponents of pytest-benchmark results")
+    parser.add_argument("report", help="JSON written by pytest --benchmark-json")
+    args = parser.parse_args(argv)
+    with open(args.report) as f:
+        curves = scaling_curves(json.load(f))
+
+    failed = []
+    for group, (group_points, exponent, budget) in sorted(curves.items()):
+        timings = ", ".join(f"n={n}: {seconds * 1000:.3f}ms" for n, seconds in group_points)
+        verdict = "ok" if not exponent > budget else "TOO STEEP"
+        print(f"{group}: k={exponent:.2f} (max {budget:g}) {verdict}\n    {timings}")
+        if exponent > budget:
+            failed.append(group)
+    if failed:
+        print(f"Scaling regressions in: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
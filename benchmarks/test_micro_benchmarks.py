@@ -0,0 +1,116 @@
+"""
+Micro-benchmarks of the CPU hot paths over synthetic corpora of growing size.
+Not part of the default test run:
+
+    python -m pytest benchmarks/test_micro_benchmarks.py --benchmark-json=micro.json
+    python -m benchmarks.scaling_curve micro.json
+
+Each benchmark records its input size and the largest acceptable scaling
+exponent in extra_info; scaling_curve fits time ~ n^k per group and fails when k
+exceeds the budget, which is how an accidental O(n^2) shows up.
+"""
+import json
+import asyncio
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pip install pytest-benchmark to run the micro-benchmarks")
+
+from benchmarks.run_benchmark import make_essays
+from fast_llm_api.helpers.async_llm_helpers import parse_grammar_mistakes
+from fast_llm_api.services import additional_analyis
+from fast_llm_api.services.additional_analyis import cross_check_similarity
+from fast_llm_api.services.content_rank import elo_fight_generator
+from fast_llm_api.services.content_rank.elo_fight_generator import apply_evaluation, elo_fights, select_opponent, update_elo
+from fast_llm_api.services.content_rank.pairing import swiss_pairings
+from fast_llm_api.services.models import OneStudentEntry
+
+SIZES = [100, 300, 1000, 3000]
+OUTCOMES = ("A", "B", "DRAW")
+
+
+def rated_entries(n):
+    entries = [OneStudentEntry(**essay) for essay in make_essays(n)]
+    for index, entry in enumerate(entries):
+        apply_evaluation(entry, 1 + index % 12, 1 + index * 7 % 12, 1 + index % 5, [{}] * (index % 4))
+    return entries
+
+
+def record(benchmark, group, n, max_exponent):
+    benchmark.group = group
+    benchmark.extra_info.update({"n": n, "max_exponent": max_exponent})
+
+
+async def stub_compare_pair(entry, opponent):
+    # Deterministic outcomes without any LLM call
+    return tuple(OUTCOMES[(len(entry['answer']) + len(opponent['answer']) + offset) % 3] for offset in range(4))
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_select_opponent(benchmark, n):
+    record(benchmark, "select_opponent", n, 1.4)
+    entries = rated_entries(n)
+    benchmark(select_opponent, entries, entries[n // 2])
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_swiss_pairings(benchmark, n):
+    record(benchmark, "swiss_pairings", n, 1.4)
+    entries = rated_entries(n)
+    ratings = [[entry['elo_creativity'], entry['elo_depth'], entry['elo_coherence'], entry['elo_grammar']] for entry in entries]
+    ids = [entry['id'] for entry in entries]
+    benchmark(swiss_pairings, ratings, ids, set(), fold=0)
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_update_elo_fold(benchmark, n):
+    record(benchmark, "update_elo", n, 1.4)
+    entries = rated_entries(n)
+
+    def one_fold():
+        # One fold's worth of updates: every entry plays once on every dimension
+        for i in range(0, n - 1, 2):
+            for score_type in ("elo_creativity", "elo_depth", "elo_coherence", "elo_grammar"):
+                update_elo(entries[i], entries[i + 1], OUTCOMES[i % 3], score_type)
+
+    benchmark(one_fold)
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_elo_fights(benchmark, monkeypatch, n):
+    record(benchmark, "elo_fights", n, 1.4)
+    monkeypatch.setattr(elo_fight_generator, "_compare_pair", stub_compare_pair)
+
+    def setup():
+        return (rated_entries(n),), {}
+
+    def run(entries):
+        asyncio.run(elo_fights(entries, num_folds=3, early_stopping=False))
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+
+
+@pytest.mark.parametrize("method,max_exponent", [("exact", 2.2), ("minhash", 1.5)])
+@pytest.mark.parametrize("n", SIZES)
+def test_cross_check_similarity(benchmark, monkeypatch, n, method, max_exponent):
+    # Exact all-pairs similarity is inherently quadratic in the product; the
+    # budget is there to catch anything worse
+    record(benchmark, f"cross_check_similarity[{method}]", n, max_exponent)
+    monkeypatch.setattr(additional_analyis, "SIMILARITY_CORPUS_RECORD_ALL", False)
+    essays = make_essays(n)
+
+    def setup():
+        return ([dict(essay) for essay in essays],), {}
+
+    def run(entries):
+        asyncio.run(cross_check_similarity(entries, 0.2, method=method))
+
+    benchmark.pedantic(run, setup=setup, rounds=3)
+
+
+@pytest.mark.parametrize("n", SIZES)
+def test_parse_grammar_mistakes(benchmark, n):
+    record(benchmark, "parse_grammar_mistakes", n, 1.4)
+    mistakes = [{"start_idx": 4 * i, "end_idx": 4 * i + 3, "original_text": "goed", "corrected_text": "went",
+                 "mistake_category": "Verb tense; irregular past"} for i in range(n)]
+    response = "```json\n" + json.dumps(mistakes, indent=2) + "\n```"
+    assert len(benchmark(parse_grammar_mistakes, response)) == n
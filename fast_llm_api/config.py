@@ -15,3 +15,106 @@ openai.api_key = OPENAI_API_KEY
 
 # Set Anthropic API key globally in the client (can also create a global client here)
 anthropic_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+
+# Shared aiohttp connection pool used for every async LLM call
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "50"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_REQUEST_TIMEOUT = float(os.getenv("HTTP_REQUEST_TIMEOUT", "120"))
+
+# Process-wide admission control for LLM calls (0 disables a limit)
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "500"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+
+# Retry policy for LLM calls (seconds)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "6"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "60"))
+LLM_CALL_DEADLINE = float(os.getenv("LLM_CALL_DEADLINE", "300"))
+
+# Content-addressed cache of LLM responses (empty path keeps it in memory only)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite3")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "10000"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "500000"))
+
+# OpenAI-compatible endpoint (point at a local stand-in for offline runs)
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1").rstrip("/")
+
+# Batch execution mode: "openai" uses the Batch API, "replay" answers from a local JSONL file
+LLM_BATCH_BACKEND = os.getenv("LLM_BATCH_BACKEND", "openai")
+LLM_BATCH_REPLAY_PATH = os.getenv("LLM_BATCH_REPLAY_PATH", "")
+LLM_BATCH_WORK_DIR = os.getenv("LLM_BATCH_WORK_DIR", ".cache/batches")
+LLM_BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_INTERVAL", "30"))
+LLM_BATCH_MAX_WAIT = float(os.getenv("LLM_BATCH_MAX_WAIT", str(24 * 3600)))
+
+# Ask for all four rubric dimensions in one structured call (falls back to per-dimension calls)
+LLM_COMBINED_RUBRIC = os.getenv("LLM_COMBINED_RUBRIC", "1") == "1"
+
+# Adaptive fold scheduling for content ranking (num_folds becomes an upper bound)
+FOLD_MIN_FOLDS = int(os.getenv("FOLD_MIN_FOLDS", "2"))
+# Ratings are averaged over this many folds before checking rank stability and drift
+FOLD_WINDOW = int(os.getenv("FOLD_WINDOW", "4"))
+FOLD_TAU_THRESHOLD = float(os.getenv("FOLD_TAU_THRESHOLD", "0.985"))
+# Converged once smoothed ratings drift by at most this fraction of the Elo K factor per fold
+FOLD_DRIFT_FRACTION = float(os.getenv("FOLD_DRIFT_FRACTION", "0.125"))
+FOLD_FOCUS_FRACTION = float(os.getenv("FOLD_FOCUS_FRACTION", "0.5"))
+
+# Job tracking for both routers: "memory" (single process) or "sqlite" (shared by all workers)
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "memory")
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", ".cache/jobs.sqlite3")
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Job executor: how many jobs run at once, and how many may wait before submits get a 429
+JOB_MAX_CONCURRENT = int(os.getenv("JOB_MAX_CONCURRENT", "2"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "100"))
+# Jobs with at most this many texts get interactive priority by default
+JOB_INTERACTIVE_SIZE = int(os.getenv("JOB_INTERACTIVE_SIZE", "50"))
+
+# Content-rank checkpoints, used to resume jobs after a crash or redeploy
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", ".cache/checkpoints")
+RESUME_JOBS_ON_STARTUP = os.getenv("RESUME_JOBS_ON_STARTUP", "1") == "1"
+
+# Cross-check similarity: neighbours kept per essay, and the dense block size (rows x N scores) held at once
+SIMILARITY_TOP_K = int(os.getenv("SIMILARITY_TOP_K", "5"))
+SIMILARITY_BLOCK_ELEMENTS = int(os.getenv("SIMILARITY_BLOCK_ELEMENTS", str(16_000_000)))
+
+# MinHash/LSH near-duplicate index: signature length, LSH bands (rows per band = perm / bands),
+# character shingle size, and where the cross-job index of previous submissions is kept
+MINHASH_NUM_PERM = int(os.getenv("MINHASH_NUM_PERM", "128"))
+MINHASH_BANDS = int(os.getenv("MINHASH_BANDS", "32"))
+MINHASH_SHINGLE_SIZE = int(os.getenv("MINHASH_SHINGLE_SIZE", "5"))
+MINHASH_MAX_BUCKET_PAIRS = int(os.getenv("MINHASH_MAX_BUCKET_PAIRS", "50"))
+MINHASH_INDEX_DIR = os.getenv("MINHASH_INDEX_DIR", ".cache/minhash_index")
+
+# Persistent TF-IDF corpus of earlier submissions, queried by jobs with a "school" or "all" similarity scope
+SIMILARITY_CORPUS_DIR = os.getenv("SIMILARITY_CORPUS_DIR", ".cache/similarity_corpus")
+# Also record texts of jobs that only compare within themselves, so later jobs can find them. Off by
+# default: the corpus has no retention, so opting in keeps every submitted text on disk indefinitely
+SIMILARITY_CORPUS_RECORD_ALL = os.getenv("SIMILARITY_CORPUS_RECORD_ALL", "0") == "1"
+
+# Executors for CPU-bound analysis: a process pool for vectorisation and similarity (0 disables it,
+# falling back to threads), a thread pool for lighter work, and the cohort size worth a process hop
+ANALYSIS_PROCESS_WORKERS = int(os.getenv("ANALYSIS_PROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+ANALYSIS_THREAD_WORKERS = int(os.getenv("ANALYSIS_THREAD_WORKERS", "8"))
+ANALYSIS_PROCESS_MIN_TEXTS = int(os.getenv("ANALYSIS_PROCESS_MIN_TEXTS", "2000"))
+
+# LLM telemetry: USD per million tokens for cost estimates (defaults are gpt-4o-mini list prices),
+# the Batch API discount factor, and how many jobs keep per-job metrics in memory
+LLM_PRICE_PROMPT_PER_MILLION = float(os.getenv("LLM_PRICE_PROMPT_PER_MILLION", "0.15"))
+LLM_PRICE_CACHED_PROMPT_PER_MILLION = float(os.getenv("LLM_PRICE_CACHED_PROMPT_PER_MILLION", "0.075"))
+LLM_PRICE_COMPLETION_PER_MILLION = float(os.getenv("LLM_PRICE_COMPLETION_PER_MILLION", "0.60"))
+LLM_BATCH_PRICE_FACTOR = float(os.getenv("LLM_BATCH_PRICE_FACTOR", "0.5"))
+TELEMETRY_MAX_JOBS = int(os.getenv("TELEMETRY_MAX_JOBS", "1000"))
+
+# Opt-in profiling: an event-loop lag monitor and sampled stack profiles of jobs, either every job
+# (PROFILE_ALL_JOBS) or those requested through POST /profiling/jobs/{job_id}; folded stacks go to PROFILE_DIR
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_ALL_JOBS = os.getenv("PROFILE_ALL_JOBS", "0") == "1"
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", ".cache/profiles")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_WARN_SECONDS = float(os.getenv("LOOP_LAG_WARN_SECONDS", "0.25"))
@@ -5,94 +5,172 @@ import json
 import asyncio
 import aiohttp
 import time
+import logging
+from typing import List, Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from fast_llm_api.helpers.http_session import get_http_session
+from fast_llm_api.helpers.rate_limiter import get_llm_scheduler, estimate_tokens
+from fast_llm_api.helpers.llm_cache import llm_cache, make_cache_key
+from fast_llm_api.helpers.retry_policy import RetryPolicy, LLMRequestError, is_retryable_exception, is_retryable_status, parse_retry_after
+from fast_llm_api.helpers.telemetry import telemetry, LLMCallRecord, current_call
+from fast_llm_api.helpers.prompt_templates import (EVALUATE_CREATIVITY, EVALUATE_DEPTH, EVALUATE_COHERENCE, LIST_GRAMMAR_MISTAKES,
+                                                   COMPARE_CREATIVITY, COMPARE_DEPTH, COMPARE_COHERENCE, COMPARE_GRAMMAR,
+                                                   EVALUATE_ALL_DIMENSIONS, COMPARE_ALL_DIMENSIONS, RUBRIC_SYSTEM_PROMPT, format_mistakes)
+from fast_llm_api.config import LLM_MAX_RETRIES, OPENAI_API_BASE
+
+logger = logging.getLogger(__name__)
 
 OPENAI_MODEL = "gpt-4o-mini"
+OPENAI_CHAT_COMPLETIONS_URL = f"{OPENAI_API_BASE}/chat/completions"
 
-MAX_RETRIES = 5
-RETRY_BACKOFF_FACTOR = 2
-
-async def async_openai_call(prompt, retries=MAX_RETRIES):
-    for attempt in range(retries):
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai.api_key}"
-            }
-            payload = {
-                "model": OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": "You are an evaluator."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 1000
-            }
-            async with session.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload) as response:
-                try:
-                    result = await response.json()
-                    return result['choices'][0]['message']['content'].strip()
-                except KeyError:
-                    print(f"Error: {result}")
-                    if 'error' in result and 'rate limit' in result['error'].get('message', '').lower():
-                        wait_time = RETRY_BACKOFF_FACTOR ** attempt
-                        print(f"Rate limit hit. Retrying in {wait_time} seconds...")
-                        await asyncio.sleep(wait_time)
-                    else:
-                        raise
-                except Exception as e:
-                    print(f"Unexpected error: {e}")
-                    raise
-    raise Exception("Max retries exceeded")
+MAX_RETRIES = LLM_MAX_RETRIES
+MAX_TOKENS = 1000
+SYSTEM_PROMPT = "You are an evaluator."
 
-async def chatgpt_evaluate_creativity(text):
-    prompt = f"""
-    Evaluate the creativity of the following text on a scale of 1 to 12, where 1 is very basic or unoriginal and 12 is exceptionally creative and original. Be mindful that these were written by elementary school students. Provide only the number as the response. Use the following rubric:
-    - 1-2: Student makes overly simple statements with 2-4 words per sentence.
-    - 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
-    - 5-6: Student uses somewhat complex adjectives and descriptors to describe otherwise generic events.
-    - 7-8: Satisfies 5-6, while explaining some unique experiences with some common elements.
-    - 9-10: Satisfies 7-8, but the student portrays a minimal but existing amount of original thought and perspective.
-    - 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
-    - 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.
-    
-    Text: {text}
+# Calls currently on the wire, by cache key; identical concurrent requests share one future
+_inflight_calls = {}
+
+async def _post_chat_completion(session, payload):
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {openai.api_key}"
+    }
+    async with session.post(OPENAI_CHAT_COMPLETIONS_URL, headers=headers, json=payload) as response:
+        try:
+            result = await response.json(content_type=None)
+        except (json.JSONDecodeError, aiohttp.ContentTypeError):
+            result = None
+        if response.status >= 400 or not isinstance(result, dict) or 'error' in result:
+            error = (result or {}).get('error') if isinstance(result, dict) else None
+            message = error.get('message', '') if isinstance(error, dict) else str(error or result)
+            retryable = is_retryable_status(response.status) or 'rate limit' in message.lower()
+            raise LLMRequestError(f"HTTP {response.status}: {message}", status=response.status,
+                                  retryable=retryable, retry_after=parse_retry_after(response.headers))
+        return result
+
+async def async_openai_call(prompt, retries=MAX_RETRIES, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS, prompt_type="other"):
+    """
+    `prompt_type` (e.g. "compare_depth") only labels the call's telemetry.
     """
-    return await async_openai_call(prompt)
+    cache_key = make_cache_key(OPENAI_MODEL, system_prompt, prompt, max_tokens)
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        telemetry.record_cache_hit(prompt_type)
+        return cached
+
+    pending = _inflight_calls.get(cache_key)
+    if pending is not None:
+        telemetry.record_deduplicated(prompt_type)
+        # Shield so one waiter being cancelled doesn't cancel the shared call
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    # Mark the result as retrieved even when no follower ever awaits it
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    _inflight_calls[cache_key] = future
+    # The retry loop fills in attempts, queue wait and usage through the context
+    record = LLMCallRecord(prompt_type)
+    record_token = current_call.set(record)
+    started = time.monotonic()
+    try:
+        content = await _call_with_retries(prompt, system_prompt, max_tokens, retries)
+        telemetry.record_call(record, time.monotonic() - started, ok=True)
+        await llm_cache.set(cache_key, content)
+        future.set_result(content)
+        return content
+    except asyncio.CancelledError:
+        # Followers belong to other tasks; cancelling the future would raise CancelledError in
+        # them and take down their workers, so hand them an ordinary failed call instead
+        future.set_exception(LLMRequestError("Shared call was cancelled by the request that started it", retryable=True))
+        raise
+    except Exception as e:
+        telemetry.record_call(record, time.monotonic() - started, ok=False)
+        future.set_exception(e)
+        raise
+    finally:
+        current_call.reset(record_token)
+        _inflight_calls.pop(cache_key, None)
+
+async def _call_with_retries(prompt, system_prompt, max_tokens, retries):
+    session = get_http_session()
+    scheduler = get_llm_scheduler()
+    policy = RetryPolicy(max_attempts=retries)
+    estimated_tokens = estimate_tokens(system_prompt + prompt, max_tokens)
+    payload = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": max_tokens
+    }
+
+    loop = asyncio.get_running_loop()
+    record = current_call.get()
+    deadline = loop.time() + policy.deadline
+    delay = policy.base_delay
+    for attempt in range(policy.max_attempts):
+        try:
+            queued_at = loop.time()
+            # Backoff sleeps happen outside the slot so waiting retries don't hold capacity
+            async with scheduler.slot(estimated_tokens):
+                if record is not None:
+                    record.attempts += 1
+                    record.queue_wait += loop.time() - queued_at
+                remaining = max(0.0, deadline - loop.time())
+                result = await asyncio.wait_for(_post_chat_completion(session, payload),
+                                                timeout=min(policy.attempt_timeout, remaining))
+        except Exception as e:
+            if not is_retryable_exception(e):
+                logger.error(f"LLM call failed: {e}")
+                raise
+            delay = policy.next_delay(delay, getattr(e, 'retry_after', None), deadline - loop.time())
+            if attempt + 1 >= policy.max_attempts:
+                raise LLMRequestError(f"Max retries exceeded: {e!r}") from e
+            if loop.time() + delay >= deadline:
+                raise LLMRequestError(f"Call deadline of {policy.deadline}s exceeded: {e!r}") from e
+            logger.warning(f"Retryable error ({e!r}). Retrying in {delay:.2f} seconds...")
+            await asyncio.sleep(delay)
+            continue
+
+        if record is not None:
+            record.usage = result.get('usage')
+        try:
+            return result['choices'][0]['message']['content'].strip()
+        except (KeyError, IndexError, TypeError):
+            raise LLMRequestError(f"Malformed completion response: {result}")
+    raise LLMRequestError("Max retries exceeded")
+
+def evaluate_creativity_prompt(text):
+    return EVALUATE_CREATIVITY.render(text=text)
+
+async def chatgpt_evaluate_creativity(text):
+    prompt = evaluate_creativity_prompt(text)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="evaluate_creativity")
+
+def evaluate_depth_prompt(text):
+    return EVALUATE_DEPTH.render(text=text)
 
 async def chatgpt_evaluate_depth(text):
-    prompt = f"""
-    Evaluate the depth of the following text on a scale of 1 to 12, where 1 is very shallow or surface-level and 12 is exceptionally deep, profound, and comprehensive. Be mindful that these were written by elementary school students. Provide only the number as the response. Use the following rubric:
-    - 1-2: Student makes overly simple statements with 2-4 words per sentence.
-    - 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
-    - 5-6: Student uses somewhat complex adjectives and descriptors to describe simple explorations and insight.
-    - 7-8: Satisfies 5-6, moderate depth, with some detailed exploration and insight.
-    - 9-10: Satisfies 7-8, deep exploration, insightful and well-developed ideas.
-    - 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
-    - 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.
-    
-    Text: {text}
-    """
-    return await async_openai_call(prompt)
+    prompt = evaluate_depth_prompt(text)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="evaluate_depth")
+
+def evaluate_coherence_prompt(text):
+    return EVALUATE_COHERENCE.render(text=text)
 
 async def chatgpt_evaluate_coherence(text):
-    prompt = f"""
-    Evaluate the coherence of the following text on a scale of 1 to 5, where 1 means very hard to understand or comprehend and 5 means that the text can be understood easily. We are not evaluating the depth/creativity of the writing, just how comprehensible and coherent the content is. Be mindful that these were written by elementary school students. Provide only the number as the response. Use the following rubric:
-    - 1: The reader can understand less than 20% of the information the writer meant to convey.
-    - 2: The reader can understand more than 20% but less than 40% of the information the writer meant to convey.
-    - 3: The reader can understand more than 40% but less than 60% of the information the writer meant to convey.
-    - 4: The reader can understand more than 60% but less than 80% of the information the writer meant to convey.
-    - 5: The reader has no trouble understanding what the writer meant to convey.
-
-    Text: {text}
-    """
-    return await async_openai_call(prompt)
+    prompt = evaluate_coherence_prompt(text)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="evaluate_coherence")
+
+def list_grammar_mistakes_prompt(text):
+    return LIST_GRAMMAR_MISTAKES.render(text=text)
 
 async def chatgpt_list_grammar_mistakes(text):
-    prompt = f"""
-    List only strict grammatical mistakes in the following text in the form of a JSON array of dictionaries with the keys: start_idx, end_idx, original_text, corrected_text, and mistake_category. Do not correct punctuation or conjugations, or any of these "trivial" mistakes. The mistake_category should be a short note like a teacher would write when grading essays. The input text is a transcription, not an essay, so we must only pick very specific grammar mistakes and do not pick out syntactical, punctuational, etc the technical mistakes. Ensure the output is a valid JSON array. If there are no mistakes, return an empty array "[]".
+    prompt = list_grammar_mistakes_prompt(text)
+    response = await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="list_grammar_mistakes")
+    return parse_grammar_mistakes(response)
 
-    Text: {text}
-    """
-    response = await async_openai_call(prompt)
+def parse_grammar_mistakes(response):
     try:
         # Preprocess the response to ensure it is a valid JSON array
         cleaned_response = re.sub(r'[^ -~]', '', response)  # Remove non-printable characters
@@ -101,82 +179,106 @@ async def chatgpt_list_grammar_mistakes(text):
         grammar_mistakes = json.loads(cleaned_response)
         return grammar_mistakes
     except json.JSONDecodeError as e:
-        print(f"JSONDecodeError: {e}")
-        print(f"Response: {response}")
-        print(f"Cleaned Response: {cleaned_response}")
+        logger.warning(f"Unparseable grammar mistakes ({e}). Response: {response!r}")
         return []
 
+def compare_creativity_prompt(text_a, text_b):
+    return COMPARE_CREATIVITY.render(text_a=text_a, text_b=text_b)
+
 async def chatgpt_compare_creativity(text_a, text_b):
-    prompt = f"""
-    Compare the following two texts and determine which one is more creative. 
-    
-    Just as reference, here is a rubric for an absolute measure:
-    ```Evaluate the creativity of the following text on a scale of 1 to 12, where 1 is very basic or unoriginal and 12 is exceptionally creative and original. Be mindful that these were written by elementary school students. Provide only the number as the response. Use the following rubric:
-    - 1-2: Student makes overly simple statements with 2-4 words per sentence.
-    - 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
-    - 5-6: Student uses somewhat complex adjectives and descriptors to describe otherwise generic events.
-    - 7-8: Satisfies 5-6, while explaining some unique experiences with some common elements.
-    - 9-10: Satisfies 7-8, but the student portrays a minimal but existing amount of original thought and perspective.
-    - 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
-    - 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.```
-
-    Compare the following two texts and determine which one is more creative. 
-    Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable:
-    Text A: {text_a}
-    Text B: {text_b}
-    """
-    return await async_openai_call(prompt)
+    prompt = compare_creativity_prompt(text_a, text_b)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_creativity")
+
+def compare_depth_prompt(text_a, text_b):
+    return COMPARE_DEPTH.render(text_a=text_a, text_b=text_b)
 
 async def chatgpt_compare_depth(text_a, text_b):
-    prompt = f"""
-    Compare the following two texts and determine which one has more depth. 
-    
-    Just as reference, here is a rubric for an absolute measure:
-    ```Evaluate the depth of the following text on a scale of 1 to 12, where 1 is very shallow or surface-level and 12 is exceptionally deep, profound, and comprehensive. Be mindful that these were written by elementary school students. Provide only the number as the response. Use the following rubric:
-    - 1-2: Student makes overly simple statements with 2-4 words per sentence.
-    - 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
-    - 5-6: Student uses somewhat complex adjectives and descriptors to describe simple explorations and insight.
-    - 7-8: Satisfies 5-6, moderate depth, with some detailed exploration and insight.
-    - 9-10: Satisfies 7-8, deep exploration, insightful and well-developed ideas.
-    - 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
-    - 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.```
-    
-    Compare the following two texts and determine which one has more depth. 
-    Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable:
-    Text A: {text_a}
-    Text B: {text_b}
-    """
-    return await async_openai_call(prompt)
+    prompt = compare_depth_prompt(text_a, text_b)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_depth")
+
+def compare_coherence_prompt(text_a, text_b):
+    return COMPARE_COHERENCE.render(text_a=text_a, text_b=text_b)
 
 async def chatgpt_compare_coherence(text_a, text_b):
-    prompt = f"""
-    Compare the following two texts and determine which one is more coherent. 
-    
-    Just as reference, here is a rubric for an absolute measure:
-    ```Evaluate the coherence of the following text on a scale of 1 to 5, where 1 means very hard to understand or comprehend and 5 means that the text can be understood easily. Provide only the number as the response. Use the following rubric:
-    - 1: The reader can understand less than 20% of the information the writer meant to convey.
-    - 2: The reader can understand more than 20% but less than 40% of the information the writer meant to convey.
-    - 3: The reader can understand more than 40% but less than 60% of the information the writer meant to convey.
-    - 4: The reader can understand more than 60% but less than 80% of the information the writer meant to convey.
-    - 5: The reader has no trouble understanding what the writer meant to convey.```
-
-    Compare the following two texts and determine which one is more coherent. 
-    Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable:
-    Text A: {text_a}
-    Text B: {text_b}
-    """
-    return await async_openai_call(prompt)
+    prompt = compare_coherence_prompt(text_a, text_b)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_coherence")
+
+def compare_grammar_prompt(text_a, text_a_mistakes, text_b, text_b_mistakes):
+    return COMPARE_GRAMMAR.render(text_a=text_a, mistakes_a=format_mistakes(text_a_mistakes),
+                                  text_b=text_b, mistakes_b=format_mistakes(text_b_mistakes))
 
 async def chatgpt_compare_grammar(text_a, text_a_mistakes, text_b, text_b_mistakes):
-    prompt = f"""
-    Compare the grammar skills of the following two texts and determine which one has better grammar skills. Consider the number and types of mistakes listed for each text, as well as the overall complexity and correctness of the grammar used.
+    prompt = compare_grammar_prompt(text_a, text_a_mistakes, text_b, text_b_mistakes)
+    return await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_grammar")
 
-    Text A: {text_a}
-    Mistakes A: {json.dumps(text_a_mistakes)}
+class GrammarMistake(BaseModel):
+    model_config = ConfigDict(extra="allow")
 
-    Text B: {text_b}
-    Mistakes B: {json.dumps(text_b_mistakes)}
+    start_idx: Optional[int] = None
+    end_idx: Optional[int] = None
+    original_text: str = ""
+    corrected_text: str = ""
+    mistake_category: str = ""
 
-    Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable.
+class RubricEvaluation(BaseModel):
+    creativity: int = Field(ge=1, le=12)
+    depth: int = Field(ge=1, le=12)
+    coherence: int = Field(ge=1, le=5)
+    grammar_mistakes: List[GrammarMistake] = []
+
+class RubricComparison(BaseModel):
+    creativity: Literal["A", "B", "DRAW"]
+    depth: Literal["A", "B", "DRAW"]
+    coherence: Literal["A", "B", "DRAW"]
+    grammar: Literal["A", "B", "DRAW"]
+
+def _load_json_object(response):
+    cleaned_response = response.strip().strip('```json').strip('```').strip()
+    start, end = cleaned_response.find('{'), cleaned_response.rfind('}')
+    if start == -1 or end < start:
+        raise json.JSONDecodeError("No JSON object found", cleaned_response, 0)
+    return json.loads(cleaned_response[start:end + 1])
+
+def parse_rubric_evaluation(response):
+    """
+    Validate a combined evaluation response. Returns None when it can't be used,
+    so the caller can fall back to per-dimension calls.
+    """
+    try:
+        return RubricEvaluation.model_validate(_load_json_object(response))
+    except (json.JSONDecodeError, ValidationError) as e:
+        logger.warning(f"Invalid combined evaluation: {e}")
+        return None
+
+def parse_rubric_comparison(response):
+    try:
+        data = _load_json_object(response)
+        if isinstance(data, dict):
+            data = {key: str(value).strip().upper() for key, value in data.items()}
+        return RubricComparison.model_validate(data)
+    except (json.JSONDecodeError, ValidationError) as e:
+        logger.warning(f"Invalid combined comparison: {e}")
+        return None
+
+def evaluate_all_dimensions_prompt(text):
+    return EVALUATE_ALL_DIMENSIONS.render(text=text)
+
+async def chatgpt_evaluate_all_dimensions(text):
+    """
+    One call for creativity, depth, coherence and grammar. Returns a RubricEvaluation, or None if unparseable.
+    """
+    prompt = evaluate_all_dimensions_prompt(text)
+    response = await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="evaluate_all_dimensions")
+    return parse_rubric_evaluation(response)
+
+def compare_all_dimensions_prompt(text_a, text_a_mistakes, text_b, text_b_mistakes):
+    return COMPARE_ALL_DIMENSIONS.render(text_a=text_a, mistakes_a=format_mistakes(text_a_mistakes),
+                                         text_b=text_b, mistakes_b=format_mistakes(text_b_mistakes))
+
+async def chatgpt_compare_all_dimensions(text_a, text_a_mistakes, text_b, text_b_mistakes):
+    """
+    One call comparing all four dimensions. Returns a RubricComparison, or None if unparseable.
     """
-    return await async_openai_call(prompt)
+    prompt = compare_all_dimensions_prompt(text_a, text_a_mistakes, text_b, text_b_mistakes)
+    response = await async_openai_call(prompt, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_all_dimensions")
+    return parse_rubric_comparison(response)
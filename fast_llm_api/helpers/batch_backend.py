@@ -0,0 +1,273 @@
+import os
+import json
+import uuid
+import hashlib
+import asyncio
+import aiohttp
+import openai
+import logging
+from typing import Dict, List, Optional, Sequence, Union
+from fast_llm_api.config import OPENAI_API_BASE, LLM_BATCH_BACKEND, LLM_BATCH_REPLAY_PATH, LLM_BATCH_WORK_DIR, LLM_BATCH_POLL_INTERVAL, LLM_BATCH_MAX_WAIT
+from fast_llm_api.helpers.http_session import get_http_session
+from fast_llm_api.helpers.llm_cache import llm_cache, make_cache_key
+from fast_llm_api.helpers.retry_policy import RetryPolicy, LLMRequestError, is_retryable_exception, is_retryable_status, parse_retry_after
+from fast_llm_api.helpers.job_context import current_batch_ledger
+from fast_llm_api.helpers.async_llm_helpers import OPENAI_MODEL, SYSTEM_PROMPT, MAX_TOKENS, async_openai_call
+from fast_llm_api.helpers.telemetry import telemetry
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS_PER_BATCH = 50000  # provider limit per input file
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def build_batch_line(custom_id, prompt, system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS):
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {
+            "model": OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens
+        }
+    }
+
+
+def write_batch_file(lines, work_dir=None):
+    work_dir = work_dir or LLM_BATCH_WORK_DIR
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, f"batch-{uuid.uuid4()}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+
+def extract_content(output_line):
+    """
+    Pull the completion text out of one batch output line, or None if that request failed.
+    """
+    response = output_line.get("response") or {}
+    if response.get("status_code") != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"].strip()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+class OpenAIBatchBackend:
+    """
+    Runs a JSONL request file through the OpenAI Batch API: upload, create,
+    poll until terminal, then stream the output file back line by line.
+
+    Polls and the download are retried like realtime calls, since one dropped
+    connection during a wait of up to a day should not lose the batch. The
+    batch id is recorded in the job's batch ledger (its checkpoint) as soon as
+    the batch exists, so a resumed job polls it instead of paying for a second
+    one; a job that gives up on a batch cancels it.
+    """
+
+    def __init__(self, api_base: str = OPENAI_API_BASE, poll_interval: float = LLM_BATCH_POLL_INTERVAL,
+                 max_wait: float = LLM_BATCH_MAX_WAIT):
+        self.api_base = api_base
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+
+    @property
+    def _headers(self):
+        return {"Authorization": f"Bearer {openai.api_key}"}
+
+    async def _request_json(self, method, path, **kwargs):
+        session = get_http_session()
+        async with session.request(method, f"{self.api_base}{path}", headers=self._headers, **kwargs) as response:
+            try:
+                result = await response.json(content_type=None)
+            except (json.JSONDecodeError, aiohttp.ContentTypeError):
+                result = None
+            if response.status >= 400 or not isinstance(result, dict):
+                raise LLMRequestError(f"Batch API {method} {path} failed: HTTP {response.status}: {result}", status=response.status,
+                                      retryable=response.status < 400 or is_retryable_status(response.status),
+                                      retry_after=parse_retry_after(response.headers))
+            return result
+
+    async def _with_retries(self, operation, *args):
+        policy = RetryPolicy()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.deadline
+        delay = policy.base_delay
+        for attempt in range(policy.max_attempts):
+            try:
+                return await operation(*args)
+            except Exception as e:
+                if not is_retryable_exception(e) or attempt + 1 >= policy.max_attempts:
+                    raise
+                delay = policy.next_delay(delay, getattr(e, 'retry_after', None), deadline - loop.time())
+                if loop.time() + delay >= deadline:
+                    raise
+                logger.warning(f"Retryable batch API error ({e!r}). Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+
+    async def _upload(self, path):
+        form = aiohttp.FormData()
+        form.add_field("purpose", "batch")
+        with open(path, "rb") as f:
+            form.add_field("file", f.read(), filename=os.path.basename(path), content_type="application/jsonl")
+        result = await self._request_json("POST", "/files", data=form)
+        return result["id"]
+
+    async def _wait(self, batch_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while True:
+            batch = await self._with_retries(self._request_json, "GET", f"/batches/{batch_id}")
+            if batch["status"] in TERMINAL_STATUSES:
+                return batch
+            if loop.time() >= deadline:
+                raise LLMRequestError(f"Batch {batch_id} did not finish within {self.max_wait}s")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _cancel(self, batch_id):
+        try:
+            await self._request_json("POST", f"/batches/{batch_id}/cancel")
+        except Exception as e:
+            logger.warning(f"Could not cancel batch {batch_id}: {e!r}")
+
+    async def _download(self, file_id, results):
+        session = get_http_session()
+        async with session.get(f"{self.api_base}/files/{file_id}/content", headers=self._headers) as response:
+            if response.status >= 400:
+                raise LLMRequestError(f"Batch output download failed: HTTP {response.status}", status=response.status,
+                                      retryable=is_retryable_status(response.status), retry_after=parse_retry_after(response.headers))
+            async for raw_line in response.content:
+                raw_line = raw_line.strip()
+                if raw_line:
+                    line = json.loads(raw_line)
+                    results[line["custom_id"]] = line
+
+    async def _submit(self, path):
+        input_file_id = await self._upload(path)
+        batch = await self._request_json("POST", "/batches", json={
+            "input_file_id": input_file_id,
+            "endpoint": BATCH_ENDPOINT,
+            "completion_window": "24h",
+        })
+        return batch["id"]
+
+    async def run(self, path, batch_key: Optional[str] = None) -> Dict[str, dict]:
+        ledger = current_batch_ledger.get() if batch_key else None
+        batch_id = ledger.batch_id(batch_key) if ledger else None
+        if batch_id is None:
+            batch_id = await self._submit(path)
+            if ledger:
+                await ledger.record_batch(batch_key, batch_id)
+        else:
+            logger.info(f"Collecting batch {batch_id} submitted before the job was resumed.")
+        try:
+            batch = await self._wait(batch_id)
+            results: Dict[str, dict] = {}
+            for file_key in ("output_file_id", "error_file_id"):
+                if batch.get(file_key):
+                    # A retried download starts over; lines are keyed by custom id, so repeats overwrite
+                    await self._with_retries(self._download, batch[file_key], results)
+        except Exception:
+            # The job gives up on this batch; don't leave it running (and billing) untracked
+            await self._cancel(batch_id)
+            if ledger:
+                await ledger.forget_batch(batch_key)
+            raise
+        if ledger:
+            await ledger.forget_batch(batch_key)
+        return results
+
+
+class ReplayBatchBackend:
+    """
+    Local stand-in for the Batch API: answers a request file from a JSONL file
+    of batch output lines. Custom ids are content hashes, so a replay file
+    recorded for one run answers any later run with the same prompts.
+    """
+
+    def __init__(self, replay_path: str = LLM_BATCH_REPLAY_PATH):
+        if not replay_path:
+            raise ValueError("LLM_BATCH_BACKEND=replay needs LLM_BATCH_REPLAY_PATH set to a JSONL file of batch output lines")
+        self.replay_path = replay_path
+
+    async def run(self, path, batch_key: Optional[str] = None) -> Dict[str, dict]:
+        with open(path, encoding="utf-8") as f:
+            requested = {json.loads(line)["custom_id"] for line in f if line.strip()}
+        results: Dict[str, dict] = {}
+        with open(self.replay_path, encoding="utf-8") as f:
+            for raw_line in f:
+                if raw_line.strip():
+                    line = json.loads(raw_line)
+                    if line.get("custom_id") in requested:
+                        results[line["custom_id"]] = line
+        return results
+
+
+def get_batch_backend():
+    if LLM_BATCH_BACKEND == "replay":
+        return ReplayBatchBackend()
+    return OpenAIBatchBackend()
+
+
+async def run_prompts_in_batch(prompts: List[str], system_prompt=SYSTEM_PROMPT, max_tokens=MAX_TOKENS,
+                               backend: Optional[object] = None, prompt_type: Union[str, Sequence[str]] = "other") -> List[str]:
+    """
+    Answer a list of prompts through the batch backend, in order. Cached and
+    duplicate prompts are not resubmitted; requests the batch could not answer
+    fall back to the realtime path. `prompt_type` labels telemetry, either one
+    type for all prompts or one per prompt.
+    """
+    backend = backend or get_batch_backend()
+    prompt_types = [prompt_type] * len(prompts) if isinstance(prompt_type, str) else list(prompt_type)
+    keys = [make_cache_key(OPENAI_MODEL, system_prompt, prompt, max_tokens) for prompt in prompts]
+    answers: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    types: Dict[str, str] = {}
+    for key, prompt, key_type in zip(keys, prompts, prompt_types):
+        if key in answers or key in pending:
+            continue
+        types[key] = key_type
+        cached = await llm_cache.get(key)
+        if cached is not None:
+            answers[key] = cached
+            telemetry.record_cache_hit(key_type)
+        else:
+            pending[key] = prompt
+
+    pending_items = list(pending.items())
+    chunks = [pending_items[i:i + MAX_REQUESTS_PER_BATCH] for i in range(0, len(pending_items), MAX_REQUESTS_PER_BATCH)]
+
+    async def run_chunk(chunk):
+        lines = [build_batch_line(key, prompt, system_prompt, max_tokens) for key, prompt in chunk]
+        path = await asyncio.to_thread(write_batch_file, lines)
+        # Custom ids are content hashes, so the same requests get the same key again on resume
+        batch_key = hashlib.blake2b("".join(key for key, _ in chunk).encode(), digest_size=16).hexdigest()
+        try:
+            return await backend.run(path, batch_key)
+        finally:
+            os.remove(path)
+
+    for outputs in await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)):
+        for key, line in outputs.items():
+            content = extract_content(line)
+            if content is not None and key in pending:
+                answers[key] = content
+                telemetry.record_batch_result(types[key], ((line.get("response") or {}).get("body") or {}).get("usage"))
+                await llm_cache.set(key, content)
+
+    failed = [key for key in pending if key not in answers]
+    if failed:
+        logger.warning(f"Batch left {len(failed)} requests unanswered. Falling back to realtime calls...")
+        contents = await asyncio.gather(*(async_openai_call(pending[key], system_prompt=system_prompt, max_tokens=max_tokens, prompt_type=types[key])
+                                         for key in failed))
+        answers.update(zip(failed, contents))
+
+    return [answers[key] for key in keys]
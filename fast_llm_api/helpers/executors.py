@@ -0,0 +1,127 @@
+import asyncio
+import functools
+import contextvars
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from scipy import sparse
+from fast_llm_api.config import ANALYSIS_PROCESS_WORKERS, ANALYSIS_THREAD_WORKERS
+
+# Pools are created on first use and shut down by the app lifespan
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+def process_pool_enabled() -> bool:
+    return ANALYSIS_PROCESS_WORKERS > 0
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        # spawn rather than fork: the parent runs an event loop and helper threads
+        _process_pool = ProcessPoolExecutor(max_workers=ANALYSIS_PROCESS_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=ANALYSIS_THREAD_WORKERS, thread_name_prefix="analysis")
+    return _thread_pool
+
+
+async def run_in_process(fn, *args, **kwargs):
+    """
+    Run a picklable module-level function in the process pool, or in the thread
+    pool when ANALYSIS_PROCESS_WORKERS is 0.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool() if process_pool_enabled() else get_thread_pool()
+    return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+
+
+async def run_in_thread(fn, *args, **kwargs):
+    """
+    Run lighter blocking work in the thread pool, keeping the job's context
+    (current_job_id) like asyncio.to_thread does.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_thread_pool(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+def shutdown_executors():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True, cancel_futures=True)
+    _process_pool = None
+    _thread_pool = None
+
+
+class SharedArray(NamedTuple):
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+def share_array(array: np.ndarray) -> Tuple[SharedArray, shared_memory.SharedMemory]:
+    """
+    Copy an array into a new shared memory block. The caller owns the block and
+    must close and unlink it (see release_shared).
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return SharedArray(block.name, array.shape, array.dtype.str), block
+
+
+def attach_array(descriptor: SharedArray) -> Tuple[np.ndarray, shared_memory.SharedMemory]:
+    """
+    Map a shared array created by another process without copying it. Keep the
+    returned block referenced while the array is in use.
+    """
+    # Spawned pool workers share the parent's resource tracker, so attaching here
+    # does not make the block vanish when the worker exits
+    block = shared_memory.SharedMemory(name=descriptor.name)
+    return np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=block.buf), block
+
+
+def share_csr(matrix) -> Tuple[Dict, List[shared_memory.SharedMemory]]:
+    matrix = sparse.csr_matrix(matrix)
+    descriptor, blocks = {'shape': matrix.shape}, []
+    for name in ('data', 'indices', 'indptr'):
+        descriptor[name], block = share_array(getattr(matrix, name))
+        blocks.append(block)
+    return descriptor, blocks
+
+
+def attach_csr(descriptor: Dict) -> Tuple[sparse.csr_matrix, List[shared_memory.SharedMemory]]:
+    arrays, blocks = {}, []
+    for name in ('data', 'indices', 'indptr'):
+        arrays[name], block = attach_array(descriptor[name])
+        blocks.append(block)
+    matrix = sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=descriptor['shape'], copy=False)
+    return matrix, blocks
+
+
+def release_shared(blocks: List[shared_memory.SharedMemory], unlink: bool = False):
+    for block in blocks:
+        block.close()
+        if unlink:
+            block.unlink()
+
+
+def unlink_shared(descriptor: Dict):
+    """
+    Free the blocks of a shared CSR descriptor created in another process.
+    """
+    for name in ('data', 'indices', 'indptr'):
+        block = shared_memory.SharedMemory(name=descriptor[name].name)
+        block.close()
+        block.unlink()
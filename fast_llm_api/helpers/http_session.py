@@ -0,0 +1,67 @@
+import asyncio
+import aiohttp
+from typing import Optional
+from fast_llm_api.config import HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_KEEPALIVE_TIMEOUT, HTTP_REQUEST_TIMEOUT
+
+# One keep-alive session for the whole app, opened by the FastAPI lifespan hook
+_session: Optional[aiohttp.ClientSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _build_session():
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=300,
+    )
+    timeout = aiohttp.ClientTimeout(total=HTTP_REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def open_http_session():
+    """
+    Create the shared session. Called once from the app lifespan.
+    """
+    global _session, _session_loop
+    if _session is None or _session.closed:
+        _session = _build_session()
+        _session_loop = asyncio.get_running_loop()
+    return _session
+
+
+async def close_http_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+def get_http_session():
+    """
+    Return the shared session, creating it lazily when the helpers are used
+    outside the app (scripts, tests) or from a different event loop.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        _release_session(_session, _session_loop)
+        _session = _build_session()
+        _session_loop = loop
+    return _session
+
+
+def _release_session(session, loop):
+    """
+    Let go of a session made on another event loop. It can only be closed on its
+    own loop, so the close is handed to that loop while it still runs. Once that
+    loop has stopped nothing can await the close any more, so the session is
+    detached from its connector instead and reads as closed.
+    """
+    if session is None or session.closed:
+        return
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(session.close(), loop)
+    else:
+        session.detach()
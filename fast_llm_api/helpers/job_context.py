@@ -0,0 +1,11 @@
+from contextvars import ContextVar
+from typing import Any, Optional
+
+# Id of the job the current task is working for; set by the job executor and
+# inherited by every task the job spawns (asyncio.gather copies the context)
+current_job_id: ContextVar[Optional[str]] = ContextVar("current_job_id", default=None)
+
+# Where the current job records the provider batches it has in flight (its
+# JobCheckpoint for content-rank jobs), so a resumed job collects a batch it
+# already paid for instead of submitting it again
+current_batch_ledger: ContextVar[Optional[Any]] = ContextVar("current_batch_ledger", default=None)
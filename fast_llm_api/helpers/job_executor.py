@@ -0,0 +1,102 @@
+import asyncio
+import itertools
+import logging
+from typing import Dict, Optional, Tuple
+from fast_llm_api.config import JOB_MAX_CONCURRENT, JOB_MAX_QUEUE, JOB_INTERACTIVE_SIZE
+from fast_llm_api.helpers.job_context import current_job_id
+from fast_llm_api.helpers.profiling import job_profiler
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE_PRIORITY = 0
+BULK_PRIORITY = 10
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def default_priority(num_texts):
+    """
+    Lower runs first: small interactive jobs jump ahead of large bulk jobs.
+    """
+    return INTERACTIVE_PRIORITY if num_texts <= JOB_INTERACTIVE_SIZE else BULK_PRIORITY
+
+
+class JobExecutor:
+    """
+    Runs submitted jobs from a bounded priority queue on a fixed number of
+    worker tasks, so a burst of large jobs can't take over the event loop
+    that also serves HTTP. Equal priorities run in submission order.
+    """
+
+    def __init__(self, max_concurrent_jobs: int = JOB_MAX_CONCURRENT, max_queue_size: int = JOB_MAX_QUEUE):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.max_queue_size = max_queue_size
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._sequence = itertools.count()
+        self._waiting: Dict[str, Tuple[int, int]] = {}
+        self.running = 0
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrent_jobs)]
+
+    async def start(self):
+        self._ensure_started()
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._waiting.clear()
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+    def is_full(self):
+        return len(self._waiting) >= self.max_queue_size
+
+    def submit(self, job_id, job_fn, *args, priority: int = INTERACTIVE_PRIORITY):
+        """
+        Queue `job_fn(*args)` and return its 1-based position in the queue.
+        Raises QueueFullError when the queue is at capacity.
+        """
+        if self.is_full():
+            raise QueueFullError(f"Job queue is full ({self.max_queue_size} waiting)")
+        self._ensure_started()
+        key = (priority, next(self._sequence))
+        self._waiting[job_id] = key
+        self._queue.put_nowait((key, job_id, job_fn, args))
+        return self.queue_position(job_id)
+
+    def queue_position(self, job_id):
+        key = self._waiting.get(job_id)
+        if key is None:
+            return None
+        return 1 + sum(1 for other in self._waiting.values() if other < key)
+
+    async def _worker(self):
+        while True:
+            _, job_id, job_fn, args = await self._queue.get()
+            self._waiting.pop(job_id, None)
+            self.running += 1
+            token = current_job_id.set(job_id)
+            try:
+                with job_profiler.job(job_id):
+                    await job_fn(*args)
+            except Exception as e:
+                # Jobs record their own failures; this only keeps the worker alive
+                logger.error(f"Job {job_id} raised outside its handler: {e}", exc_info=True)
+            finally:
+                current_job_id.reset(token)
+                self.running -= 1
+                self._queue.task_done()
+
+
+job_executor = JobExecutor()
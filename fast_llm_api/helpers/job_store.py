@@ -0,0 +1,294 @@
+import os
+import copy
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+from fastapi.encoders import jsonable_encoder
+from fast_llm_api.config import JOB_STORE_BACKEND, JOB_STORE_PATH, JOB_TTL_SECONDS
+
+# Allowed status changes; a running job may go back to queued when it is resumed elsewhere
+STATUS_TRANSITIONS = {
+    'queued': {'running', 'failed'},
+    'running': {'completed', 'failed', 'queued'},
+    'completed': set(),
+    'failed': {'queued'},
+}
+FINISHED_STATUSES = {'completed', 'failed'}
+EVICTION_INTERVAL_SECONDS = 60
+RESULT_CACHE_SIZE = 4  # decoded results of completed jobs kept for paging
+
+
+class InvalidStatusTransition(ValueError):
+    pass
+
+
+def check_transition(job_id, current, new):
+    if new != current and new not in STATUS_TRANSITIONS.get(current, set()):
+        raise InvalidStatusTransition(f"Job {job_id} cannot go from '{current}' to '{new}'")
+
+
+class JobStore(ABC):
+    """
+    Job records keyed by job_id. A record is a dict with status, result,
+    created_at, start_time and end_time; any other keyword passed to create or
+    update is kept alongside. Finished jobs are evicted after `ttl` seconds.
+    """
+
+    # Backends doing disk I/O run the async variants in a worker thread, like the LLM cache's disk tier
+    blocking = False
+
+    def __init__(self, ttl: float = JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._last_eviction = 0.0
+
+    @abstractmethod
+    def create(self, job_id, **fields):
+        ...
+
+    @abstractmethod
+    def get(self, job_id, with_result: bool = True) -> Optional[Dict]:
+        ...
+
+    @abstractmethod
+    def update(self, job_id, **fields):
+        ...
+
+    @abstractmethod
+    def list_jobs(self, status: Optional[str] = None, created_after: Optional[datetime] = None,
+                  limit: Optional[int] = None) -> Dict[str, Dict]:
+        ...
+
+    @abstractmethod
+    def evict_expired(self, now: Optional[float] = None) -> int:
+        ...
+
+    async def _call(self, method, *args, **kwargs):
+        if self.blocking:
+            return await asyncio.to_thread(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    # What async routes and job workers use, so a large result write never stalls the event loop
+    async def acreate(self, job_id, **fields):
+        return await self._call(self.create, job_id, **fields)
+
+    async def aget(self, job_id, with_result: bool = True) -> Optional[Dict]:
+        return await self._call(self.get, job_id, with_result)
+
+    async def aupdate(self, job_id, **fields):
+        return await self._call(self.update, job_id, **fields)
+
+    async def alist_jobs(self, status: Optional[str] = None, created_after: Optional[datetime] = None,
+                         limit: Optional[int] = None) -> Dict[str, Dict]:
+        return await self._call(self.list_jobs, status, created_after, limit)
+
+    def _maybe_evict(self):
+        now = time.time()
+        if now - self._last_eviction >= EVICTION_INTERVAL_SECONDS:
+            self._last_eviction = now
+            self.evict_expired(now)
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self, ttl: float = JOB_TTL_SECONDS):
+        super().__init__(ttl)
+        self._jobs: Dict[str, Dict] = {}
+
+    def create(self, job_id, **fields):
+        self._maybe_evict()
+        job = {'status': 'queued', 'result': None, 'created_at': datetime.now(), 'start_time': None, 'end_time': None}
+        job.update(fields)
+        self._jobs[job_id] = job
+        return job
+
+    def get(self, job_id, with_result=True):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job = copy.copy(job)
+        if not with_result:
+            job.pop('result', None)
+        return job
+
+    def update(self, job_id, **fields):
+        job = self._jobs[job_id]
+        if 'status' in fields:
+            check_transition(job_id, job['status'], fields['status'])
+        job.update(fields)
+        return job
+
+    def list_jobs(self, status=None, created_after=None, limit=None):
+        jobs = [(job_id, job) for job_id, job in self._jobs.items()
+                if (status is None or job['status'] == status)
+                and (created_after is None or job['created_at'] > created_after)]
+        jobs.sort(key=lambda item: item[1]['created_at'])
+        if limit is not None:
+            jobs = jobs[:limit]
+        return {job_id: copy.copy(job) for job_id, job in jobs}
+
+    def evict_expired(self, now=None):
+        cutoff = datetime.fromtimestamp((now or time.time()) - self.ttl)
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job['status'] in FINISHED_STATUSES and job['end_time'] is not None and job['end_time'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+
+class SqliteJobStore(JobStore):
+    """
+    SQLite (WAL) backed store, so several uvicorn workers can share job state.
+    Results are stored as JSON blobs; status and creation time are indexed.
+    """
+
+    COLUMNS = ('status', 'result', 'created_at', 'start_time', 'end_time')
+    blocking = True
+    TIME_COLUMNS = ('created_at', 'start_time', 'end_time')
+
+    def __init__(self, kind: str, path: str = JOB_STORE_PATH, ttl: float = JOB_TTL_SECONDS):
+        super().__init__(ttl)
+        self.kind = kind
+        self.path = path
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # job_id -> decoded result; completed results never change
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, "
+            "start_time REAL, end_time REAL, result TEXT, extra TEXT NOT NULL DEFAULT '{}')"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_status ON jobs (kind, status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_kind_created ON jobs (kind, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_end_time ON jobs (status, end_time)")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_epoch(value):
+        return value.timestamp() if isinstance(value, datetime) else value
+
+    @staticmethod
+    def _from_epoch(value):
+        return datetime.fromtimestamp(value) if value is not None else None
+
+    def _row_to_job(self, row, with_result=True):
+        status, created_at, start_time, end_time, result, extra = row
+        job = json.loads(extra)
+        job.update({
+            'status': status,
+            'created_at': self._from_epoch(created_at),
+            'start_time': self._from_epoch(start_time),
+            'end_time': self._from_epoch(end_time),
+        })
+        if with_result:
+            job['result'] = json.loads(result) if result is not None else None
+        return job
+
+    def _split_fields(self, fields):
+        columns, extra = {}, {}
+        for key, value in fields.items():
+            if key in self.TIME_COLUMNS:
+                columns[key] = self._to_epoch(value)
+            elif key == 'result':
+                columns[key] = json.dumps(jsonable_encoder(value), ensure_ascii=False) if value is not None else None
+            elif key == 'status':
+                columns[key] = value
+            else:
+                extra[key] = jsonable_encoder(value)
+        return columns, extra
+
+    def create(self, job_id, **fields):
+        self._maybe_evict()
+        fields = {'status': 'queued', 'result': None, 'created_at': datetime.now(), 'start_time': None, 'end_time': None, **fields}
+        columns, extra = self._split_fields(fields)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, status, created_at, start_time, end_time, result, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, self.kind, columns['status'], columns['created_at'], columns['start_time'],
+                 columns['end_time'], columns['result'], json.dumps(extra, ensure_ascii=False)),
+            )
+            self._conn.commit()
+        return fields
+
+    def get(self, job_id, with_result=True):
+        with self._lock:
+            cached = self._results.get(job_id) if with_result else None
+            load_result = with_result and cached is None
+            row = self._conn.execute(
+                f"SELECT status, created_at, start_time, end_time, {'result' if load_result else 'NULL'}, extra FROM jobs WHERE job_id = ? AND kind = ?",
+                (job_id, self.kind),
+            ).fetchone()
+            if cached is not None:
+                self._results.move_to_end(job_id)
+        if row is None:
+            return None
+        job = self._row_to_job(row, with_result=load_result)
+        if cached is not None:
+            job['result'] = cached
+        elif load_result and job['status'] == 'completed':
+            # Paging through a large result should not decode the whole blob on every request
+            with self._lock:
+                self._results[job_id] = job['result']
+                if len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        return job
+
+    def update(self, job_id, **fields):
+        columns, extra = self._split_fields(fields)
+        with self._lock:
+            row = self._conn.execute("SELECT status, extra FROM jobs WHERE job_id = ? AND kind = ?", (job_id, self.kind)).fetchone()
+            if row is None:
+                raise KeyError(job_id)
+            if 'status' in columns:
+                check_transition(job_id, row[0], columns['status'])
+            if extra:
+                columns['extra'] = json.dumps({**json.loads(row[1]), **extra}, ensure_ascii=False)
+            if columns:
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                self._conn.execute(f"UPDATE jobs SET {assignments} WHERE job_id = ? AND kind = ?",
+                                   (*columns.values(), job_id, self.kind))
+                self._conn.commit()
+
+    def list_jobs(self, status=None, created_after=None, limit=None):
+        query = "SELECT job_id, status, created_at, start_time, end_time, NULL, extra FROM jobs WHERE kind = ?"
+        params = [self.kind]
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if created_after is not None:
+            query += " AND created_at > ?"
+            params.append(self._to_epoch(created_after))
+        query += " ORDER BY created_at"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        # Listings skip the result blobs; fetch a single job to get its result
+        return {row[0]: self._row_to_job(row[1:], with_result=False) for row in rows}
+
+    def evict_expired(self, now=None):
+        cutoff = (now or time.time()) - self.ttl
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE kind = ? AND status IN ('completed', 'failed') AND end_time < ?",
+                (self.kind, cutoff),
+            )
+            self._conn.commit()
+            self._results.clear()
+        return cursor.rowcount
+
+
+def get_job_store(kind: str) -> JobStore:
+    if JOB_STORE_BACKEND == "sqlite":
+        return SqliteJobStore(kind)
+    return InMemoryJobStore()
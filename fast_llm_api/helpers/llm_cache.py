@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+from fast_llm_api.config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_DISK_ENTRIES
+
+# Run disk eviction once every this many writes rather than on every insert
+EVICTION_INTERVAL = 200
+
+
+def make_cache_key(model, system_prompt, prompt, max_tokens):
+    raw = json.dumps([model, system_prompt, prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier response cache: an in-memory LRU in front of a SQLite table.
+    Both tiers expire entries after `ttl` seconds; the disk tier is trimmed
+    to `disk_entries` rows by least recent access.
+    """
+
+    def __init__(self, path: Optional[str] = LLM_CACHE_PATH, ttl: float = LLM_CACHE_TTL_SECONDS,
+                 memory_entries: int = LLM_CACHE_MEMORY_ENTRIES, disk_entries: int = LLM_CACHE_DISK_ENTRIES,
+                 enabled: bool = LLM_CACHE_ENABLED):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.enabled = enabled
+        self._memory: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+    # --- memory tier ---
+
+    def _memory_get(self, key, now):
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _memory_set(self, key, value, expires_at):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # --- disk tier ---
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _disk_get(self, key, now):
+        with self._db_lock:
+            conn = self._connection()
+            row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return value, expires_at
+
+    def _disk_set(self, key, value, expires_at, now):
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= EVICTION_INTERVAL:
+                self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now):
+        self._writes_since_eviction = 0
+        conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        if count > self.disk_entries:
+            conn.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.disk_entries,),
+            )
+
+    # --- public API ---
+
+    async def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            self.hits += 1
+            self.memory_hits += 1
+            return value
+        if self.path:
+            row = await asyncio.to_thread(self._disk_get, key, now)
+            if row is not None:
+                value, expires_at = row
+                self._memory_set(key, value, expires_at)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        expires_at = now + self.ttl
+        self._memory_set(key, value, expires_at)
+        if self.path:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at, now)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+        }
+
+    def close(self):
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+llm_cache = LLMResponseCache()
@@ -0,0 +1,311 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import numpy as np
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from fast_llm_api.helpers.job_context import current_job_id
+from fast_llm_api.config import (PROFILING_ENABLED, PROFILE_ALL_JOBS, PROFILE_SAMPLE_INTERVAL, PROFILE_DIR,
+                                 LOOP_LAG_INTERVAL, LOOP_LAG_WARN_SECONDS, TELEMETRY_MAX_JOBS)
+
+logger = logging.getLogger(__name__)
+
+MAX_PHASE_EVENTS = 2000  # per job; totals keep counting past it
+MAX_LAG_SPIKES = 100
+LAG_WINDOW = 10000
+MAX_STACK_DEPTH = 64
+TOP_ENTRIES = 20
+
+# Innermost frames of threads that are only waiting; counted as idle rather than as stacks
+IDLE_FRAMES = {("selectors", "select"), ("threading", "wait"), ("queue", "get"),
+               ("concurrent.futures.thread", "_worker"), ("concurrent.futures.process", "_wait_for_notification")}
+
+
+class JobPhases:
+    """
+    Wall time of the named phases of one job: totals per phase plus a capped
+    timeline of individual phase runs.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.totals: Dict[str, Dict] = defaultdict(lambda: {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+        self.events: List[Dict] = []
+
+    def add(self, name, start, duration, labels):
+        total = self.totals[name]
+        total["count"] += 1
+        total["seconds"] += duration
+        total["max_seconds"] = max(total["max_seconds"], duration)
+        if len(self.events) < MAX_PHASE_EVENTS:
+            self.events.append({"phase": name, "start": round(start - self.started, 4), "seconds": round(duration, 4), **labels})
+
+    def summary(self) -> Dict:
+        totals = {name: {"count": total["count"], "seconds": round(total["seconds"], 4), "max_seconds": round(total["max_seconds"], 4)}
+                  for name, total in sorted(self.totals.items(), key=lambda item: -item[1]["seconds"])}
+        return {"totals": totals, "timeline": self.events}
+
+
+class PhaseRecorder:
+    """
+    Times phases of the job the current task belongs to, and knows which phases
+    are running right now so event-loop lag can be attributed to them.
+    """
+
+    def __init__(self, max_jobs: int = TELEMETRY_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, JobPhases]" = OrderedDict()
+        self._active: Dict[int, str] = {}
+        self._next_key = 0
+
+    @contextmanager
+    def phase(self, name: str, **labels):
+        job_id = current_job_id.get()
+        key = self._next_key
+        self._next_key += 1
+        self._active[key] = f"{job_id}:{name}" if job_id else name
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            del self._active[key]
+            if job_id is not None:
+                self._job(job_id).add(name, start, duration, labels)
+
+    def _job(self, job_id) -> JobPhases:
+        phases = self._jobs.get(job_id)
+        if phases is None:
+            phases = self._jobs[job_id] = JobPhases()
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return phases
+
+    def active_phases(self) -> List[str]:
+        return sorted(set(self._active.values()))
+
+    def job_summary(self, job_id) -> Optional[Dict]:
+        phases = self._jobs.get(job_id)
+        return phases.summary() if phases is not None else None
+
+
+phase_recorder = PhaseRecorder()
+phase_timer = phase_recorder.phase
+
+
+class LoopLagMonitor:
+    """
+    Measures how late a periodic timer fires on the event loop. The overshoot is
+    time the loop spent running something else, i.e. blocking work; spikes above
+    `warn_after` are logged with the phases that were running at the time.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn_after: float = LOOP_LAG_WARN_SECONDS):
+        self.interval = interval
+        self.warn_after = warn_after
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.max_lag = 0.0
+        self.spikes = deque(maxlen=MAX_LAG_SPIKES)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.warn_after:
+                phases = phase_recorder.active_phases()
+                self.spikes.append({"at": time.time(), "lag_seconds": round(lag, 4), "active_phases": phases})
+                logger.warning(f"Event loop blocked for {lag:.3f}s; active phases: {', '.join(phases) or 'none'}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(np.fromiter(self.lags, dtype=float), q)) if self.lags else 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "running": self.running,
+            "samples": len(self.lags),
+            "p50_seconds": round(self.percentile(50), 4),
+            "p99_seconds": round(self.percentile(99), 4),
+            "max_seconds": round(self.max_lag, 4),
+            "spikes": list(self.spikes),
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
+
+
+def _frame_label(frame):
+    return frame.f_globals.get("__name__", "?"), frame.f_code.co_name
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread from a background thread. Stacks
+    are kept in folded form ("thread;outer;...;inner count"), which flame graph
+    tools such as speedscope or flamegraph.pl read directly. Other jobs sharing
+    the process are sampled too, so profile one job at a time for clean results.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.idle: Counter = Counter()
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped = self.stopped or time.time()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.sample(names.get(thread_id, str(thread_id)), frame)
+            self.samples += 1
+
+    def sample(self, thread_name, frame):
+        if _frame_label(frame) in IDLE_FRAMES:
+            self.idle[thread_name] += 1
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            module, function = _frame_label(frame)
+            stack.append(f"{module}:{function}")
+            frame = frame.f_back
+        self.stacks[";".join([thread_name, *reversed(stack)])] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict:
+        inner = Counter()
+        for stack, count in self.stacks.items():
+            inner[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "samples": self.samples,
+            "interval_seconds": self.interval,
+            "started": self.started,
+            "stopped": self.stopped,
+            "idle_samples": dict(self.idle),
+            "top_functions": [{"function": name, "samples": count} for name, count in inner.most_common(TOP_ENTRIES)],
+            "top_stacks": [{"stack": stack, "samples": count} for stack, count in self.stacks.most_common(TOP_ENTRIES)],
+        }
+
+
+class JobProfiler:
+    """
+    Runs a SamplingProfiler while selected jobs run: every job with
+    PROFILE_ALL_JOBS, otherwise jobs requested by id (before or while they run).
+    Finished profiles are written to PROFILE_DIR as <job_id>.folded.
+    """
+
+    def __init__(self, directory: str = PROFILE_DIR, max_jobs: int = TELEMETRY_MAX_JOBS):
+        self.directory = directory
+        self.max_jobs = max_jobs
+        self._requested: Dict[str, Optional[float]] = {}  # job id -> sampling time limit, if any
+        self._running_jobs = set()
+        self._profiles: "OrderedDict[str, SamplingProfiler]" = OrderedDict()
+
+    def enabled(self):
+        return PROFILING_ENABLED
+
+    def request(self, job_id: str, seconds: Optional[float] = None) -> str:
+        """
+        Profile a job: now if it is running, otherwise as soon as it starts.
+        With `seconds`, the job is only sampled for that long from when sampling starts.
+        """
+        if job_id not in self._running_jobs:
+            self._requested[job_id] = seconds
+            return "scheduled"
+        profiler = self._profiles.get(job_id)
+        if profiler is None or profiler.stopped:
+            self._start(job_id, seconds)
+        elif seconds is not None:
+            asyncio.get_running_loop().call_later(seconds, self._finish, job_id)
+        return "profiling"
+
+    def _start(self, job_id, seconds: Optional[float] = None) -> SamplingProfiler:
+        profiler = self._profiles[job_id] = SamplingProfiler()
+        while len(self._profiles) > self.max_jobs:
+            self._profiles.popitem(last=False)
+        profiler.start()
+        if seconds is not None:
+            asyncio.get_running_loop().call_later(seconds, self._finish, job_id)
+        return profiler
+
+    def _finish(self, job_id):
+        profiler = self._profiles.get(job_id)
+        if profiler is None or profiler.stopped:
+            return
+        profiler.stop()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, f"{job_id}.folded"), "w", encoding="utf-8") as f:
+                f.write(profiler.folded())
+        except OSError as e:
+            logger.warning(f"Could not write the profile of job {job_id}: {e}")
+
+    @contextmanager
+    def job(self, job_id: str):
+        """
+        Wrap a job's run; samples it when profiling applies to it.
+        """
+        self._running_jobs.add(job_id)
+        if self.enabled() and (PROFILE_ALL_JOBS or job_id in self._requested):
+            self._start(job_id, self._requested.pop(job_id, None))
+        try:
+            with phase_timer("job"):
+                yield
+        finally:
+            self._running_jobs.discard(job_id)
+            self._finish(job_id)
+
+    def profile(self, job_id: str) -> Optional[SamplingProfiler]:
+        return self._profiles.get(job_id)
+
+    def state(self, job_id: str) -> str:
+        profiler = self._profiles.get(job_id)
+        if profiler is not None:
+            return "finished" if profiler.stopped else "profiling"
+        return "scheduled" if job_id in self._requested else "off"
+
+
+job_profiler = JobProfiler()
@@ -0,0 +1,115 @@
+import json
+import time
+import asyncio
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional, Set
+from fast_llm_api.helpers.job_context import current_job_id
+
+FINISHED_STATUSES = {'completed', 'failed'}
+SUBSCRIBER_QUEUE_SIZE = 256
+MAX_TRACKED_JOBS = 1000
+HEARTBEAT_SECONDS = 15
+COUNTER_PUBLISH_INTERVAL = 0.25
+
+
+class ProgressBroker:
+    """
+    In-process pub/sub of job progress events. Subscribers first receive the
+    latest event of each type, then live events until the job finishes.
+    Slow subscribers lose their oldest queued events rather than blocking the job.
+    Events are per worker process; clients stream from the worker running the job.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._latest: "OrderedDict[str, Dict[str, Dict]]" = OrderedDict()
+
+    def publish(self, job_id, event_type, **data):
+        event = {'type': event_type, 'job_id': job_id, 'timestamp': time.time(), **data}
+        latest = self._latest.setdefault(job_id, {})
+        latest[event_type] = event
+        self._latest.move_to_end(job_id)
+        while len(self._latest) > MAX_TRACKED_JOBS:
+            self._latest.popitem(last=False)
+        for queue in self._subscribers.get(job_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def latest(self, job_id):
+        return dict(self._latest.get(job_id, {}))
+
+    async def subscribe(self, job_id, heartbeat: float = HEARTBEAT_SECONDS):
+        """
+        Yield events for a job; yields None as a heartbeat when nothing happened for `heartbeat` seconds.
+        """
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[job_id].add(queue)
+        try:
+            for event in self.latest(job_id).values():
+                yield event
+            if self.latest(job_id).get('status', {}).get('status') in FINISHED_STATUSES:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+                if event['type'] == 'status' and event.get('status') in FINISHED_STATUSES:
+                    return
+        finally:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+
+progress_broker = ProgressBroker()
+
+
+def publish_progress(event_type, **data):
+    """
+    Publish an event for the job the current task belongs to (no-op outside a job).
+    """
+    job_id = current_job_id.get()
+    if job_id is not None:
+        progress_broker.publish(job_id, event_type, **data)
+
+
+class ProgressCounter:
+    """
+    Counts finished calls of one phase and publishes `done`/`total`, at most
+    every COUNTER_PUBLISH_INTERVAL seconds plus once at the end.
+    """
+
+    def __init__(self, event_type, total, **data):
+        self.event_type = event_type
+        self.total = total
+        self.done = 0
+        self.data = data
+        self._last_publish = 0.0
+        publish_progress(event_type, done=0, total=total, **data)
+
+    def advance(self, count=1):
+        self.done += count
+        now = time.monotonic()
+        if self.done >= self.total or now - self._last_publish >= COUNTER_PUBLISH_INTERVAL:
+            self._last_publish = now
+            publish_progress(self.event_type, done=self.done, total=self.total, **self.data)
+
+    async def track(self, awaitable):
+        result = await awaitable
+        self.advance()
+        return result
+
+
+async def sse_events(job_id):
+    """
+    Format a job's progress events as a Server-Sent Events stream.
+    """
+    async for event in progress_broker.subscribe(job_id):
+        if event is None:
+            yield ": keep-alive\n\n"
+        else:
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
@@ -0,0 +1,155 @@
+import json
+import textwrap
+
+# Rubric levels shared by the single-dimension and combined prompts
+CREATIVITY_LEVELS = """
+- 1-2: Student makes overly simple statements with 2-4 words per sentence.
+- 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
+- 5-6: Student uses somewhat complex adjectives and descriptors to describe otherwise generic events.
+- 7-8: Satisfies 5-6, while explaining some unique experiences with some common elements.
+- 9-10: Satisfies 7-8, but the student portrays a minimal but existing amount of original thought and perspective.
+- 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
+- 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.
+""".strip()
+
+DEPTH_LEVELS = """
+- 1-2: Student makes overly simple statements with 2-4 words per sentence.
+- 3-4: Student uses simple adjectives and descriptors to otherwise simple statements with 4-7 words per sentence.
+- 5-6: Student uses somewhat complex adjectives and descriptors to describe simple explorations and insight.
+- 7-8: Satisfies 5-6, moderate depth, with some detailed exploration and insight.
+- 9-10: Satisfies 7-8, deep exploration, insightful and well-developed ideas.
+- 11: Explains unique experiences, unique perspectives, and shows unique character traits of the writer.
+- 12: While satisfying the conditions for an 11, the reader walks away thought-provoked by the writing.
+""".strip()
+
+COHERENCE_LEVELS = """
+- 1: The reader can understand less than 20% of the information the writer meant to convey.
+- 2: The reader can understand more than 20% but less than 40% of the information the writer meant to convey.
+- 3: The reader can understand more than 40% but less than 60% of the information the writer meant to convey.
+- 4: The reader can understand more than 60% but less than 80% of the information the writer meant to convey.
+- 5: The reader has no trouble understanding what the writer meant to convey.
+""".strip()
+
+GRAMMAR_RULES = ('Do not correct punctuation or conjugations, or any of these "trivial" mistakes. The mistake_category should be a short note '
+                 'like a teacher would write when grading essays. The input text is a transcription, not an essay, so we must only pick very '
+                 'specific grammar mistakes and do not pick out syntactical, punctuational, etc the technical mistakes.')
+
+SINGLE_TEXT = "Text: {text}"
+TWO_TEXTS = "Text A: {text_a}\nText B: {text_b}"
+TWO_TEXTS_WITH_MISTAKES = "Text A: {text_a}\nMistakes A: {mistakes_a}\n\nText B: {text_b}\nMistakes B: {mistakes_b}"
+
+
+class PromptTemplate:
+    """
+    A prompt made of static instructions followed by a per-call payload. The
+    instructions are normalised once, so every prompt of a template starts with
+    the same bytes and the provider can serve that prefix from its prompt cache;
+    only the payload (the essay text) is formatted per call, and it goes last.
+    """
+
+    def __init__(self, instructions: str, payload: str):
+        self.prefix = textwrap.dedent(instructions).strip() + "\n\n"
+        self.payload = payload
+
+    def render(self, **fields) -> str:
+        return self.prefix + self.payload.format(**fields)
+
+
+def format_mistakes(mistakes) -> str:
+    # Compact JSON: the separators json.dumps uses by default only cost tokens
+    return json.dumps(mistakes, ensure_ascii=False, separators=(",", ":"))
+
+
+CREATIVITY_SCALE = "1 to 12, where 1 is very basic or unoriginal and 12 is exceptionally creative and original"
+DEPTH_SCALE = "1 to 12, where 1 is very shallow or surface-level and 12 is exceptionally deep, profound, and comprehensive"
+COHERENCE_SCALE = "1 to 5, where 1 means very hard to understand or comprehend and 5 means that the text can be understood easily"
+COHERENCE_NOTE = "We are not evaluating the depth/creativity of the writing, just how comprehensible and coherent the content is. "
+STUDENTS_NOTE = "Be mindful that these were written by elementary school students."
+
+
+def _evaluate_instructions(dimension, scale, levels, note=""):
+    return (f"Evaluate the {dimension} of the following text on a scale of {scale}. {note}{STUDENTS_NOTE} "
+            f"Provide only the number as the response. Use the following rubric:\n{levels}")
+
+
+GRAMMAR_MISTAKES_INSTRUCTIONS = (
+    "List only strict grammatical mistakes in the following text in the form of a JSON array of dictionaries with the keys: "
+    f"start_idx, end_idx, original_text, corrected_text, and mistake_category. {GRAMMAR_RULES} "
+    'Ensure the output is a valid JSON array. If there are no mistakes, return an empty array "[]".')
+
+GRAMMAR_COMPARISON_INSTRUCTIONS = (
+    "Compare the grammar skills of the following two texts and determine which one has better grammar skills. Consider the number "
+    "and types of mistakes listed for each text, as well as the overall complexity and correctness of the grammar used.\n"
+    'Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable.')
+
+ALL_DIMENSIONS_EVALUATION_INSTRUCTIONS = (
+    f"Evaluate the following text on four dimensions. {STUDENTS_NOTE}\n"
+    f"1. creativity, on a scale of {CREATIVITY_SCALE}. Use the creativity rubric above.\n"
+    f"2. depth, on a scale of {DEPTH_SCALE}. Use the depth rubric above.\n"
+    f"3. coherence, on a scale of {COHERENCE_SCALE}. {COHERENCE_NOTE}Use the coherence rubric above.\n"
+    "4. grammar_mistakes: only strict grammatical mistakes, as an array of objects with the keys: start_idx, end_idx, original_text, "
+    f"corrected_text, and mistake_category. {GRAMMAR_RULES} If there are no mistakes, use an empty array.\n"
+    'Respond with only a valid JSON object of the form {"creativity": <number>, "depth": <number>, "coherence": <number>, "grammar_mistakes": [...]}.')
+
+ALL_DIMENSIONS_COMPARISON_INSTRUCTIONS = (
+    f"Compare the following two texts on four dimensions: creativity, depth, coherence and grammar. {STUDENTS_NOTE} "
+    "Just as reference, use the creativity, depth and coherence rubrics above as an absolute measure. "
+    "For grammar, consider the number and types of mistakes listed for each text, as well as the overall complexity and correctness of the grammar used.\n"
+    'For each dimension, answer "A", "B", or "DRAW". Choose "DRAW" only if the texts are truly indistinguishable on that dimension.\n'
+    'Respond with only a valid JSON object of the form {"creativity": "A", "depth": "B", "coherence": "DRAW", "grammar": "A"}.')
+
+# System message of the rubric calls. Provider prompt caching starts at 1024
+# tokens of identical prefix and no single task's instructions are that long,
+# so the instructions of the rubric tasks are moved here word for word, each
+# rubric once; the user prompts only name the task and carry the texts.
+RUBRIC_SYSTEM_PROMPT = "\n\n".join([
+    "You are an evaluator. Each request names one of the tasks below and ends with the text or texts it is about.",
+    _evaluate_instructions("creativity", CREATIVITY_SCALE, CREATIVITY_LEVELS),
+    _evaluate_instructions("depth", DEPTH_SCALE, DEPTH_LEVELS),
+    _evaluate_instructions("coherence", COHERENCE_SCALE, COHERENCE_LEVELS, COHERENCE_NOTE),
+    GRAMMAR_MISTAKES_INSTRUCTIONS,
+    GRAMMAR_COMPARISON_INSTRUCTIONS,
+    ALL_DIMENSIONS_EVALUATION_INSTRUCTIONS,
+    ALL_DIMENSIONS_COMPARISON_INSTRUCTIONS,
+])
+
+
+def _evaluate_dimension(dimension, scale, note=""):
+    return PromptTemplate(
+        f"Evaluate the {dimension} of the following text on a scale of {scale}. {note}{STUDENTS_NOTE} "
+        f"Provide only the number as the response. Use the {dimension} rubric above.",
+        SINGLE_TEXT)
+
+
+def _compare_dimension(question, dimension):
+    return PromptTemplate(
+        f"Compare the following two texts and determine which one {question}.\n\n"
+        f"Just as reference, use the {dimension} rubric above as an absolute measure.\n\n"
+        f'Compare the following two texts and determine which one {question}.\n'
+        f'Provide "A", "B", or "DRAW" only as the response. Choose "DRAW" only if the texts are truly indistinguishable:',
+        TWO_TEXTS)
+
+
+EVALUATE_CREATIVITY = _evaluate_dimension("creativity", CREATIVITY_SCALE)
+EVALUATE_DEPTH = _evaluate_dimension("depth", DEPTH_SCALE)
+EVALUATE_COHERENCE = _evaluate_dimension("coherence", COHERENCE_SCALE, COHERENCE_NOTE)
+
+LIST_GRAMMAR_MISTAKES = PromptTemplate(
+    "List only strict grammatical mistakes in the following text, as described above.",
+    SINGLE_TEXT)
+
+COMPARE_CREATIVITY = _compare_dimension("is more creative", "creativity")
+COMPARE_DEPTH = _compare_dimension("has more depth", "depth")
+COMPARE_COHERENCE = _compare_dimension("is more coherent", "coherence")
+
+COMPARE_GRAMMAR = PromptTemplate(
+    "Compare the grammar skills of the following two texts, as described above.",
+    TWO_TEXTS_WITH_MISTAKES)
+
+EVALUATE_ALL_DIMENSIONS = PromptTemplate(
+    "Evaluate the following text on four dimensions, as described above.",
+    SINGLE_TEXT)
+
+COMPARE_ALL_DIMENSIONS = PromptTemplate(
+    "Compare the following two texts on four dimensions, as described above.",
+    TWO_TEXTS_WITH_MISTAKES)
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fast_llm_api.config import LLM_MAX_IN_FLIGHT, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE
+
+# Rough bytes-per-token ratio; UTF-8 bytes keep Korean text (3 bytes/char) from being underestimated
+BYTES_PER_TOKEN = 4
+
+
+def estimate_tokens(prompt, max_tokens=0):
+    """
+    Estimate the tokens a request counts against the provider limit: the prompt
+    plus the completion budget, which providers reserve up front.
+    """
+    return len(prompt.encode("utf-8")) // BYTES_PER_TOKEN + 1 + max_tokens
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding at most one minute of budget.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_available(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)  # oversized requests wait for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    """
+    Admits LLM requests up to the provider limits: at most `max_in_flight`
+    concurrent calls, and a requests-per-minute plus tokens-per-minute budget.
+    Waiters are admitted in FIFO order.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = LLM_TOKENS_PER_MINUTE):
+        self._semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+        self._request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self._token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self._admission_lock = asyncio.Lock()
+        self.in_flight = 0
+
+    async def _admit(self, estimated_tokens: int):
+        async with self._admission_lock:
+            while True:
+                wait = 0.0
+                if self._request_bucket is not None:
+                    wait = max(wait, self._request_bucket.time_until_available(1))
+                if self._token_bucket is not None:
+                    wait = max(wait, self._token_bucket.time_until_available(estimated_tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self._request_bucket is not None:
+                self._request_bucket.consume(1)
+            if self._token_bucket is not None:
+                self._token_bucket.consume(estimated_tokens)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int = 0):
+        """
+        Hold one in-flight slot for the duration of a single HTTP attempt.
+        """
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            await self._admit(estimated_tokens)
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_llm_scheduler():
+    """
+    Return the process-wide scheduler (one per running event loop, since its
+    semaphore and lock are bound to the loop that first waits on them).
+    """
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler = LLMScheduler()
+        _scheduler_loop = loop
+    return _scheduler
+
+
+def llm_in_flight() -> int:
+    return _scheduler.in_flight if _scheduler is not None else 0
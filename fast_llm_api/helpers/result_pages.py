@@ -0,0 +1,61 @@
+import json
+from typing import Iterable, List, Optional
+from fastapi.encoders import jsonable_encoder
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """
+    Turn a comma separated `fields=` query value into a list of field names.
+    """
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(',') if name.strip()]
+
+
+def _value(item, name):
+    if isinstance(item, dict):
+        return item.get(name)
+    return getattr(item, name, None)
+
+
+def sort_items(items, sort_by: Optional[str], descending: bool = True):
+    """
+    Sort result items by one field. Items missing the field go last either way.
+    """
+    if not sort_by:
+        return list(items)
+    present = [item for item in items if _value(item, sort_by) is not None]
+    missing = [item for item in items if _value(item, sort_by) is None]
+    present.sort(key=lambda item: _value(item, sort_by), reverse=descending)
+    return present + missing
+
+
+def project(item, fields: Optional[List[str]]):
+    """
+    Encode one result item, keeping only `fields` when given.
+    """
+    if fields is None:
+        return jsonable_encoder(item)
+    return {name: jsonable_encoder(_value(item, name)) for name in fields}
+
+
+def select_page(items, offset: int = 0, limit: Optional[int] = None, sort_by: Optional[str] = None,
+                descending: bool = True):
+    """
+    Sort and slice a job result. Returns the page and the total number of items.
+    """
+    ordered = sort_items(items, sort_by, descending)
+    end = None if limit is None else offset + limit
+    return ordered[offset:end], len(ordered)
+
+
+def encode_page(page, fields: Optional[List[str]] = None):
+    return [project(item, fields) for item in page]
+
+
+def ndjson_lines(items: Iterable, fields: Optional[List[str]] = None):
+    """
+    Yield one JSON line per item, encoding lazily so large results stream out.
+    """
+    for item in items:
+        yield json.dumps(project(item, fields), ensure_ascii=False) + "\n"
@@ -0,0 +1,121 @@
+import re
+import random
+import asyncio
+import aiohttp
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+from fast_llm_api.config import LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_ATTEMPT_TIMEOUT, LLM_CALL_DEADLINE
+
+# 408 timeout, 409 lock conflict, 429 rate limit and transient server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Connection resets, dropped keep-alive sockets, truncated bodies and attempt timeouts
+RETRYABLE_EXCEPTIONS = (
+    aiohttp.ClientConnectionError,
+    aiohttp.ClientPayloadError,
+    asyncio.TimeoutError,
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class LLMRequestError(Exception):
+    """
+    A failed LLM call, carrying what the retry loop needs to decide what to do next.
+    """
+
+    def __init__(self, message, status: Optional[int] = None, retryable: bool = False, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def is_retryable_status(status):
+    return status in RETRYABLE_STATUS_CODES
+
+
+def is_retryable_exception(exc):
+    if isinstance(exc, LLMRequestError):
+        return exc.retryable
+    return isinstance(exc, RETRYABLE_EXCEPTIONS)
+
+
+def parse_duration(value):
+    """
+    Parse a reset hint in seconds: plain numbers ("2", "0.5") or OpenAI-style
+    durations ("20ms", "1s", "6m0s", "1h2m3.5s"). Returns None when unparseable.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts or "".join(n + u for n, u in parts) != value:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers):
+    """
+    Extract the server's reset hint from Retry-After (seconds or HTTP date),
+    retry-after-ms, or the x-ratelimit-reset-* headers of an exhausted limit.
+    """
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms") is not None:
+        millis = parse_duration(headers.get("retry-after-ms"))
+        if millis is not None:
+            return millis / 1000
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        seconds = parse_duration(retry_after)
+        if seconds is not None:
+            return seconds
+        try:
+            reset_at = parsedate_to_datetime(retry_after)
+            return max(0.0, (reset_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    hints = []
+    for limit in ("requests", "tokens"):
+        reset = parse_duration(headers.get(f"x-ratelimit-reset-{limit}"))
+        remaining = headers.get(f"x-ratelimit-remaining-{limit}")
+        # Only the limit that is actually exhausted tells us how long to wait
+        if reset is not None and (remaining is None or str(remaining).strip() == "0"):
+            hints.append(reset)
+    return max(hints) if hints else None
+
+
+class RetryPolicy:
+    """
+    Decorrelated-jitter exponential backoff bounded by a per-attempt timeout
+    and an overall per-call deadline.
+    """
+
+    def __init__(self, max_attempts: int = LLM_MAX_RETRIES, base_delay: float = LLM_RETRY_BASE_DELAY,
+                 max_delay: float = LLM_RETRY_MAX_DELAY, attempt_timeout: float = LLM_ATTEMPT_TIMEOUT,
+                 deadline: float = LLM_CALL_DEADLINE):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+
+    def next_delay(self, previous_delay, retry_after=None, remaining=None):
+        """
+        Sleep before the next attempt. A server hint is honoured as a floor, even
+        past max_delay since retrying earlier only earns another rejection, with a
+        little jitter on top so callers released by the same reset don't collide.
+        The jitter never takes the sleep past the `remaining` time before the call
+        deadline; a hint that is itself past it is returned as is.
+        """
+        if retry_after is not None:
+            jitter = self.base_delay if remaining is None else min(self.base_delay, max(0.0, remaining - retry_after) / 2)
+            return retry_after + random.uniform(0, jitter)
+        return min(self.max_delay, random.uniform(self.base_delay, max(self.base_delay, previous_delay * 3)))
@@ -0,0 +1,242 @@
+import bisect
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+from fast_llm_api.helpers.job_context import current_job_id
+from fast_llm_api.config import (LLM_PRICE_PROMPT_PER_MILLION, LLM_PRICE_CACHED_PROMPT_PER_MILLION, LLM_PRICE_COMPLETION_PER_MILLION,
+                                 LLM_BATCH_PRICE_FACTOR, TELEMETRY_MAX_JOBS)
+
+METRIC_PREFIX = "fast_llm_api"
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, cumulative like Prometheus when exported.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile by interpolating inside the bucket it falls in.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            yield bound, total
+
+
+def token_cost(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0, batch: bool = False) -> float:
+    cost = ((prompt_tokens - cached_tokens) * LLM_PRICE_PROMPT_PER_MILLION + cached_tokens * LLM_PRICE_CACHED_PROMPT_PER_MILLION
+            + completion_tokens * LLM_PRICE_COMPLETION_PER_MILLION) / 1_000_000
+    return cost * LLM_BATCH_PRICE_FACTOR if batch else cost
+
+
+class PromptTypeMetrics:
+    """
+    Counters and histograms of the LLM calls of one prompt type.
+    """
+
+    def __init__(self):
+        self.calls = 0  # answered by the provider
+        self.errors = 0
+        self.cache_hits = 0
+        self.deduplicated = 0  # shared an identical in-flight call
+        self.batched = 0  # answered through the Batch API
+        self.attempts = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost_usd = 0.0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queue_wait = Histogram(QUEUE_WAIT_BUCKETS)
+
+    def add_usage(self, usage: Optional[Dict], batch: bool = False):
+        if not usage:
+            return
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        cached_tokens = int((usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.cost_usd += token_cost(prompt_tokens, completion_tokens, cached_tokens, batch)
+
+    def summary(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "deduplicated": self.deduplicated,
+            "batched": self.batched,
+            "retries": self.retries,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_seconds": {"total": round(self.latency.sum, 3), "p50": self.latency.quantile(0.5),
+                                "p95": self.latency.quantile(0.95)},
+            "queue_wait_seconds": {"total": round(self.queue_wait.sum, 3), "p95": self.queue_wait.quantile(0.95)},
+        }
+
+
+class LLMMetrics:
+    """
+    LLM call metrics of one scope (the whole process, or one job), by prompt type.
+    """
+
+    def __init__(self):
+        self.by_type: Dict[str, PromptTypeMetrics] = defaultdict(PromptTypeMetrics)
+
+    def summary(self) -> Dict:
+        by_type = {prompt_type: metrics.summary() for prompt_type, metrics in sorted(self.by_type.items())}
+        totals = {key: sum(summary[key] for summary in by_type.values())
+                  for key in ("calls", "errors", "cache_hits", "deduplicated", "batched", "retries",
+                              "prompt_tokens", "completion_tokens", "cached_tokens")}
+        # Share of prompt tokens the provider served from its prompt cache
+        totals["cached_token_share"] = round(totals["cached_tokens"] / totals["prompt_tokens"], 4) if totals["prompt_tokens"] else 0.0
+        totals["cost_usd"] = round(sum(metrics.cost_usd for metrics in self.by_type.values()), 6)
+        totals["llm_seconds"] = round(sum(metrics.latency.sum for metrics in self.by_type.values()), 3)
+        totals["queue_wait_seconds"] = round(sum(metrics.queue_wait.sum for metrics in self.by_type.values()), 3)
+        return {**totals, "by_prompt_type": by_type}
+
+
+@dataclass
+class LLMCallRecord:
+    """
+    What one async_openai_call went through; filled in by the retry loop.
+    """
+    prompt_type: str
+    attempts: int = 0
+    queue_wait: float = 0.0
+    usage: Optional[Dict] = None
+
+
+# The call record of the LLM call the current task is making
+current_call: ContextVar[Optional[LLMCallRecord]] = ContextVar("current_llm_call", default=None)
+
+
+class Telemetry:
+    """
+    Aggregates LLM call metrics for the whole process and per job (the job is
+    taken from current_job_id). Per-job metrics of the oldest jobs are dropped
+    beyond TELEMETRY_MAX_JOBS; finished jobs keep a summary in the job store.
+    """
+
+    def __init__(self, max_jobs: int = TELEMETRY_MAX_JOBS):
+        self.process = LLMMetrics()
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, LLMMetrics]" = OrderedDict()
+
+    def _scopes(self, prompt_type: str) -> Iterable[PromptTypeMetrics]:
+        yield self.process.by_type[prompt_type]
+        job_id = current_job_id.get()
+        if job_id is not None:
+            metrics = self._jobs.get(job_id)
+            if metrics is None:
+                metrics = self._jobs[job_id] = LLMMetrics()
+                while len(self._jobs) > self.max_jobs:
+                    self._jobs.popitem(last=False)
+            yield metrics.by_type[prompt_type]
+
+    def record_call(self, record: LLMCallRecord, latency: float, ok: bool):
+        for metrics in self._scopes(record.prompt_type):
+            if ok:
+                metrics.calls += 1
+            else:
+                metrics.errors += 1
+            metrics.attempts += record.attempts
+            metrics.retries += max(0, record.attempts - 1)
+            metrics.latency.observe(latency)
+            metrics.queue_wait.observe(record.queue_wait)
+            metrics.add_usage(record.usage)
+
+    def record_cache_hit(self, prompt_type: str):
+        for metrics in self._scopes(prompt_type):
+            metrics.cache_hits += 1
+
+    def record_deduplicated(self, prompt_type: str):
+        for metrics in self._scopes(prompt_type):
+            metrics.deduplicated += 1
+
+    def record_batch_result(self, prompt_type: str, usage: Optional[Dict]):
+        for metrics in self._scopes(prompt_type):
+            metrics.batched += 1
+            metrics.add_usage(usage, batch=True)
+
+    def job_summary(self, job_id: str) -> Optional[Dict]:
+        metrics = self._jobs.get(job_id)
+        return metrics.summary() if metrics is not None else None
+
+    def render_prometheus(self, extra: Optional[Dict[str, Tuple[str, str, float]]] = None) -> str:
+        """
+        Process-wide metrics in the Prometheus text exposition format, plus any
+        `extra` unlabelled metrics given as name -> (type, help, value).
+        """
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        by_type = sorted(self.process.by_type.items())
+        family("llm_calls_total", "counter", "LLM calls by prompt type and outcome.")
+        for prompt_type, metrics in by_type:
+            for outcome in ("ok", "error", "cache_hit", "deduplicated", "batched"):
+                value = {"ok": metrics.calls, "error": metrics.errors, "cache_hit": metrics.cache_hits,
+                         "deduplicated": metrics.deduplicated, "batched": metrics.batched}[outcome]
+                lines.append(f'{METRIC_PREFIX}_llm_calls_total{{prompt_type="{prompt_type}",outcome="{outcome}"}} {value}')
+        family("llm_retries_total", "counter", "Retried LLM request attempts.")
+        for prompt_type, metrics in by_type:
+            lines.append(f'{METRIC_PREFIX}_llm_retries_total{{prompt_type="{prompt_type}"}} {metrics.retries}')
+        family("llm_tokens_total", "counter", "Tokens reported by the provider's usage block.")
+        for prompt_type, metrics in by_type:
+            for kind, value in (("prompt", metrics.prompt_tokens), ("completion", metrics.completion_tokens),
+                                ("cached", metrics.cached_tokens)):
+                lines.append(f'{METRIC_PREFIX}_llm_tokens_total{{prompt_type="{prompt_type}",kind="{kind}"}} {value}')
+        family("llm_cost_usd_total", "counter", "Estimated LLM spend in USD.")
+        for prompt_type, metrics in by_type:
+            lines.append(f'{METRIC_PREFIX}_llm_cost_usd_total{{prompt_type="{prompt_type}"}} {metrics.cost_usd:.6f}')
+        for name, attribute, help_text in (("llm_call_latency_seconds", "latency", "Wall time of LLM calls, retries included."),
+                                           ("llm_queue_wait_seconds", "queue_wait", "Time LLM calls waited for a scheduler slot.")):
+            family(name, "histogram", help_text)
+            for prompt_type, metrics in by_type:
+                histogram = getattr(metrics, attribute)
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'{METRIC_PREFIX}_{name}_bucket{{prompt_type="{prompt_type}",le="{le}"}} {count}')
+                lines.append(f'{METRIC_PREFIX}_{name}_sum{{prompt_type="{prompt_type}"}} {histogram.sum:.6f}')
+                lines.append(f'{METRIC_PREFIX}_{name}_count{{prompt_type="{prompt_type}"}} {histogram.count}')
+        for name, (kind, help_text, value) in (extra or {}).items():
+            family(name, kind, help_text)
+            lines.append(f"{METRIC_PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+telemetry = Telemetry()
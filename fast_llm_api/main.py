@@ -1,14 +1,62 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fast_llm_api.routes import additional_analysis, content_rank, random
+from fastapi.responses import PlainTextResponse
+from fast_llm_api.helpers.http_session import open_http_session, close_http_session
+from fast_llm_api.helpers.llm_cache import llm_cache
+from fast_llm_api.helpers.job_executor import job_executor
+from fast_llm_api.helpers.executors import shutdown_executors
+from fast_llm_api.helpers.telemetry import telemetry
+from fast_llm_api.helpers.rate_limiter import llm_in_flight
+from fast_llm_api.helpers.profiling import job_profiler, loop_lag_monitor
+from fast_llm_api.config import RESUME_JOBS_ON_STARTUP
+from fast_llm_api.routes import additional_analysis, content_rank, random, profiling
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled keep-alive client shared by every LLM helper for the app lifetime
+    await open_http_session()
+    await job_executor.start()
+    if job_profiler.enabled():
+        loop_lag_monitor.start()
+    if RESUME_JOBS_ON_STARTUP:
+        await content_rank.resume_pending_jobs()
+    yield
+    await loop_lag_monitor.stop()
+    await job_executor.stop()
+    shutdown_executors()
+    await close_http_session()
+    llm_cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Include the route groups
 app.include_router(content_rank.router, prefix="/content-rank")
 app.include_router(additional_analysis.router, prefix="/additional-analysis")
 app.include_router(random.router, prefix="/random")
+app.include_router(profiling.router, prefix="/profiling")
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Fast-LLM API!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics of this worker: LLM calls, latency, tokens and cost by
+    prompt type, plus the response cache, scheduler and job queue.
+    """
+    cache = llm_cache.stats()
+    return telemetry.render_prometheus({
+        "llm_cache_hits_total": ("counter", "LLM response cache hits.", cache["hits"]),
+        "llm_cache_misses_total": ("counter", "LLM response cache misses.", cache["misses"]),
+        "llm_cache_memory_entries": ("gauge", "Entries in the in-memory LLM response cache.", cache["memory_entries"]),
+        "llm_in_flight": ("gauge", "LLM requests currently on the wire.", llm_in_flight()),
+        "jobs_running": ("gauge", "Jobs currently running on this worker.", job_executor.running),
+        "jobs_queued": ("gauge", "Jobs waiting in this worker's queue.", job_executor.queued),
+        "event_loop_lag_max_seconds": ("gauge", "Largest event-loop lag seen (0 unless PROFILING_ENABLED=1).",
+                                       loop_lag_monitor.max_lag),
+    })
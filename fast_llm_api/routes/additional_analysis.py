@@ -1,11 +1,18 @@
 import math
 import uuid
 import logging
-from fastapi import APIRouter, BackgroundTasks
-from pydantic import BaseModel
-from typing import List, Optional, Dict
-from fast_llm_api.services.additional_analyis import evaluate_all_entries_story_plagiarism, cross_check_similarity
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Literal
+from fast_llm_api.services.additional_analyis import run_analysis_pipeline, ANALYSIS_STAGES
 from fast_llm_api.services.models import OneStudentEntry
+from fast_llm_api.helpers.job_store import JobStore, get_job_store
+from fast_llm_api.helpers.result_pages import parse_fields, select_page, encode_page, ndjson_lines
+from fast_llm_api.helpers.progress import progress_broker, publish_progress, sse_events
+from fast_llm_api.helpers.telemetry import telemetry
+from fast_llm_api.helpers.job_executor import job_executor, default_priority
+from fast_llm_api.config import SIMILARITY_TOP_K
 from datetime import datetime
 
 # Global Variables
@@ -17,8 +24,8 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory storage for job tracking
-additional_analysis_jobs: Dict[str, Dict] = {}
+# Job tracking (in-memory or SQLite, see JOB_STORE_BACKEND)
+additional_analysis_jobs: JobStore = get_job_store("additional_analysis")
 
 class JobStatus(BaseModel):
     job_id: str
@@ -30,27 +37,33 @@ class JobStatus(BaseModel):
 class SubmitAdditionalAnalysisJobRequest(BaseModel):
     texts: List[OneStudentEntry]
     similarity_threshold: Optional[float] = THRESHOLD_FOR_COPYING
-
-# Background task to run the ranking process
-async def process_job(job_id: str, text_entries: List[SubmitAdditionalAnalysisJobRequest], similarity_threshold: float):
-    logger.info(f"Starting additional analysis job {job_id} with {len(text_entries)} entries.")
-    additional_analysis_jobs[job_id]['status'] = 'running'
-    additional_analysis_jobs[job_id]['start_time'] = datetime.now()  # Track start time
+    similarity_top_k: Optional[int] = Field(SIMILARITY_TOP_K, ge=1)  # most similar entries listed per text
+    similarity_method: Optional[Literal["exact", "minhash"]] = "exact"  # "minhash" only scores LSH near-duplicate candidates
+    check_previous_submissions: Optional[bool] = False  # also match against the persisted index of earlier jobs
+    similarity_scope: Optional[Literal["job", "school", "all"]] = "job"  # compare within this job, or against earlier submissions
+    school: Optional[str] = None  # required for the "school" scope
+    stages: List[Literal["plagiarism", "story", "similarity"]] = Field(default_factory=lambda: list(ANALYSIS_STAGES), min_length=1)
+    priority: Optional[int] = None  # lower runs first; defaults by job size
+
+# Background task to run the analysis pipeline
+async def process_job(job_id: str, request: SubmitAdditionalAnalysisJobRequest):
+    text_entries = request.texts
+    logger.info(f"Starting additional analysis job {job_id} with {len(text_entries)} entries, stages: {', '.join(request.stages)}.")
+    await additional_analysis_jobs.aupdate(job_id, status='running', start_time=datetime.now())  # Track start time
+    publish_progress("status", status='running')
     try:
-        # Evaluate story plagiarism and cross-check similarity
-        result_story_probs = await evaluate_all_entries_story_plagiarism(text_entries)
-        result_story_similarity_probs = await cross_check_similarity(text_entries, similarity_threshold)
-
-        result = result_story_similarity_probs
+        # LLM checks and similarity run concurrently; their fields are merged per entry
+        result = await run_analysis_pipeline(text_entries, request.stages, request.similarity_top_k, request.similarity_method,
+                                             request.check_previous_submissions, request.similarity_scope, request.school)
 
-        additional_analysis_jobs[job_id]['status'] = 'completed'
-        additional_analysis_jobs[job_id]['result'] = result
-        additional_analysis_jobs[job_id]['end_time'] = datetime.now()  # Track end time
+        await additional_analysis_jobs.aupdate(job_id, status='completed', result=result, end_time=datetime.now(),
+                                        llm_usage=telemetry.job_summary(job_id))  # Track end time
+        publish_progress("status", status='completed')
         logger.info(f"Additional analysis job {job_id} completed successfully.")
     except Exception as e:
-        additional_analysis_jobs[job_id]['status'] = 'failed'
-        additional_analysis_jobs[job_id]['result'] = str(e)
-        additional_analysis_jobs[job_id]['end_time'] = datetime.now()  # Track end time
+        await additional_analysis_jobs.aupdate(job_id, status='failed', result=str(e), error=str(e), end_time=datetime.now(),
+                                        llm_usage=telemetry.job_summary(job_id))  # Track end time
+        publish_progress("status", status='failed', error=str(e))
         logger.error(f"Additional analysis job {job_id} failed with error: {e}", exc_info=True)
 
 def calculate_elapsed_time(job):
@@ -71,30 +84,33 @@ def format_time_korean(dt):
 
 # Endpoint to submit a large list of texts (creates a new job)
 @router.post("/submit-job")
-async def submit_job(request: SubmitAdditionalAnalysisJobRequest, background_tasks: BackgroundTasks):
+async def submit_job(request: SubmitAdditionalAnalysisJobRequest):
     # Generate a unique job_id
     job_id = str(uuid.uuid4())
     
+    # Refuse new work while the queue is full rather than piling jobs onto the event loop
+    if job_executor.is_full():
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later")
+    if request.similarity_scope == "school" and not request.school:
+        raise HTTPException(status_code=422, detail="The school similarity scope needs a school")
+
     # Store job in the system
-    additional_analysis_jobs[job_id] = {
-        'status': 'queued',
-        'result': None,
-        'start_time': None,
-        'end_time': None
-    }
+    await additional_analysis_jobs.acreate(job_id)
+    progress_broker.publish(job_id, "status", status='queued')
 
     logger.info(f"Job {job_id} has been queued with similarity threshold: {request.similarity_threshold}")
     
-    # Queue the task in the background
-    background_tasks.add_task(process_job, job_id, request.texts, request.similarity_threshold)
+    # Queue the task on the job executor
+    priority = request.priority if request.priority is not None else default_priority(len(request.texts))
+    queue_position = job_executor.submit(job_id, process_job, job_id, request, priority=priority)
 
-    return {"job_id": job_id, "status": "Job has been queued"}
+    return {"job_id": job_id, "status": "Job has been queued", "queue_position": queue_position}
 
 # Endpoint to retrieve the status of all additional_analysis_jobs
 @router.get("/job-status")
-async def get_job_status():
+async def get_job_status(status: Optional[str] = None, limit: Optional[int] = Query(None, ge=1)):
     job_statuses = {}
-    for job_id, job in additional_analysis_jobs.items():
+    for job_id, job in (await additional_analysis_jobs.alist_jobs(status=status, limit=limit)).items():
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         job_statuses[job_id] = {
             'status': job['status'],
@@ -104,17 +120,32 @@ async def get_job_status():
     logger.info("Returning status for all additional analysis jobs.")
     return job_statuses
 
+# Endpoint to stream progress events of a specific job (Server-Sent Events)
+@router.get("/job-events/{job_id}")
+async def stream_job_events(job_id: str):
+    job = await additional_analysis_jobs.aget(job_id)
+    if not job:
+        logger.warning(f"Job {job_id} not found when streaming events.")
+        return {"error": "Job not found"}
+    if job['status'] in ('completed', 'failed') and 'status' not in progress_broker.latest(job_id):
+        # Finished before this worker saw it (restart or another worker): just report the outcome
+        progress_broker.publish(job_id, "status", status=job['status'])
+    return StreamingResponse(sse_events(job_id), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # Endpoint to retrieve the status of a specific job
 @router.get("/job-status/{job_id}")
 async def get_job_status_by_id(job_id: str):
-    job = additional_analysis_jobs.get(job_id)
+    job = await additional_analysis_jobs.aget(job_id, with_result=False)  # metadata only; results come from /job-result
     if job:
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         return {
             'status': job['status'],
             'created_at': creation_time,
             'elapsed_time': calculate_elapsed_time(job),
-            'result': job.get('result', None)
+            'queue_position': job_executor.queue_position(job_id),
+            'error': job.get('error'),
+            # Live while the job runs on this worker; stored with the job once it finishes
+            'llm_usage': job.get('llm_usage') or telemetry.job_summary(job_id)
         }
     else:
         logger.warning(f"Job {job_id} not found.")
@@ -122,15 +153,30 @@ async def get_job_status_by_id(job_id: str):
 
 # Endpoint to retrieve the result of a specific job by job_id
 @router.get("/job-result/{job_id}")
-async def get_job_result(job_id: str):
-    job = additional_analysis_jobs.get(job_id)
+async def get_job_result(job_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                         sort_by: Optional[str] = None, order: Literal["asc", "desc"] = "desc",
+                         fields: Optional[str] = None, format: Literal["json", "ndjson"] = "json"):
+    """
+    Return a completed job's result, optionally sorted, paged (offset/limit) and
+    projected to a comma separated list of `fields`. `format=ndjson` streams one
+    entry per line instead of building one large JSON document.
+    """
+    job = await additional_analysis_jobs.aget(job_id)
     if job:
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         if job['status'] == 'completed':
             logger.info(f"Returning result for job {job_id}.")
+            page, total = select_page(job['result'], offset, limit, sort_by, order == "desc")
+            field_names = parse_fields(fields)
+            if format == "ndjson":
+                return StreamingResponse(ndjson_lines(page, field_names), media_type="application/x-ndjson",
+                                         headers={"X-Total-Count": str(total)})
             return {
                 "job_id": job_id,
-                "result": job['result'],
+                "result": encode_page(page, field_names),
+                "total": total,
+                "offset": offset,
+                "limit": limit,
                 "created_at": creation_time,
                 "elapsed_time": calculate_elapsed_time(job)
             }
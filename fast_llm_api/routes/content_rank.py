@@ -1,11 +1,20 @@
 import math
 import uuid
+import asyncio
 import logging
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Literal
 from fast_llm_api.services.content_rank.elo_fight_generator import generate_elo_results
+from fast_llm_api.services.content_rank.checkpoint import JobCheckpoint, list_checkpoints
 from fast_llm_api.services.models import OneStudentEntry
+from fast_llm_api.helpers.job_store import JobStore, get_job_store
+from fast_llm_api.helpers.result_pages import parse_fields, select_page, encode_page, ndjson_lines
+from fast_llm_api.helpers.progress import progress_broker, publish_progress, sse_events
+from fast_llm_api.helpers.telemetry import telemetry
+from fast_llm_api.helpers.job_executor import job_executor, default_priority, QueueFullError
+from fast_llm_api.helpers.job_context import current_batch_ledger
 from datetime import datetime
 
 # Set up logging configuration
@@ -14,8 +23,8 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# In-memory storage for job tracking
-jobs: Dict[str, Dict] = {}
+# Job tracking (in-memory or SQLite, see JOB_STORE_BACKEND)
+jobs: JobStore = get_job_store("content_rank")
 
 class JobStatus(BaseModel):
     job_id: str
@@ -25,32 +34,107 @@ class JobStatus(BaseModel):
     created_at: Optional[str] = None  # Add creation timestamp
 
 
+# Result fields /job-result can sort by
+EloSortField = Literal["elo_creativity", "elo_depth", "elo_coherence", "elo_grammar"]
+
+
 class SubmitJobRequest(BaseModel):
     texts: List[OneStudentEntry]
     num_folds: Optional[int]
+    mode: Optional[Literal["realtime", "batch"]] = "realtime"  # "batch" routes LLM calls through the Batch API
+    early_stopping: Optional[bool] = True  # stop before num_folds once the ranking has converged
+    priority: Optional[int] = None  # lower runs first; defaults by job size
 
 # Background task to run the ranking process
-async def process_job(job_id: str, student_entries: List[OneStudentEntry], num_folds: int):
-    logger.info(f"Starting job {job_id} with {len(student_entries)} entries and {num_folds} folds.")
-    jobs[job_id]['status'] = 'running'
-    jobs[job_id]['start_time'] = datetime.now()  # Track start time
+async def process_job(job_id: str, student_entries: List[OneStudentEntry], num_folds: int, mode: str = "realtime", early_stopping: bool = True,
+                      resume_state=None, checkpoint: Optional[JobCheckpoint] = None):
+    # Submits and resumes claim the job's lock before queueing it; never run a copy someone else holds
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(job_id, job_params(num_folds, mode, early_stopping))
+    if not checkpoint.claimed and not checkpoint.claim():
+        logger.warning(f"Job {job_id} is already claimed by another run; not starting it.")
+        return
+    if resume_state is not None:
+        logger.info(f"Resuming job {job_id} from {resume_state.phase} checkpoint at fold {resume_state.fold}/{num_folds}.")
+    else:
+        logger.info(f"Starting job {job_id} with {len(student_entries)} entries and {num_folds} folds in {mode} mode.")
+    await jobs.aupdate(job_id, status='running', start_time=datetime.now())  # Track start time
+    publish_progress("status", status='running')
+    ledger_token = current_batch_ledger.set(checkpoint)
     try:
         # Asynchronous AI ranking operation
-        result = await generate_elo_results(student_entries, num_folds)
-        jobs[job_id]['status'] = 'completed'
-        jobs[job_id]['result'] = result
-        jobs[job_id]['end_time'] = datetime.now()  # Track end time
+        result = await generate_elo_results(student_entries, num_folds, mode, early_stopping, checkpoint, resume_state)
+        await jobs.aupdate(job_id, status='completed', result=result, end_time=datetime.now(),
+                    llm_usage=telemetry.job_summary(job_id))  # Track end time
+        publish_progress("status", status='completed')
+        checkpoint.delete()
         logger.info(f"Job {job_id} completed successfully.")
     except Exception as e:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['result'] = str(e)
-        jobs[job_id]['end_time'] = datetime.now()  # Track end time
+        await jobs.aupdate(job_id, status='failed', result=str(e), error=str(e), end_time=datetime.now(),
+                    llm_usage=telemetry.job_summary(job_id))  # Track end time
+        publish_progress("status", status='failed', error=str(e))
+        checkpoint.mark_failed()
         logger.error(f"Job {job_id} failed with error: {e}", exc_info=True)
+    finally:
+        current_batch_ledger.reset(ledger_token)
+        checkpoint.release()
+
+def job_params(num_folds, mode, early_stopping, priority=None):
+    return {'num_folds': num_folds, 'mode': mode, 'early_stopping': early_stopping, 'priority': priority}
+
+async def resume_from_checkpoint(job_id: str, include_failed: bool = True):
+    """
+    Re-queue a job from its last checkpoint. Returns the queue position, or None
+    when there is nothing to resume (no checkpoint, already finished, or claimed
+    by another worker). Raises QueueFullError when the executor is full.
+    """
+    checkpoint = JobCheckpoint(job_id)
+    if checkpoint.failed and not include_failed:
+        return None
+    state = await asyncio.to_thread(JobCheckpoint.load, job_id)
+    if state is None:
+        return None
+    job = await jobs.aget(job_id)
+    if job is not None and job['status'] == 'completed':
+        checkpoint.delete()
+        return None
+    if job_executor.is_full():
+        raise QueueFullError(f"Cannot resume job {job_id}: job queue is full")
+    if not checkpoint.claim():
+        return None
+
+    checkpoint.params = state.params
+    checkpoint.clear_failed()
+    if job is None:
+        await jobs.acreate(job_id)
+    else:
+        await jobs.aupdate(job_id, status='queued', end_time=None)
+    progress_broker.publish(job_id, "status", status='queued', resumed_from_fold=state.fold)
+    params = state.params
+    priority = params.get('priority')
+    if priority is None:
+        priority = default_priority(len(state.entries))
+    return job_executor.submit(job_id, process_job, job_id, state.entries, params['num_folds'], params['mode'],
+                               params['early_stopping'], state, checkpoint, priority=priority)
+
+async def resume_pending_jobs():
+    """
+    Resume every checkpointed job that didn't fail, e.g. after a crash or redeploy.
+    """
+    for job_id in list_checkpoints():
+        try:
+            position = await resume_from_checkpoint(job_id, include_failed=False)
+        except QueueFullError:
+            logger.warning(f"Job queue is full; leaving checkpointed job {job_id} for later.")
+            break
+        if position is not None:
+            logger.info(f"Job {job_id} re-queued from checkpoint at position {position}.")
 
 def recommend_num_folds(num_texts, reduction_factor=0.20):
     """
     Recommend the number of folds based on the number of bots and a reduction factor
     that accounts for the initial scores already providing some guidance.
+    With early stopping this is an upper bound; elo_fights stops once ranks settle.
     """
     base_folds = math.log2(num_texts)
     adjusted_folds = base_folds * (1 - reduction_factor)
@@ -74,34 +158,60 @@ def format_time_korean(dt):
 
 # Endpoint to submit a large list of texts (creates a new job)
 @router.post("/submit-job")
-async def submit_job(request: SubmitJobRequest, background_tasks: BackgroundTasks):
+async def submit_job(request: SubmitJobRequest):
     # Generate a unique job_id
     job_id = str(uuid.uuid4())
     
+    # Refuse new work while the queue is full rather than piling jobs onto the event loop
+    if job_executor.is_full():
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later")
+
     # Store job in the system
-    jobs[job_id] = {
-        'status': 'queued',
-        'result': None,
-        'start_time': None,
-        'end_time': None
-    }
+    await jobs.acreate(job_id)
+    progress_broker.publish(job_id, "status", status='queued')
 
     folds = request.num_folds
     if folds is None:
         folds = recommend_num_folds(len(request.texts))
 
     logger.info(f"Job {job_id} has been queued with {folds} folds.")
-    
-    # Queue the task in the background
-    background_tasks.add_task(process_job, job_id, request.texts, folds)
 
-    return {"job_id": job_id, "status": "Job has been queued"}
+    # Checkpoint the submission so the job survives a restart even before it starts. The lock is held
+    # from now until the job finishes, so a resume can't queue a second copy while this one waits
+    checkpoint = JobCheckpoint(job_id, job_params(folds, request.mode, request.early_stopping, request.priority))
+    checkpoint.claim()
+    await checkpoint.asave(request.texts, "submitted")
+
+    # Queue the task on the job executor
+    priority = request.priority if request.priority is not None else default_priority(len(request.texts))
+    try:
+        queue_position = job_executor.submit(job_id, process_job, job_id, request.texts, folds, request.mode, request.early_stopping,
+                                             None, checkpoint, priority=priority)
+    except QueueFullError:
+        # Filled up while the checkpoint was written; drop the job rather than leave it for a later resume
+        checkpoint.delete()
+        await jobs.aupdate(job_id, status='failed', error="Job queue is full", end_time=datetime.now())
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later")
+
+    return {"job_id": job_id, "status": "Job has been queued", "queue_position": queue_position}
+
+# Endpoint to resume an interrupted or failed job from its last checkpoint
+@router.post("/resume/{job_id}")
+async def resume_job(job_id: str):
+    try:
+        queue_position = await resume_from_checkpoint(job_id)
+    except QueueFullError:
+        raise HTTPException(status_code=429, detail="Job queue is full, retry later")
+    if queue_position is None:
+        logger.warning(f"No resumable checkpoint for job {job_id}.")
+        raise HTTPException(status_code=404, detail="No resumable checkpoint for this job")
+    return {"job_id": job_id, "status": "Job has been re-queued from its last checkpoint", "queue_position": queue_position}
 
 # Endpoint to retrieve the status of all jobs
 @router.get("/job-status")
-async def get_job_status():
+async def get_job_status(status: Optional[str] = None, limit: Optional[int] = Query(None, ge=1)):
     job_statuses = {}
-    for job_id, job in jobs.items():
+    for job_id, job in (await jobs.alist_jobs(status=status, limit=limit)).items():
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         job_statuses[job_id] = {
             'status': job['status'],
@@ -111,17 +221,32 @@ async def get_job_status():
     logger.info("Returning status for all jobs.")
     return job_statuses
 
+# Endpoint to stream progress events of a specific job (Server-Sent Events)
+@router.get("/job-events/{job_id}")
+async def stream_job_events(job_id: str):
+    job = await jobs.aget(job_id)
+    if not job:
+        logger.warning(f"Job {job_id} not found when streaming events.")
+        return {"error": "Job not found"}
+    if job['status'] in ('completed', 'failed') and 'status' not in progress_broker.latest(job_id):
+        # Finished before this worker saw it (restart or another worker): just report the outcome
+        progress_broker.publish(job_id, "status", status=job['status'])
+    return StreamingResponse(sse_events(job_id), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # Endpoint to retrieve the status of a specific job
 @router.get("/job-status/{job_id}")
 async def get_job_status_by_id(job_id: str):
-    job = jobs.get(job_id)
+    job = await jobs.aget(job_id, with_result=False)  # metadata only; results come from /job-result
     if job:
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         return {
             'status': job['status'],
             'created_at': creation_time,
             'elapsed_time': calculate_elapsed_time(job),
-            'result': job.get('result', None)
+            'queue_position': job_executor.queue_position(job_id),
+            'error': job.get('error'),
+            # Live while the job runs on this worker; stored with the job once it finishes
+            'llm_usage': job.get('llm_usage') or telemetry.job_summary(job_id)
         }
     else:
         logger.warning(f"Job {job_id} not found.")
@@ -129,14 +254,29 @@ async def get_job_status_by_id(job_id: str):
 
 # Endpoint to retrieve the result of a specific job by job_id
 @router.get("/job-result/{job_id}")
-async def get_job_result(job_id: str):
-    job = jobs.get(job_id)
+async def get_job_result(job_id: str, offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                         sort_by: Optional[EloSortField] = None, order: Literal["asc", "desc"] = "desc",
+                         fields: Optional[str] = None, format: Literal["json", "ndjson"] = "json"):
+    """
+    Return a completed job's result, optionally sorted, paged (offset/limit) and
+    projected to a comma separated list of `fields`. `format=ndjson` streams one
+    entry per line instead of building one large JSON document.
+    """
+    job = await jobs.aget(job_id)
     if job:
         creation_time = format_time_korean(job['start_time']) if job['start_time'] else None
         if job['status'] == 'completed':
+            page, total = select_page(job['result'], offset, limit, sort_by, order == "desc")
+            field_names = parse_fields(fields)
+            if format == "ndjson":
+                return StreamingResponse(ndjson_lines(page, field_names), media_type="application/x-ndjson",
+                                         headers={"X-Total-Count": str(total)})
             return {
                 "job_id": job_id,
-                "result": job['result'],
+                "result": encode_page(page, field_names),
+                "total": total,
+                "offset": offset,
+                "limit": limit,
                 "created_at": creation_time,
                 "elapsed_time": calculate_elapsed_time(job)
             }
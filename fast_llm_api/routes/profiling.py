@@ -0,0 +1,41 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from fast_llm_api.helpers.profiling import job_profiler, loop_lag_monitor, phase_recorder
+
+router = APIRouter()
+
+
+# Event-loop lag percentiles and the recent spikes with the phases running at the time
+@router.get("/loop-lag")
+async def get_loop_lag():
+    return loop_lag_monitor.summary()
+
+
+# Phase timings of a job, plus a summary of its sampled profile if it has one
+@router.get("/jobs/{job_id}")
+async def get_job_profile(job_id: str):
+    profile = job_profiler.profile(job_id)
+    return {
+        "job_id": job_id,
+        "profiling": job_profiler.state(job_id),
+        "phases": phase_recorder.job_summary(job_id),
+        "profile": profile.summary() if profile is not None else None,
+    }
+
+
+# Start sampling a job now if it is running, or as soon as it starts
+@router.post("/jobs/{job_id}")
+async def request_job_profile(job_id: str, seconds: Optional[float] = Query(None, gt=0)):
+    if not job_profiler.enabled():
+        raise HTTPException(status_code=403, detail="Profiling is disabled, set PROFILING_ENABLED=1")
+    return {"job_id": job_id, "profiling": job_profiler.request(job_id, seconds)}
+
+
+# The job's sampled stacks in folded format, for speedscope or flamegraph.pl
+@router.get("/jobs/{job_id}/profile", response_class=PlainTextResponse)
+async def dump_job_profile(job_id: str):
+    profile = job_profiler.profile(job_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profile for this job")
+    return profile.folded()
@@ -1,89 +1,191 @@
 import asyncio
 import numpy as np
-from typing import List
+from typing import Dict, List, Sequence
 from fast_llm_api.services.models import OneStudentEntry
 from fast_llm_api.helpers.async_llm_helpers import async_openai_call
+from fast_llm_api.helpers.prompt_templates import PromptTemplate
+from fast_llm_api.helpers.progress import ProgressCounter, publish_progress
+from fast_llm_api.services.similarity.top_k import top_k_similar, parallel_top_k_similar
+from fast_llm_api.services.similarity.minhash import MinHashLSHIndex, get_persistent_index, rank_candidate_pairs
+from fast_llm_api.services.similarity import corpus
+from fast_llm_api.helpers.job_context import current_job_id
+from fast_llm_api.helpers.profiling import phase_timer
+from fast_llm_api.helpers.executors import run_in_process, run_in_thread, process_pool_enabled
+from fast_llm_api.config import SIMILARITY_TOP_K, MINHASH_INDEX_DIR, SIMILARITY_CORPUS_RECORD_ALL, ANALYSIS_PROCESS_MIN_TEXTS
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
 
 
-async def chatgpt_evaluate_plagiarism_probability(text):
-    prompt_plagiarism = f"""
-        Consider the following text and make an informed guess on whether this reads as a plagiarized text. We understand that you don't have access to all kinds of databases, but answer with both your confidence (in LOW, MEDIUM, HIGH) in that the text sounds plagiarized and what you think it reads very similarly too.
+PLAGIARISM_PROMPT = PromptTemplate("""
+    Consider the following text and make an informed guess on whether this reads as a plagiarized text. We understand that you don't have access to all kinds of databases, but answer with both your confidence (in LOW, MEDIUM, HIGH) in that the text sounds plagiarized and what you think it reads very similarly too.
+
+    Consider the following text, and determine its probability of plagiarism.
+    Output "LOW" if you think there is a low chance / zero chance it was plagiarized.
+    Output "MEDIUM: <Source Text Name>" or "HIGH: <Source Text Name>" if you think it is plagiarized, and add "Source Text Name" accordingly to the source that the given text sounds a lot like.
+    Keep in mind that students are completely allowed to quote real references, and that direct quotations do NOT constitute plagiarism. But pretending that it's their own work without proper quoting is what does.
+    Do NOT explain your reasoning, only output "LOW", "MEDIUM: <Source Text Name>", OR "HIGH: <Source Text Name>", and no other texrt.
+    """, "Input Text: {text}")
 
-        Consider the following text, and determine its probability of plagiarism.
-        Output "LOW" if you think there is a low chance / zero chance it was plagiarized.
-        Output "MEDIUM: <Source Text Name>" or "HIGH: <Source Text Name>" if you think it is plagiarized, and add "Source Text Name" accordingly to the source that the given text sounds a lot like.
-        Keep in mind that students are completely allowed to quote real references, and that direct quotations do NOT constitute plagiarism. But pretending that it's their own work without proper quoting is what does.
-        Do NOT explain your reasoning, only output "LOW", "MEDIUM: <Source Text Name>", OR "HIGH: <Source Text Name>", and no other texrt.
+STORY_PROMPT = PromptTemplate("""
+    Consider the following text and make an informed guess on whether this reads as a story, rather than an essay. We are trying to give a score for how story-like this text is, and we're expecting to receive mainly essays, so we're trying to filter out texts that are essays without theses.
+    Please generate a score from 0 to 100 in 10 intervals, where:
+    - 0 means it's a typical essay that is not a story (though it might have some small story-like elements),
+    - 50 if it's an essay driven mainly by a story, and
+    - 100 if this is just a story of a character going through a certain set of actions.
 
-        Input Text: {text}
-        """
-    return await async_openai_call(prompt_plagiarism)
+    Do NOT explain your reasoning, only output one of "0", "10", "20", "30", "40", "50", "60", "70", "80", "90", "100". Do not explain, only one of the eleven numbers, please.
+    """, "Input Text: {text}")
+
+async def chatgpt_evaluate_plagiarism_probability(text):
+    return await async_openai_call(PLAGIARISM_PROMPT.render(text=text), prompt_type="plagiarism")
 
 async def chatgpt_evaluate_story_probability(text):
-    prompt_story = f"""
-        Consider the following text and make an informed guess on whether this reads as a story, rather than an essay. We are trying to give a score for how story-like this text is, and we're expecting to receive mainly essays, so we're trying to filter out texts that are essays without theses.
-        Please generate a score from 0 to 100 in 10 intervals, where:
-        - 0 means it's a typical essay that is not a story (though it might have some small story-like elements), 
-        - 50 if it's an essay driven mainly by a story, and 
-        - 100 if this is just a story of a character going through a certain set of actions.
-        
-        Do NOT explain your reasoning, only output one of "0", "10", "20", "30", "40", "50", "60", "70", "80", "90", "100". Do not explain, only one of the eleven numbers, please.
-        
-        Input Text: {text}
-        """
-        
-    return await async_openai_call(prompt_story)
+    return await async_openai_call(STORY_PROMPT.render(text=text), prompt_type="story")
 
 
-async def evaluate_all_entries_story_plagiarism(student_entries):
-    num_type_tasks = 2
+ANALYSIS_STAGES = ("plagiarism", "story", "similarity")
+
+def apply_fields(student_entries, field_sets):
+    for entry, fields in zip(student_entries, field_sets):
+        for key, value in fields.items():
+            entry[key] = value
+    return student_entries
 
+async def story_plagiarism_checks(student_entries, plagiarism=True, story=True) -> List[Dict]:
+    """
+    LLM plagiarism and/or story-likeness answers, as one dict of fields per entry.
+    """
+    checks = []
+    if plagiarism:
+        checks.append(('plagiarism_score', chatgpt_evaluate_plagiarism_probability))
+    if story:
+        checks.append(('story_score', chatgpt_evaluate_story_probability))
+
+    counter = ProgressCounter("plagiarism_checks", total=len(checks) * len(student_entries))
     tasks = []
     for entry in student_entries:
-        tasks.append(chatgpt_evaluate_plagiarism_probability(entry['answer']))
-        tasks.append(chatgpt_evaluate_story_probability(entry['answer']))
+        for _, check in checks:
+            tasks.append(counter.track(check(entry['answer'])))
 
-    results = await asyncio.gather(*tasks)
+    with phase_timer("llm_checks"):
+        results = await asyncio.gather(*tasks)
 
-    for i, entry in enumerate(student_entries):
-        entry['plagiarism_score'] = results[num_type_tasks * i]
-        entry['story_score'] = results[num_type_tasks * i + 1]
+    return [{field: results[len(checks) * i + j] for j, (field, _) in enumerate(checks)}
+            for i in range(len(student_entries))]
 
-    return student_entries
+async def evaluate_all_entries_story_plagiarism(student_entries):
+    return apply_fields(student_entries, await story_plagiarism_checks(student_entries))
 
-async def cross_check_similarity(student_entries, similarity_threshold):
-    
+def similarity_neighbours(texts, top_k=SIMILARITY_TOP_K):
+    text_vectors = TfidfVectorizer().fit_transform(texts)
+    return top_k_similar(text_vectors, top_k)
+
+def minhash_neighbours(texts, top_k=SIMILARITY_TOP_K):
+    """
+    Near-duplicate candidates from a MinHash/LSH index, re-scored with exact TF-IDF
+    cosine. Only candidate pairs are compared, so texts without a near-duplicate
+    may end up with no neighbours at all.
+    """
+    index = MinHashLSHIndex()
+    for position, text in enumerate(texts):
+        index.add(position, text)
+    pairs = index.candidate_pairs()
+    text_vectors = TfidfVectorizer().fit_transform(texts)  # rows are L2-normalised
+    scores = np.asarray(text_vectors[pairs[:, 0]].multiply(text_vectors[pairs[:, 1]]).sum(axis=1)).ravel()
+    return rank_candidate_pairs(len(texts), pairs, scores, top_k)
+
+def match_previous_submissions(ids, texts, job_id=None, top_k=SIMILARITY_TOP_K, directory=MINHASH_INDEX_DIR):
+    """
+    Look each text up in the persisted index of earlier submissions, then add the
+    texts to it, as {"id", "job_id", "score"} dicts like the corpus neighbours.
+    Scores are MinHash estimates of shingle Jaccard similarity, since earlier
+    texts are not kept.
+    """
+    matches = get_persistent_index(directory).match_and_add([str(entry_id) for entry_id in ids], texts, job_id, top_k)
+    return [[{"id": doc_id, "job_id": match_job_id, "score": score} for (match_job_id, doc_id, _), score in entry_matches]
+            for entry_matches in matches]
+
+def use_process_pool(texts):
+    # Small cohorts are not worth shipping to another process
+    return process_pool_enabled() and len(texts) >= ANALYSIS_PROCESS_MIN_TEXTS
+
+async def run_analysis(fn, texts, *args):
+    if use_process_pool(texts):
+        return await run_in_process(fn, *args)
+    return await run_in_thread(fn, *args)
+
+async def similarity_checks(student_entries, top_k=SIMILARITY_TOP_K, method="exact",
+                            check_previous_submissions=False, scope="job", school=None) -> List[Dict]:
+    """
+    Each entry's most similar texts, as one dict of fields per entry. With scope "job" only this request's
+    texts are compared; "school" and "all" query the persistent corpus of earlier
+    submissions (same school, or everything), which these texts are added to.
+    """
+    publish_progress("similarity", state="started", total=len(student_entries))
     ids = list([item["id"] for item in student_entries])
     texts = list([item["answer"] for item in student_entries])
-
-    text_vectors = TfidfVectorizer().fit_transform(texts)
-    for text_index, _ in enumerate(texts):
-        reference_vector = text_vectors[text_index:text_index+1]
-        
-        cosine_sim = cosine_similarity(reference_vector, text_vectors).flatten()
-
-        cosine_sim[text_index] = -np.inf # mask the vector itself
-        best_idx = cosine_sim.argmax()
-        # if cosine_sim[best_idx] >= similarity_threshold:
-        #     similarity_text = f"ID: {ids[best_idx]} / 유사도: {cosine_sim[best_idx]}"
-        # else:
-        #     similarity_text = f"없음 / 1위 유사도: {ids[best_idx]}, 유사도 {cosine_sim[best_idx]}"
-        
-        student_entries[text_index]["best_similarity_id"] = ids[best_idx]
-        student_entries[text_index]["best_similarity_score"] = cosine_sim[best_idx]
-
-
+    job_id = current_job_id.get()
+
+    # Vectorising and scoring are CPU bound, so keep them off the event loop
+    corpus_directory = corpus.SIMILARITY_CORPUS_DIR
+    if scope == "job":
+        with phase_timer("similarity_scoring", method=method):
+            if method == "minhash":
+                neighbours, scores = await run_analysis(minhash_neighbours, texts, texts, top_k)
+            elif use_process_pool(texts):
+                neighbours, scores = await parallel_top_k_similar(texts, top_k)
+            else:
+                neighbours, scores = await run_in_thread(similarity_neighbours, texts, top_k)
+            matches = [[{"id": ids[j], "score": float(score)} for j, score in zip(neighbours[text_index], scores[text_index])]
+                       for text_index in range(len(texts))]
+        if SIMILARITY_CORPUS_RECORD_ALL:
+            with phase_timer("corpus_update"):
+                await run_analysis(corpus.corpus_add_documents, texts, corpus_directory, ids, texts, job_id, school)
+    else:
+        with phase_timer("similarity_scoring", method="corpus", scope=scope):
+            matches = await run_analysis(corpus.corpus_neighbours, texts, corpus_directory, ids, texts, top_k, scope, job_id, school)
+
+    field_sets = [{
+        "best_similarity_id": similar_entries[0]["id"] if similar_entries else None,
+        "best_similarity_score": similar_entries[0]["score"] if similar_entries else None,
+        "similar_entries": similar_entries,
+    } for similar_entries in matches]
+
+    if check_previous_submissions:
+        with phase_timer("previous_submissions"):
+            previous_matches = await run_in_thread(match_previous_submissions, ids, texts, job_id, top_k)
+        for fields, previous in zip(field_sets, previous_matches):
+            fields["previous_submission_matches"] = previous
+
+    publish_progress("similarity", state="finished", total=len(student_entries))
+    return field_sets
+
+async def cross_check_similarity(student_entries, similarity_threshold, top_k=SIMILARITY_TOP_K, method="exact",
+                                 check_previous_submissions=False, scope="job", school=None):
+    field_sets = await similarity_checks(student_entries, top_k, method, check_previous_submissions, scope, school)
+    return apply_fields(student_entries, field_sets)
+
+async def run_analysis_pipeline(student_entries, stages: Sequence[str] = ANALYSIS_STAGES, top_k=SIMILARITY_TOP_K,
+                                method="exact", check_previous_submissions=False, scope="job", school=None):
+    """
+    Run the selected stages concurrently, so the local similarity work overlaps the
+    LLM calls, then merge every stage's fields into the entries.
+    """
+    stage_tasks = []
+    if "plagiarism" in stages or "story" in stages:
+        stage_tasks.append(story_plagiarism_checks(student_entries, "plagiarism" in stages, "story" in stages))
+    if "similarity" in stages:
+        stage_tasks.append(similarity_checks(student_entries, top_k, method, check_previous_submissions, scope, school))
+
+    for field_sets in await asyncio.gather(*stage_tasks):
+        apply_fields(student_entries, field_sets)
     return student_entries
 
 
 # Main function to execute the asynchronous process
 async def generate_function(student_entries: List[OneStudentEntry], similarity_threshold):
-    evaluated_entries = await evaluate_all_entries_story_plagiarism(student_entries)
-    final_results = await cross_check_similarity(evaluated_entries, similarity_threshold)
-    
+    final_results = await run_analysis_pipeline(student_entries)
+
     return final_results
 
 
@@ -0,0 +1,171 @@
+import os
+import json
+import fcntl
+import asyncio
+import threading
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from fast_llm_api.config import CHECKPOINT_DIR
+from fast_llm_api.services.models import OneStudentEntry
+
+CHECKPOINT_SUFFIX = ".jsonl"
+
+
+class CheckpointState(BaseModel):
+    job_id: str
+    params: Dict
+    phase: str  # "submitted", "evaluated" or "fold"
+    fold: int = 0
+    played: List[List[str]] = []
+    scheduler: Optional[Dict] = None  # FoldScheduler.state() after the last completed fold
+    entries: List[OneStudentEntry]
+
+
+class JobCheckpoint:
+    """
+    Resumable state of one content-rank job, stored as JSONL: a header line with
+    the job parameters, phase, completed fold count, pairings already fought and
+    the fold scheduler's state, then one line per entry with its scores, grammar
+    mistakes and Elo ratings.
+    Writes are atomic (temp file + rename), so a crash mid-write keeps the previous checkpoint.
+    Provider batches the job has in flight are kept next to it in a small
+    .batches file, keyed by the batch's requests, so a resumed job collects them.
+    """
+
+    def __init__(self, job_id: str, params: Optional[Dict] = None, directory: Optional[str] = None):
+        self.job_id = job_id
+        self.params = params or {}
+        self.directory = directory or CHECKPOINT_DIR
+        self._lock_fd = None
+        self._batches_lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.job_id}{CHECKPOINT_SUFFIX}")
+
+    def _read_batches(self) -> Dict[str, str]:
+        try:
+            with open(f"{self.path}.batches", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _update_batches(self, key, batch_id):
+        with self._batches_lock:
+            batches = self._read_batches()
+            if batch_id is None:
+                batches.pop(key, None)
+            else:
+                batches[key] = batch_id
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self.path}.batches.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(batches, f)
+            os.replace(tmp_path, f"{self.path}.batches")
+
+    def batch_id(self, key) -> Optional[str]:
+        with self._batches_lock:
+            return self._read_batches().get(key)
+
+    async def record_batch(self, key, batch_id):
+        await asyncio.to_thread(self._update_batches, key, batch_id)
+
+    async def forget_batch(self, key):
+        await asyncio.to_thread(self._update_batches, key, None)
+
+    def save(self, student_entries, phase, fold=0, played=(), store=None, scheduler=None):
+        """
+        Write a checkpoint. When an EloRatingStore is given, its current ratings
+        are written instead of the (stale) Elo attributes on the entries.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        header = {
+            "job_id": self.job_id,
+            "params": self.params,
+            "phase": phase,
+            "fold": fold,
+            "played": [list(pair) for pair in played],
+            "scheduler": scheduler,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+            for entry in student_entries:
+                data = entry.model_dump()
+                if store is not None:
+                    data.update(zip(store.dimensions, store.ratings[store.index[entry['id']]].tolist()))
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    async def asave(self, student_entries, phase, fold=0, played=(), store=None, scheduler=None):
+        # Snapshot ratings on the loop thread; the file write happens in a worker thread
+        if store is not None:
+            store = _RatingsSnapshot(store)
+        await asyncio.to_thread(self.save, list(student_entries), phase, fold, list(played), store, scheduler)
+
+    @classmethod
+    def load(cls, job_id, directory: Optional[str] = None) -> Optional[CheckpointState]:
+        checkpoint = cls(job_id, directory=directory)
+        if not os.path.exists(checkpoint.path):
+            return None
+        with open(checkpoint.path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            entries = [OneStudentEntry(**json.loads(line)) for line in f if line.strip()]
+        return CheckpointState(entries=entries, **header)
+
+    def claim(self):
+        """
+        Take an exclusive lock so only one worker process resumes this job.
+        The lock is released when the process exits, even if it crashes.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(f"{self.path}.lock", os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    @property
+    def claimed(self):
+        return self._lock_fd is not None
+
+    def release(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def mark_failed(self):
+        # Failed jobs are only resumed on request, never automatically at startup
+        open(f"{self.path}.failed", "w").close()
+
+    def clear_failed(self):
+        if os.path.exists(f"{self.path}.failed"):
+            os.remove(f"{self.path}.failed")
+
+    @property
+    def failed(self):
+        return os.path.exists(f"{self.path}.failed")
+
+    def delete(self):
+        for path in (self.path, f"{self.path}.lock", f"{self.path}.failed", f"{self.path}.batches"):
+            if os.path.exists(path):
+                os.remove(path)
+        self.release()
+
+
+class _RatingsSnapshot:
+    def __init__(self, store):
+        self.dimensions = list(store.dimensions)
+        self.index = dict(store.index)
+        self.ratings = store.ratings.copy()
+
+
+def list_checkpoints(directory: Optional[str] = None):
+    directory = directory or CHECKPOINT_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len(CHECKPOINT_SUFFIX)] for name in os.listdir(directory) if name.endswith(CHECKPOINT_SUFFIX))
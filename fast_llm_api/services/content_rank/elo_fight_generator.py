@@ -5,10 +5,26 @@ import json
 import asyncio
 import aiohttp
 import time
+import logging
 
 from typing import List
 from fast_llm_api.services.models import OneStudentEntry
 from fast_llm_api.helpers.async_llm_helpers import chatgpt_list_grammar_mistakes, chatgpt_evaluate_creativity, chatgpt_evaluate_coherence, chatgpt_evaluate_depth, chatgpt_compare_grammar, chatgpt_compare_coherence, chatgpt_compare_creativity, chatgpt_compare_depth
+from fast_llm_api.helpers.async_llm_helpers import evaluate_creativity_prompt, evaluate_depth_prompt, evaluate_coherence_prompt, list_grammar_mistakes_prompt, parse_grammar_mistakes, compare_creativity_prompt, compare_depth_prompt, compare_coherence_prompt, compare_grammar_prompt
+from fast_llm_api.helpers.async_llm_helpers import chatgpt_evaluate_all_dimensions, chatgpt_compare_all_dimensions, evaluate_all_dimensions_prompt, compare_all_dimensions_prompt, parse_rubric_evaluation, parse_rubric_comparison
+from fast_llm_api.services.content_rank.pairing import swiss_pairings
+from fast_llm_api.services.content_rank.elo_state import EloRatingStore, outcome_scores
+from fast_llm_api.services.content_rank.fold_scheduler import FoldScheduler
+from fast_llm_api.config import LLM_COMBINED_RUBRIC
+from fast_llm_api.helpers.batch_backend import run_prompts_in_batch
+from fast_llm_api.helpers.prompt_templates import RUBRIC_SYSTEM_PROMPT
+from fast_llm_api.helpers.progress import ProgressCounter, publish_progress
+from fast_llm_api.helpers.executors import run_in_thread
+from fast_llm_api.helpers.profiling import phase_timer
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = 10
 
 def update_elo(entry_a, entry_b, result, score_type):
     k = 32
@@ -26,54 +42,169 @@ def update_elo(entry_a, entry_b, result, score_type):
         entry_b[score_type] += k * (0.5 - expected_b)
 
 
-async def evaluate_all_entries(student_entries):
-    tasks = []
-    for entry in student_entries:
-        tasks.append(chatgpt_evaluate_creativity(entry['answer']))
-        tasks.append(chatgpt_evaluate_depth(entry['answer']))
-        tasks.append(chatgpt_evaluate_coherence(entry['answer']))
-        tasks.append(chatgpt_list_grammar_mistakes(entry['answer']))
-
-    results = await asyncio.gather(*tasks)
-
-    for i, entry in enumerate(student_entries):
-        entry['creativity_score'] = extract_number(results[4 * i])
-        entry['depth_score'] = extract_number(results[4 * i + 1])
-        entry['coherence_score'] = extract_number(results[4 * i + 2])
-        entry['grammar_mistakes'] = results[4 * i + 3]
-        entry['grammar_mistake_count'] = len(entry['grammar_mistakes'])
-        
-        # Initialize Elo scores based on the initial evaluation scores (creativity, depth, coherence, grammar)
-        entry['elo_creativity'] = 600 + (entry['creativity_score'] - 1) * 100
-        entry['elo_depth'] = 600 + (entry['depth_score'] - 1) * 100
-        entry['elo_coherence'] = 600 + (entry['coherence_score'] - 1) * 100
-        entry['elo_grammar'] = 600 + (10 - entry['grammar_mistake_count']) * 100  # Assuming fewer grammar mistakes are better
-    
+def apply_evaluation(entry, creativity_score, depth_score, coherence_score, grammar_mistakes):
+    entry['creativity_score'] = creativity_score
+    entry['depth_score'] = depth_score
+    entry['coherence_score'] = coherence_score
+    entry['grammar_mistakes'] = grammar_mistakes
+    entry['grammar_mistake_count'] = len(entry['grammar_mistakes'])
+
+    # Initialize Elo scores based on the initial evaluation scores (creativity, depth, coherence, grammar)
+    entry['elo_creativity'] = 600 + (entry['creativity_score'] - 1) * 100
+    entry['elo_depth'] = 600 + (entry['depth_score'] - 1) * 100
+    entry['elo_coherence'] = 600 + (entry['coherence_score'] - 1) * 100
+    entry['elo_grammar'] = 600 + (10 - entry['grammar_mistake_count']) * 100  # Assuming fewer grammar mistakes are better
+
+
+def _evaluation_scores(evaluation):
+    return (evaluation.creativity, evaluation.depth, evaluation.coherence,
+            [mistake.model_dump() for mistake in evaluation.grammar_mistakes])
+
+
+async def _evaluate_per_dimension(text):
+    results = await asyncio.gather(
+        chatgpt_evaluate_creativity(text),
+        chatgpt_evaluate_depth(text),
+        chatgpt_evaluate_coherence(text),
+        chatgpt_list_grammar_mistakes(text),
+    )
+    return extract_number(results[0]), extract_number(results[1]), extract_number(results[2]), results[3]
+
+
+async def _evaluate_entry(text):
+    if LLM_COMBINED_RUBRIC:
+        evaluation = await chatgpt_evaluate_all_dimensions(text)
+        if evaluation is not None:
+            return _evaluation_scores(evaluation)
+    return await _evaluate_per_dimension(text)
+
+
+async def _evaluate_in_batch(student_entries):
+    texts = [entry['answer'] for entry in student_entries]
+    if LLM_COMBINED_RUBRIC:
+        responses = await run_prompts_in_batch([evaluate_all_dimensions_prompt(text) for text in texts], system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="evaluate_all_dimensions")
+        evaluations = [parse_rubric_evaluation(response) for response in responses]
+        fallbacks = await asyncio.gather(*(_evaluate_per_dimension(text) for text, evaluation in zip(texts, evaluations) if evaluation is None))
+        fallbacks = iter(fallbacks)
+        return [_evaluation_scores(evaluation) if evaluation is not None else next(fallbacks) for evaluation in evaluations]
+
+    prompts = []
+    for text in texts:
+        prompts.append(evaluate_creativity_prompt(text))
+        prompts.append(evaluate_depth_prompt(text))
+        prompts.append(evaluate_coherence_prompt(text))
+        prompts.append(list_grammar_mistakes_prompt(text))
+    prompt_types = ["evaluate_creativity", "evaluate_depth", "evaluate_coherence", "list_grammar_mistakes"] * len(texts)
+    results = await run_prompts_in_batch(prompts, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type=prompt_types)
+    return [(extract_number(results[4 * i]), extract_number(results[4 * i + 1]), extract_number(results[4 * i + 2]),
+             parse_grammar_mistakes(results[4 * i + 3])) for i in range(len(texts))]
+
+
+async def evaluate_all_entries(student_entries, mode="realtime"):
+    counter = ProgressCounter("evaluation", total=len(student_entries))
+    if mode == "batch":
+        results = await _evaluate_in_batch(student_entries)
+        counter.advance(len(student_entries))
+    else:
+        results = await asyncio.gather(*(counter.track(_evaluate_entry(entry['answer'])) for entry in student_entries))
+
+    for entry, scores in zip(student_entries, results):
+        apply_evaluation(entry, *scores)
+
     return student_entries
 
-async def elo_fights(student_entries, num_folds):
-    for fold in range(num_folds):
+
+def _comparison_outcomes(comparison):
+    return comparison.creativity, comparison.depth, comparison.coherence, comparison.grammar
+
+
+async def _compare_per_dimension(entry, opponent):
+    return tuple(await asyncio.gather(
+        chatgpt_compare_creativity(entry['answer'], opponent['answer']),
+        chatgpt_compare_depth(entry['answer'], opponent['answer']),
+        chatgpt_compare_coherence(entry['answer'], opponent['answer']),
+        chatgpt_compare_grammar(entry['answer'], entry['grammar_mistakes'], opponent['answer'], opponent['grammar_mistakes']),
+    ))
+
+
+async def _compare_pair(entry, opponent):
+    if LLM_COMBINED_RUBRIC:
+        comparison = await chatgpt_compare_all_dimensions(entry['answer'], entry['grammar_mistakes'], opponent['answer'], opponent['grammar_mistakes'])
+        if comparison is not None:
+            return _comparison_outcomes(comparison)
+    return await _compare_per_dimension(entry, opponent)
+
+
+async def _compare_in_batch(pairs):
+    if LLM_COMBINED_RUBRIC:
+        prompts = [compare_all_dimensions_prompt(a['answer'], a['grammar_mistakes'], b['answer'], b['grammar_mistakes']) for a, b in pairs]
+        comparisons = [parse_rubric_comparison(response) for response in await run_prompts_in_batch(prompts, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type="compare_all_dimensions")]
+        fallbacks = iter(await asyncio.gather(*(_compare_per_dimension(a, b) for (a, b), comparison in zip(pairs, comparisons) if comparison is None)))
+        return [_comparison_outcomes(comparison) if comparison is not None else next(fallbacks) for comparison in comparisons]
+
+    prompts = []
+    for a, b in pairs:
+        prompts.append(compare_creativity_prompt(a['answer'], b['answer']))
+        prompts.append(compare_depth_prompt(a['answer'], b['answer']))
+        prompts.append(compare_coherence_prompt(a['answer'], b['answer']))
+        prompts.append(compare_grammar_prompt(a['answer'], a['grammar_mistakes'], b['answer'], b['grammar_mistakes']))
+    prompt_types = ["compare_creativity", "compare_depth", "compare_coherence", "compare_grammar"] * len(pairs)
+    results = await run_prompts_in_batch(prompts, system_prompt=RUBRIC_SYSTEM_PROMPT, prompt_type=prompt_types)
+    return [tuple(results[4 * j:4 * j + 4]) for j in range(len(pairs))]
+
+
+async def elo_fights(student_entries, num_folds, mode="realtime", early_stopping=True, checkpoint=None, start_fold=0, played=None,
+                     scheduler_state=None):
+    # Ratings live in one array during the folds and are written back to the entries at the end
+    store = EloRatingStore.from_entries(student_entries)
+    scheduler = FoldScheduler(num_folds) if early_stopping else None
+    if scheduler:
+        # A resumed job keeps its smoothing window and focus instead of starting over
+        scheduler.restore(scheduler_state)
+    played = played if played is not None else set()  # pairings already fought, so later folds look for new opponents
+    for fold in range(start_fold, num_folds):
+        with phase_timer("pairing", fold=fold + 1):
+            rows = scheduler.active_rows() if scheduler else None
+            # Sorting and pairing a large cohort is CPU work, so it runs off the event loop
+            if rows is None:
+                pair_rows = await run_in_thread(swiss_pairings, store.ratings, store.ids, played, fold=fold)
+            else:
+                # Only re-compare the neighbourhoods whose order is still uncertain
+                subset = await run_in_thread(swiss_pairings, store.ratings[rows], [store.ids[r] for r in rows], played, fold=fold)
+                pair_rows = [(int(rows[i]), int(rows[j])) for i, j in subset]
+            pairs = [(student_entries[i], student_entries[j]) for i, j in pair_rows]
+
+        publish_progress("fold", fold=fold + 1, num_folds=num_folds, pairs=len(pairs))
+        counter = ProgressCounter("comparisons", total=len(pairs), fold=fold + 1)
+        with phase_timer("llm_wait", fold=fold + 1):
+            if mode == "batch":
+                results = await _compare_in_batch(pairs)
+                counter.advance(len(pairs))
+            else:
+                results = await asyncio.gather(*(counter.track(_compare_pair(entry, opponent)) for entry, opponent in pairs))
+
+        with phase_timer("elo_update", fold=fold + 1):
+            previous_ratings = store.ratings.copy()
+            store.apply_results([i for i, _ in pair_rows], [j for _, j in pair_rows], outcome_scores(results))
+            publish_progress("leaderboard", fold=fold + 1, top=store.top(LEADERBOARD_SIZE))
+        if scheduler:
+            stats = scheduler.observe(previous_ratings, store.ratings)
+            logger.info(f"Fold {fold + 1}/{num_folds}: {len(pairs)} pairs, tau={stats['kendall_tau']:.4f}, "
+                        f"mean drift={stats['mean_drift']:.2f}, active={stats['active_entries']}")
+        if checkpoint:
+            with phase_timer("checkpoint", fold=fold + 1):
+                await checkpoint.asave(student_entries, "fold", fold + 1, played, store,
+                                       scheduler.state() if scheduler else None)
+
+        if scheduler:
+            if not scheduler.should_continue():
+                logger.info(f"Stopping after {fold + 1} of {num_folds} folds.")
+                break
+
+    with phase_timer("ranking"):
+        store.write_back(student_entries)
         # Sort entries by the average Elo across all factors
         student_entries.sort(key=lambda x: (x['elo_creativity'] + x['elo_depth'] + x['elo_coherence'] + x['elo_grammar']) / 4)
-        
-        tasks = []
-        for entry in student_entries:
-            closest_opponent = select_opponent(student_entries, entry)
-            if closest_opponent:
-                tasks.append(chatgpt_compare_creativity(entry['answer'], closest_opponent['answer']))
-                tasks.append(chatgpt_compare_depth(entry['answer'], closest_opponent['answer']))
-                tasks.append(chatgpt_compare_coherence(entry['answer'], closest_opponent['answer']))
-                tasks.append(chatgpt_compare_grammar(entry['answer'], entry['grammar_mistakes'], closest_opponent['answer'], closest_opponent['grammar_mistakes']))
-
-        results = await asyncio.gather(*tasks)
-        
-        for j, entry in enumerate(student_entries):
-            closest_opponent = select_opponent(student_entries, entry)
-            update_elo(entry, closest_opponent, results[4 * j], 'elo_creativity')
-            update_elo(entry, closest_opponent, results[4 * j + 1], 'elo_depth')
-            update_elo(entry, closest_opponent, results[4 * j + 2], 'elo_coherence')
-            update_elo(entry, closest_opponent, results[4 * j + 3], 'elo_grammar')
-            
     return student_entries
 
 def select_opponent(student_entries, current_entry):
@@ -93,9 +224,25 @@ def extract_number(text):
 
 
 # Main function to execute the asynchronous process
-async def generate_elo_results(student_entries: List[OneStudentEntry], num_folds=20):
-
-    evaluated_entries = await evaluate_all_entries(student_entries)
-    elo_results = await elo_fights(evaluated_entries, num_folds)
+async def generate_elo_results(student_entries: List[OneStudentEntry], num_folds=20, mode="realtime", early_stopping=True,
+                               checkpoint=None, resume_state=None):
+    """
+    Evaluate and rank the entries. With a checkpoint, state is saved after the
+    evaluation and after every fold; pass a loaded CheckpointState as
+    `resume_state` to continue from where it stopped.
+    """
+    if resume_state is not None and resume_state.phase in ("evaluated", "fold"):
+        evaluated_entries = resume_state.entries
+        start_fold = resume_state.fold
+        played = {tuple(pair) for pair in resume_state.played}
+        scheduler_state = resume_state.scheduler
+    else:
+        with phase_timer("evaluation"):
+            evaluated_entries = await evaluate_all_entries(student_entries, mode)
+        start_fold, played, scheduler_state = 0, set(), None
+        if checkpoint:
+            with phase_timer("checkpoint", fold=0):
+                await checkpoint.asave(evaluated_entries, "evaluated")
+    elo_results = await elo_fights(evaluated_entries, num_folds, mode, early_stopping, checkpoint, start_fold, played, scheduler_state)
     
     return elo_results
@@ -0,0 +1,77 @@
+import numpy as np
+from typing import Dict, List, Sequence
+
+ELO_DIMENSIONS = ['elo_creativity', 'elo_depth', 'elo_coherence', 'elo_grammar']
+K_FACTOR = 32
+
+# Score for entry A of a compared pair; unknown answers leave both ratings unchanged
+OUTCOME_SCORES = {"A": 1.0, "B": 0.0, "DRAW": 0.5}
+
+
+def outcome_scores(results) -> np.ndarray:
+    """
+    Convert per-pair comparison answers (one "A"/"B"/"DRAW" per dimension) into
+    a P x D float array, with NaN where the answer is unusable.
+    """
+    scores = np.full((len(results), len(ELO_DIMENSIONS)), np.nan)
+    for p, outcomes in enumerate(results):
+        for d, result in enumerate(outcomes):
+            if isinstance(result, str):
+                scores[p, d] = OUTCOME_SCORES.get(result.strip(), np.nan)
+    return scores
+
+
+class EloRatingStore:
+    """
+    Ratings for a whole job as one N x D array with an id -> row index, so a fold's
+    results are applied in a single vectorized pass rather than per entry attribute.
+    """
+
+    def __init__(self, ids: Sequence[str], ratings, dimensions: Sequence[str] = ELO_DIMENSIONS):
+        self.ids: List[str] = list(ids)
+        self.index: Dict[str, int] = {entry_id: row for row, entry_id in enumerate(self.ids)}
+        self.dimensions = list(dimensions)
+        self.ratings = np.array(ratings, dtype=float).reshape(len(self.ids), len(self.dimensions))
+
+    @classmethod
+    def from_entries(cls, student_entries, dimensions: Sequence[str] = ELO_DIMENSIONS):
+        ratings = [[entry[score_type] for score_type in dimensions] for entry in student_entries]
+        return cls([entry['id'] for entry in student_entries], ratings, dimensions)
+
+    def composite(self) -> np.ndarray:
+        return self.ratings.mean(axis=1)
+
+    def apply_results(self, rows_a, rows_b, scores, k: float = K_FACTOR):
+        """
+        Standard Elo update for every compared pair and dimension at once. `scores`
+        is P x D (1 = A won, 0 = B won, 0.5 = draw, NaN = skip).
+        """
+        rows_a = np.asarray(rows_a, dtype=np.intp)
+        rows_b = np.asarray(rows_b, dtype=np.intp)
+        if rows_a.size == 0:
+            return
+        expected_a = 1 / (1 + 10 ** ((self.ratings[rows_b] - self.ratings[rows_a]) / 400))
+        delta = np.nan_to_num(k * (np.asarray(scores, dtype=float) - expected_a), nan=0.0)
+        # np.add.at accumulates correctly even if a row appears in several pairs
+        np.add.at(self.ratings, rows_a, delta)
+        np.add.at(self.ratings, rows_b, -delta)
+
+    def top(self, k):
+        """
+        The k highest entries by composite Elo, best first.
+        """
+        composite = self.composite()
+        k = min(k, len(composite))
+        if k == 0:
+            return []
+        rows = np.argpartition(-composite, k - 1)[:k]
+        rows = rows[np.argsort(-composite[rows], kind="stable")]
+        return [{'id': self.ids[row], 'elo': float(composite[row]),
+                 **dict(zip(self.dimensions, self.ratings[row].tolist()))} for row in rows]
+
+    def write_back(self, student_entries):
+        for entry in student_entries:
+            row = self.ratings[self.index[entry['id']]]
+            for score_type, value in zip(self.dimensions, row):
+                entry[score_type] = float(value)
+        return student_entries
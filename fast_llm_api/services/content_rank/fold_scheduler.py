@@ -0,0 +1,132 @@
+import numpy as np
+from collections import deque
+from typing import Dict, Optional
+from scipy.stats import kendalltau
+from fast_llm_api.services.content_rank.elo_state import K_FACTOR
+from fast_llm_api.config import FOLD_MIN_FOLDS, FOLD_WINDOW, FOLD_TAU_THRESHOLD, FOLD_DRIFT_FRACTION, FOLD_FOCUS_FRACTION
+
+# Initial ratings are 600 + (score - 1) * 100, so band edges sit halfway between score levels
+BAND_WIDTH = 100.0
+BAND_OFFSET = 50.0
+BAND_MARGIN = 10.0
+
+
+class FoldScheduler:
+    """
+    Decides between folds whether ranking has converged, and which entries still
+    need comparisons. An entry that plays every fold keeps moving by a sizeable
+    part of K even once its rating is right, so both decisions look at composite
+    ratings averaged over the last `window` folds. Convergence means the smoothed
+    rank order barely changed over the last fold (Kendall tau >= tau_threshold)
+    and smoothed ratings drift by at most drift_fraction * K per fold on average.
+    Before that, when only a small part of the cohort is still drifting (by more
+    than twice that bound), folds are focused on those entries, their rank
+    neighbours, and entries sitting near a score-band boundary.
+
+    min_folds is the fewest folds a job plays. Independently of it, neither
+    decision is taken until a full window of folds has been averaged, since a
+    shorter average still carries the per-fold noise it is meant to remove.
+    """
+
+    def __init__(self, max_folds: int, min_folds: int = FOLD_MIN_FOLDS, window: int = FOLD_WINDOW,
+                 tau_threshold: float = FOLD_TAU_THRESHOLD, drift_fraction: float = FOLD_DRIFT_FRACTION,
+                 focus_fraction: float = FOLD_FOCUS_FRACTION, k: float = K_FACTOR):
+        if min_folds < 1:
+            raise ValueError(f"min_folds ({min_folds}) must be at least 1")
+        if window < 1:
+            raise ValueError(f"window ({window}) must be at least 1")
+        self.max_folds = max_folds
+        self.min_folds = min_folds
+        self.window = window
+        self.tau_threshold = tau_threshold
+        self.drift_threshold = drift_fraction * k
+        self.focus_fraction = focus_fraction
+        self.history = []
+        self._recent = deque(maxlen=window + 1)  # composite ratings after the last folds, oldest first
+        self._active = None
+
+    def observe(self, previous_ratings, ratings):
+        """
+        Record the change made by one fold. Both arguments are N x D rating arrays.
+        """
+        if not self._recent:
+            self._recent.append(np.asarray(previous_ratings, dtype=float).mean(axis=1))
+        self._recent.append(np.asarray(ratings, dtype=float).mean(axis=1))
+        snapshots = list(self._recent)
+        # Moving averages ending at this fold and at the previous one
+        width = min(self.window, len(snapshots) - 1)
+        current = np.mean(snapshots[-width:], axis=0)
+        previous = np.mean(snapshots[-width - 1:-1], axis=0)
+        drift = np.abs(current - previous)
+        tau = kendalltau(previous, current).statistic if len(current) > 1 else 1.0
+        tau = 1.0 if np.isnan(tau) else float(tau)
+        self._active = self._active_mask(current, drift)
+
+        stats = {
+            "fold": len(self.history) + 1,
+            "kendall_tau": tau,
+            "mean_drift": float(drift.mean()) if len(drift) else 0.0,
+            "active_entries": int(self._active.sum()),
+        }
+        self.history.append(stats)
+        return stats
+
+    def _active_mask(self, current, drift):
+        active = drift > 2 * self.drift_threshold
+        # Keep rank neighbours of drifting entries active so they still have opponents
+        order = np.argsort(current, kind="stable")
+        ranked_active = active[order]
+        spread = ranked_active.copy()
+        spread[1:] |= ranked_active[:-1]
+        spread[:-1] |= ranked_active[1:]
+        active[order] = spread
+        distance_to_edge = np.abs(((current - BAND_OFFSET) + BAND_WIDTH / 2) % BAND_WIDTH - BAND_WIDTH / 2)
+        return active | (distance_to_edge <= BAND_MARGIN)
+
+    def _settled(self):
+        # At least min_folds played, and the moving average spans a full window
+        return len(self.history) >= max(self.min_folds, self.window)
+
+    def converged(self):
+        if not self._settled():
+            return False
+        last = self.history[-1]
+        return last["kendall_tau"] >= self.tau_threshold and last["mean_drift"] <= self.drift_threshold
+
+    def should_continue(self):
+        if len(self.history) >= self.max_folds:
+            return False
+        if not self._settled():
+            return True
+        if self._active is not None and self._active.sum() < 2:
+            return False
+        return not self.converged()
+
+    def active_rows(self):
+        """
+        Rows to pair in the next fold, or None for the whole cohort.
+        """
+        if self._active is None or not self._settled():
+            return None
+        if self._active.mean() > self.focus_fraction:
+            return None
+        return np.flatnonzero(self._active)
+
+    def state(self) -> Dict:
+        """
+        What a checkpoint needs to carry the scheduler across a resume.
+        """
+        return {
+            "history": list(self.history),
+            "recent": [snapshot.tolist() for snapshot in self._recent],
+            "active": self._active.tolist() if self._active is not None else None,
+        }
+
+    def restore(self, state: Optional[Dict]):
+        if not state:
+            return
+        self.history = list(state.get("history") or [])
+        self._recent.clear()
+        self._recent.extend(np.asarray(snapshot, dtype=float) for snapshot in state.get("recent") or [])
+        active = state.get("active")
+        self._active = np.asarray(active, dtype=bool) if active is not None else None
@@ -0,0 +1,80 @@
+import numpy as np
+from typing import List, Optional, Sequence, Set, Tuple
+
+# How many unpaired neighbours (in composite-Elo order) are considered for each entry
+PAIRING_WINDOW = 8
+
+
+def pair_key(id_a, id_b):
+    return (id_a, id_b) if id_a <= id_b else (id_b, id_a)
+
+
+def swiss_pairings(ratings, ids: Sequence[str], played: Optional[Set[Tuple[str, str]]] = None,
+                   window: int = PAIRING_WINDOW, fold: int = 0) -> List[Tuple[int, int]]:
+    """
+    Compute a full matching for one fold in O(N log N + N * window).
+
+    Entries are sorted by composite (mean) Elo and each unpaired entry is matched
+    with the closest unpaired neighbour, by summed Elo difference across all
+    dimensions, among the next `window` unpaired entries. Neighbours already met
+    in `played` are skipped unless every candidate in the window is a rematch.
+    Every entry fights at most once; with an odd count one entry sits out, and the
+    sweep direction alternates by fold so the bye doesn't always land on the same end.
+
+    `ratings` is an N x D array (or nested sequence) of Elo values. Returns index
+    pairs into `ids`; `played` is updated in place with the new pairings.
+    """
+    ratings = np.asarray(ratings, dtype=float)
+    n = len(ids)
+    if n < 2:
+        return []
+    played = played if played is not None else set()
+
+    order = np.argsort(ratings.mean(axis=1), kind="stable")
+    if fold % 2 == 1:
+        order = order[::-1]
+    ordered = ratings[order]
+
+    # Doubly linked list over unpaired positions so paired ones are skipped in O(1)
+    next_unpaired = list(range(1, n + 1))
+    prev_unpaired = list(range(-1, n - 1))
+
+    def remove(position):
+        before, after = prev_unpaired[position], next_unpaired[position]
+        if before >= 0:
+            next_unpaired[before] = after
+        if after < n:
+            prev_unpaired[after] = before
+
+    pairs = []
+    position = 0
+    while position < n:
+        candidates = []
+        candidate = next_unpaired[position]
+        while candidate < n and len(candidates) < window:
+            candidates.append(candidate)
+            candidate = next_unpaired[candidate]
+        if not candidates:
+            break
+
+        distances = np.abs(ordered[candidates] - ordered[position]).sum(axis=1)
+        current_id = ids[order[position]]
+        best, best_rematch = None, None
+        for candidate, distance in zip(candidates, distances):
+            if pair_key(current_id, ids[order[candidate]]) in played:
+                if best_rematch is None or distance < best_rematch[1]:
+                    best_rematch = (candidate, distance)
+            elif best is None or distance < best[1]:
+                best = (candidate, distance)
+        partner = (best or best_rematch)[0]
+
+        i, j = int(order[position]), int(order[partner])
+        pairs.append((i, j))
+        played.add(pair_key(ids[i], ids[j]))
+        following = next_unpaired[position]
+        if following == partner:
+            following = next_unpaired[partner]
+        remove(position)
+        remove(partner)
+        position = following
+    return pairs
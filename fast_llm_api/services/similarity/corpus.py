@@ -0,0 +1,300 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from fast_llm_api.config import SIMILARITY_CORPUS_DIR, SIMILARITY_BLOCK_ELEMENTS, SIMILARITY_TOP_K
+from fast_llm_api.services.similarity.top_k import select_top_k
+
+SIMILARITY_SCOPES = ("job", "school", "all")
+NORM_CHUNK_ROWS = 65536
+
+# Binary CSR files and their element types
+_ARRAYS = {'indptr': np.int64, 'indices': np.int32, 'data': np.float32}
+_EMPTY_META = {'num_docs': 0, 'nnz': 0, 'vocabulary_size': 0, 'vocabulary_bytes': 0, 'documents_bytes': 0}
+
+
+def text_digest(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def document_key(doc_id, job_id, digest) -> Tuple:
+    # Client ids are only unique within one request, so the job and the text are part of a row's identity
+    return job_id, doc_id, digest
+
+
+class TfidfCorpus:
+    """
+    Append-only corpus of document term counts shared by every job.
+
+    Rows form one CSR matrix split over three binary files (indptr, indices,
+    data) that are memory-mapped for queries. The vocabulary only grows, so
+    older rows stay valid as new terms arrive. Raw counts are stored and IDF
+    weights come from the current document frequencies at query time, matching
+    TfidfVectorizer's defaults (smooth IDF, L2-normalised rows).
+
+    meta.json is written last and is the commit point: anything past its counts
+    was left by an interrupted append and is truncated by the next one.
+    """
+
+    def __init__(self, directory: str = SIMILARITY_CORPUS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._meta: Optional[Dict] = None
+        self.terms: List[str] = []
+        self.vocabulary: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.doc_ids: List[str] = []
+        self.doc_jobs: List[Optional[str]] = []
+        self.doc_schools: List[Optional[str]] = []
+        self._row_of: Dict[Tuple, int] = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def num_docs(self):
+        return len(self.doc_ids)
+
+    @contextmanager
+    def _file_lock(self):
+        # Serialises appends across uvicorn workers sharing the directory
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return dict(_EMPTY_META)
+
+    @staticmethod
+    def _read_lines(path, count):
+        lines = []
+        if count:
+            with open(path, encoding="utf-8") as f:
+                for _ in range(count):
+                    lines.append(f.readline().rstrip("\n"))
+        return lines
+
+    def refresh(self):
+        """
+        Reload vocabulary, document frequencies and the document list when another
+        job (or worker) has appended since the last look.
+        """
+        meta = self._read_meta()
+        if meta == self._meta:
+            return
+        self.terms = self._read_lines(self._path("vocabulary.txt"), meta['vocabulary_size'])
+        self.vocabulary = {term: column for column, term in enumerate(self.terms)}
+        self.df = np.zeros(meta['vocabulary_size'], dtype=np.int64)
+        if meta['vocabulary_size']:
+            self.df[:] = np.load(self._path("df.npy"))[:meta['vocabulary_size']]
+        documents = [json.loads(line) for line in self._read_lines(self._path("documents.jsonl"), meta['num_docs'])]
+        self.doc_ids = [document['id'] for document in documents]
+        self.doc_jobs = [document.get('job_id') for document in documents]
+        self.doc_schools = [document.get('school') for document in documents]
+        self._row_of = {document_key(document['id'], document.get('job_id'), document.get('digest')): row
+                        for row, document in enumerate(documents)}
+        self._meta = meta
+
+    def _count_terms(self, texts):
+        """
+        Term counts of `texts` over the corpus vocabulary, adding unseen terms.
+        """
+        try:
+            vectorizer = CountVectorizer()  # same tokenisation as TfidfVectorizer
+            counts = vectorizer.fit_transform(texts).tocsr()
+        except ValueError:  # no tokens at all
+            return sparse.csr_matrix((len(texts), len(self.terms)), dtype=np.float32)
+        columns = np.empty(len(vectorizer.vocabulary_), dtype=np.int32)
+        for term, batch_column in vectorizer.vocabulary_.items():
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = len(self.terms)
+                self.terms.append(term)
+                self.vocabulary[term] = column
+            columns[batch_column] = column
+        self.df = np.concatenate([self.df, np.zeros(len(self.terms) - len(self.df), dtype=np.int64)])
+        counts = sparse.csr_matrix((counts.data.astype(np.float32), columns[counts.indices], counts.indptr),
+                                   shape=(len(texts), len(self.terms)))
+        counts.sort_indices()
+        return counts
+
+    def _append_array(self, name, values, committed):
+        dtype = np.dtype(_ARRAYS[name])
+        with open(self._path(f"{name}.bin"), "ab") as f:
+            f.truncate(committed * dtype.itemsize)
+            f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def _append_lines(self, name, lines, committed_bytes):
+        payload = "".join(line + "\n" for line in lines).encode("utf-8")
+        with open(self._path(name), "ab") as f:
+            f.truncate(committed_bytes)
+            f.write(payload)
+        return committed_bytes + len(payload)
+
+    def add_documents(self, ids: Sequence[str], texts: Sequence[str], job_id: Optional[str] = None,
+                      school: Optional[str] = None) -> np.ndarray:
+        """
+        Append the documents not in the corpus yet and return the corpus row of
+        every one. A document is already there only if the same job stored the
+        same id with the same text, so a reused id never stands in for new text.
+        """
+        with self._lock, self._file_lock():
+            self.refresh()
+            meta = dict(self._meta)
+            keys = [document_key(doc_id, job_id, text_digest(text)) for doc_id, text in zip(ids, texts)]
+            new = {}
+            for key, text in zip(keys, texts):
+                if key not in self._row_of and key not in new:
+                    new[key] = text
+            if new:
+                vocabulary_size = len(self.terms)
+                counts = self._count_terms(list(new.values()))
+                self.df += np.bincount(counts.indices, minlength=len(self.terms))
+
+                indptr = counts.indptr.astype(np.int64) + meta['nnz']
+                if meta['num_docs']:
+                    self._append_array('indptr', indptr[1:], meta['num_docs'] + 1)
+                else:
+                    self._append_array('indptr', indptr, 0)
+                self._append_array('indices', counts.indices, meta['nnz'])
+                self._append_array('data', counts.data, meta['nnz'])
+                meta['vocabulary_bytes'] = self._append_lines("vocabulary.txt", self.terms[vocabulary_size:], meta['vocabulary_bytes'])
+                documents = [json.dumps({'id': doc_id, 'job_id': job_id, 'school': school, 'digest': digest}, ensure_ascii=False)
+                             for _, doc_id, digest in new]
+                meta['documents_bytes'] = self._append_lines("documents.jsonl", documents, meta['documents_bytes'])
+                np.save(self._path("df.tmp.npy"), self.df)
+                os.replace(self._path("df.tmp.npy"), self._path("df.npy"))
+
+                meta.update(num_docs=meta['num_docs'] + len(new), nnz=meta['nnz'] + counts.nnz, vocabulary_size=len(self.terms))
+                with open(self._path("meta.tmp.json"), "w") as f:
+                    json.dump(meta, f)
+                os.replace(self._path("meta.tmp.json"), self._path("meta.json"))
+                for key in new:
+                    doc_id = key[1]
+                    self._row_of[key] = len(self.doc_ids)
+                    self.doc_ids.append(doc_id)
+                    self.doc_jobs.append(job_id)
+                    self.doc_schools.append(school)
+                self._meta = meta
+            return np.array([self._row_of[key] for key in keys], dtype=np.int64)
+
+    def counts(self) -> sparse.csr_matrix:
+        """
+        The whole corpus as a CSR matrix of raw counts over the memory-mapped files.
+        """
+        meta = self._meta or _EMPTY_META
+        if not meta['num_docs']:
+            return sparse.csr_matrix((0, len(self.terms)), dtype=np.float32)
+        arrays = {}
+        for name, length in (('indptr', meta['num_docs'] + 1), ('indices', meta['nnz']), ('data', meta['nnz'])):
+            arrays[name] = np.memmap(self._path(f"{name}.bin"), dtype=_ARRAYS[name], mode='r', shape=(length,)) \
+                if length else np.zeros(0, dtype=_ARRAYS[name])
+        return sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                 shape=(meta['num_docs'], meta['vocabulary_size']), copy=False)
+
+    def idf(self) -> np.ndarray:
+        return (np.log((1 + self.num_docs) / (1 + self.df)) + 1).astype(np.float32)
+
+    def scope_rows(self, scope: str, job_id: Optional[str] = None, school: Optional[str] = None) -> Optional[np.ndarray]:
+        """
+        Corpus rows a query may match: None for all history, otherwise the rows of
+        the same school or of the same job.
+        """
+        if scope == "all":
+            return None
+        if scope == "school":
+            return np.array([row for row, value in enumerate(self.doc_schools) if value == school], dtype=np.int64)
+        if scope == "job":
+            return np.array([row for row, value in enumerate(self.doc_jobs) if value == job_id], dtype=np.int64)
+        raise ValueError(f"Unknown similarity scope: {scope}")
+
+    def top_k_similar(self, query_rows: np.ndarray, k: int = SIMILARITY_TOP_K, rows: Optional[np.ndarray] = None,
+                      max_block_elements: int = SIMILARITY_BLOCK_ELEMENTS):
+        """
+        Top-k TF-IDF cosine neighbours of corpus rows `query_rows` among `rows`
+        (all rows when None), excluding each query itself. Blocks of queries are
+        scored against the memory-mapped counts without copying them; IDF weights
+        are folded into the queries and the candidates' norms.
+        Returns per-query lists of corpus rows and of scores.
+        """
+        counts = self.counts()
+        candidates = counts if rows is None else counts[rows]
+        candidate_rows = np.arange(counts.shape[0]) if rows is None else rows
+        idf = self.idf()
+        # cos(q, c) = (q * idf) . (c * idf) / (|q * idf| |c * idf|)
+        queries = normalize(counts[query_rows].multiply(idf).tocsr()).multiply(idf).tocsr()
+        norms = np.empty(candidates.shape[0], dtype=np.float32)
+        for start in range(0, candidates.shape[0], NORM_CHUNK_ROWS):
+            chunk = candidates[start:start + NORM_CHUNK_ROWS]
+            norms[start:start + NORM_CHUNK_ROWS] = np.sqrt(chunk.multiply(chunk) @ (idf ** 2))
+        norms[norms == 0] = 1
+
+        position_of = {int(row): position for position, row in enumerate(candidate_rows)}
+        self_positions = np.array([position_of.get(int(row), -1) for row in query_rows], dtype=np.int64)
+        m = candidates.shape[0]
+        k = max(0, min(k, m - int((self_positions >= 0).any())))
+        neighbours = [[] for _ in query_rows]
+        scores = [[] for _ in query_rows]
+        if k == 0:
+            return neighbours, scores
+
+        block_rows = max(1, max_block_elements // m)
+        for start in range(0, len(query_rows), block_rows):
+            stop = min(len(query_rows), start + block_rows)
+            block = (candidates @ queries[start:stop].T).T.toarray() / norms
+            own = self_positions[start:stop]
+            masked = np.flatnonzero(own >= 0)
+            block[masked, own[masked]] = -np.inf
+            top, top_scores = select_top_k(block, k)
+            for offset in range(stop - start):
+                valid = np.isfinite(top_scores[offset])
+                neighbours[start + offset] = candidate_rows[top[offset][valid]].tolist()
+                scores[start + offset] = top_scores[offset][valid].tolist()
+        return neighbours, scores
+
+    def neighbours(self, ids, texts, k: int = SIMILARITY_TOP_K, scope: str = "all", job_id: Optional[str] = None,
+                   school: Optional[str] = None):
+        """
+        Add the texts to the corpus, then list each one's most similar documents
+        within `scope` as {"id", "job_id", "score"} dicts.
+        """
+        query_rows = self.add_documents(ids, texts, job_id, school)
+        with self._lock:
+            rows, scores = self.top_k_similar(query_rows, k, self.scope_rows(scope, job_id, school))
+            return [[{"id": self.doc_ids[row], "job_id": self.doc_jobs[row], "score": float(score)}
+                     for row, score in zip(entry_rows, entry_scores)]
+                    for entry_rows, entry_scores in zip(rows, scores)]
+
+
+# One corpus object per directory and process (pool workers keep their own)
+_corpora: Dict[str, TfidfCorpus] = {}
+
+
+def get_corpus(directory: Optional[str] = None) -> TfidfCorpus:
+    directory = directory or SIMILARITY_CORPUS_DIR
+    if directory not in _corpora:
+        _corpora[directory] = TfidfCorpus(directory)
+    return _corpora[directory]
+
+
+def corpus_neighbours(directory, ids, texts, k=SIMILARITY_TOP_K, scope="all", job_id=None, school=None):
+    return get_corpus(directory).neighbours(ids, texts, k, scope, job_id, school)
+
+
+def corpus_add_documents(directory, ids, texts, job_id=None, school=None):
+    get_corpus(directory).add_documents(ids, texts, job_id, school)
@@ -0,0 +1,309 @@
+import os
+import re
+import json
+import fcntl
+import threading
+import numpy as np
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+from fast_llm_api.services.similarity.corpus import document_key, text_digest
+from fast_llm_api.config import MINHASH_NUM_PERM, MINHASH_BANDS, MINHASH_SHINGLE_SIZE, MINHASH_MAX_BUCKET_PAIRS, MINHASH_INDEX_DIR
+
+MINHASH_SEED = 1
+_SHINGLE_BASE = np.uint64(1000003)
+_WHITESPACE = re.compile(r"\s+")
+_EMPTY_SLOT = np.iinfo(np.uint32).max
+
+
+def shingle_hashes(text: str, shingle_size: int = MINHASH_SHINGLE_SIZE) -> np.ndarray:
+    """
+    64-bit hashes of the distinct character n-grams of a text. Characters rather
+    than words, so Korean text without reliable word boundaries shingles well too.
+    """
+    text = _WHITESPACE.sub(" ", text).strip().lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) == 0:
+        return codes
+    size = min(shingle_size, len(codes))
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        hashes = hashes * _SHINGLE_BASE + codes[offset:offset + count]  # wraps mod 2^64
+    return np.unique(hashes)
+
+
+class MinHashLSHIndex:
+    """
+    MinHash signatures of character shingles, bucketed by LSH bands so documents
+    sharing any band are returned as near-duplicate candidates without comparing
+    every pair. With b bands of r rows, pairs above a Jaccard similarity of about
+    (1/b)^(1/r) are very likely to become candidates.
+    """
+
+    def __init__(self, num_perm: int = MINHASH_NUM_PERM, bands: int = MINHASH_BANDS,
+                 shingle_size: int = MINHASH_SHINGLE_SIZE, seed: int = MINHASH_SEED):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash family: ((a * x + b) mod 2^64) >> 32 with odd a
+        self._a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+        self.ids: List[Hashable] = []
+        self._positions: Dict[Hashable, int] = {}
+        self._signatures: List[np.ndarray] = []
+        self._buckets = [defaultdict(list) for _ in range(bands)]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._positions
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingle_hashes(text, self.shingle_size)
+        if len(hashes) == 0:
+            return np.full(self.num_perm, _EMPTY_SLOT, dtype=np.uint32)
+        permuted = (hashes[:, None] * self._a + self._b) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, doc_id: Hashable, text: Optional[str] = None, signature: Optional[np.ndarray] = None):
+        """
+        Index one document by text or precomputed signature. An id already in the
+        index keeps its first signature.
+        """
+        if doc_id in self._positions:
+            return
+        if signature is None:
+            signature = self.signature(text)
+        position = len(self.ids)
+        self.ids.append(doc_id)
+        self._positions[doc_id] = position
+        self._signatures.append(signature)
+        if np.all(signature == _EMPTY_SLOT):
+            return  # empty texts would all collide with each other
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(position)
+
+    def candidates(self, signature: np.ndarray) -> Set[int]:
+        positions = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            positions.update(self._buckets[band].get(key, ()))
+        return positions
+
+    def query(self, text: Optional[str] = None, signature: Optional[np.ndarray] = None,
+              top_k: Optional[int] = None) -> List[Tuple[Hashable, float]]:
+        """
+        Indexed documents sharing a band with the query, as (id, estimated Jaccard)
+        pairs in decreasing order of similarity.
+        """
+        if signature is None:
+            signature = self.signature(text)
+        matches = [(self.ids[position], self.jaccard(signature, self._signatures[position]))
+                   for position in self.candidates(signature)]
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:top_k] if top_k is not None else matches
+
+    def candidate_pairs(self, max_bucket_pairs: int = MINHASH_MAX_BUCKET_PAIRS) -> np.ndarray:
+        """
+        Position pairs (i < j) of indexed documents that share at least one band,
+        as an M x 2 array. Within a bucket each document is paired with at most the
+        next `max_bucket_pairs` members, so a band shared by boilerplate text across
+        thousands of documents cannot blow up to a quadratic number of pairs.
+        """
+        chunks = []
+        for buckets in self._buckets:
+            for positions in buckets.values():
+                if len(positions) < 2:
+                    continue
+                members = np.asarray(positions, dtype=np.int64)
+                for step in range(1, min(len(members), max_bucket_pairs + 1)):
+                    chunks.append(np.stack([members[:-step], members[step:]], axis=1))
+        if not chunks:
+            return np.zeros((0, 2), dtype=np.int64)
+        pairs = np.sort(np.concatenate(chunks), axis=1)
+        return np.unique(pairs, axis=0)
+
+    @staticmethod
+    def jaccard(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+        return float(np.mean(signature_a == signature_b))
+
+    def save(self, path: str):
+        """
+        Write ids and signatures to an .npz file; buckets are rebuilt on load.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        signatures = np.vstack(self._signatures) if self._signatures else np.zeros((0, self.num_perm), dtype=np.uint32)
+        temporary_path = f"{path}.tmp.npz"
+        np.savez(temporary_path, ids=np.array([str(doc_id) for doc_id in self.ids]), signatures=signatures,
+                 params=np.array([self.num_perm, self.bands, self.shingle_size, self.seed]))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MinHashLSHIndex":
+        with np.load(path) as data:
+            num_perm, bands, shingle_size, seed = (int(value) for value in data['params'])
+            index = cls(num_perm, bands, shingle_size, seed)
+            for doc_id, signature in zip(data['ids'].tolist(), data['signatures']):
+                index.add(doc_id, signature=signature)
+        return index
+
+
+class PersistentMinHashIndex:
+    """
+    Append-only MinHash index of previous submissions shared by every job.
+
+    Signatures are appended to signatures.bin and one {id, job_id, digest} line
+    per row to documents.jsonl under an exclusive file lock, so uvicorn workers
+    sharing the directory never lose each other's rows. Rows are keyed like the
+    TF-IDF corpus's, since client ids are only unique within one request.
+    meta.json is written last and is the commit point, as in TfidfCorpus. Each
+    process keeps its index in memory and only reads the rows appended since its
+    last look, so a job never rebuilds the LSH buckets.
+    """
+
+    def __init__(self, directory: str, num_perm: int = MINHASH_NUM_PERM, bands: int = MINHASH_BANDS,
+                 shingle_size: int = MINHASH_SHINGLE_SIZE, seed: int = MINHASH_SEED):
+        self.directory = directory
+        self.index = MinHashLSHIndex(num_perm, bands, shingle_size, seed)
+        self._lock = threading.Lock()
+        self._meta: Optional[Dict] = None
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def _params(self):
+        return [self.index.num_perm, self.index.bands, self.index.shingle_size, self.index.seed]
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path("lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        try:
+            with open(self._path("meta.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'num_docs': 0, 'documents_bytes': 0, 'params': self._params}
+
+    def refresh(self):
+        """
+        Add the rows other jobs (or workers) committed since the last look.
+        """
+        meta = self._read_meta()
+        seen = self._meta or {'num_docs': 0, 'documents_bytes': 0}
+        if meta['num_docs'] == seen['num_docs']:
+            self._meta = meta
+            return
+        if self._meta is None and meta['params'] != self._params:
+            # Signatures are only comparable under the parameters they were made with
+            self.index = MinHashLSHIndex(*meta['params'])
+        with open(self._path("documents.jsonl"), "rb") as f:
+            f.seek(seen['documents_bytes'])
+            lines = f.read(meta['documents_bytes'] - seen['documents_bytes']).decode("utf-8").splitlines()
+        documents = [json.loads(line) for line in lines]
+        signatures = np.fromfile(self._path("signatures.bin"), dtype=np.uint32, count=len(documents) * self.index.num_perm,
+                                 offset=seen['num_docs'] * self.index.num_perm * np.dtype(np.uint32).itemsize
+                                 ).reshape(len(documents), self.index.num_perm)
+        for document, signature in zip(documents, signatures):
+            key = document_key(document['id'], document.get('job_id'), document.get('digest'))
+            self.index.add(key, signature=signature)
+        self._meta = meta
+
+    def _append(self, name, payload: bytes, committed_bytes):
+        with open(self._path(name), "ab") as f:
+            f.truncate(committed_bytes)
+            f.write(payload)
+        return committed_bytes + len(payload)
+
+    def _commit(self, new: Dict[Tuple, np.ndarray]):
+        meta = dict(self._meta)
+        signature_bytes = self.index.num_perm * np.dtype(np.uint32).itemsize
+        self._append("signatures.bin", np.vstack(list(new.values())).astype(np.uint32).tobytes(), meta['num_docs'] * signature_bytes)
+        documents = "".join(json.dumps({'id': doc_id, 'job_id': job_id, 'digest': digest}, ensure_ascii=False) + "\n"
+                            for job_id, doc_id, digest in new)
+        meta['documents_bytes'] = self._append("documents.jsonl", documents.encode("utf-8"), meta['documents_bytes'])
+        meta['num_docs'] += len(new)
+        with open(self._path("meta.tmp.json"), "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path("meta.tmp.json"), self._path("meta.json"))
+        for key, signature in new.items():
+            self.index.add(key, signature=signature)
+        self._meta = meta
+
+    def match_and_add(self, ids: Sequence[str], texts: Sequence[str], job_id: Optional[str] = None,
+                      top_k: Optional[int] = None) -> List[List[Tuple[Tuple, float]]]:
+        """
+        Look each text up among the submissions indexed so far, then index the
+        texts. Returns per-text (document key, estimated Jaccard) pairs, where a
+        key is (job_id, id, digest) as in corpus.document_key. Only the text's
+        own row is left out, so a reused id with copied text still matches.
+        """
+        with self._lock:
+            if self._meta is None:
+                # Hash with the parameters the stored signatures were made with
+                with self._file_lock():
+                    self.refresh()
+            keys = [document_key(doc_id, job_id, text_digest(text)) for doc_id, text in zip(ids, texts)]
+            signatures = [self.index.signature(text) for text in texts]
+            with self._file_lock():
+                self.refresh()
+                matches = [[(match, score) for match, score in self.index.query(signature=signature) if match != key][:top_k]
+                           for key, signature in zip(keys, signatures)]
+                new = {}
+                for key, signature in zip(keys, signatures):
+                    if key not in self.index and key not in new:
+                        new[key] = signature
+                if new:
+                    self._commit(new)
+        return matches
+
+
+# One index per directory and process
+_persistent_indexes: Dict[str, PersistentMinHashIndex] = {}
+
+
+def get_persistent_index(directory: str = MINHASH_INDEX_DIR) -> PersistentMinHashIndex:
+    if directory not in _persistent_indexes:
+        _persistent_indexes[directory] = PersistentMinHashIndex(directory)
+    return _persistent_indexes[directory]
+
+
+def rank_candidate_pairs(count: int, pairs: np.ndarray, scores: np.ndarray, top_k: int):
+    """
+    Turn scored candidate pairs into each row's best `top_k` neighbours.
+    Returns per-row lists of indices and of scores, in decreasing order.
+    """
+    neighbours = [[] for _ in range(count)]
+    neighbour_scores = [[] for _ in range(count)]
+    if len(pairs) == 0:
+        return neighbours, neighbour_scores
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    both_scores = np.concatenate([scores, scores])
+    order = np.lexsort((-both_scores, rows))
+    rows, cols, both_scores = rows[order], cols[order], both_scores[order]
+    starts = np.searchsorted(rows, np.arange(count))
+    ends = np.searchsorted(rows, np.arange(count), side='right')
+    for row in range(count):
+        stop = min(ends[row], starts[row] + top_k)
+        neighbours[row] = cols[starts[row]:stop].tolist()
+        neighbour_scores[row] = both_scores[starts[row]:stop].tolist()
+    return neighbours, neighbour_scores
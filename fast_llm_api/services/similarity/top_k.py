@@ -0,0 +1,97 @@
+import asyncio
+import numpy as np
+from typing import Tuple
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from fast_llm_api.config import SIMILARITY_TOP_K, SIMILARITY_BLOCK_ELEMENTS, ANALYSIS_PROCESS_WORKERS
+from fast_llm_api.helpers.executors import run_in_process, share_csr, attach_csr, release_shared, unlink_shared
+
+
+def select_top_k(block: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Column indices and scores of the `k` largest scores in each row of a dense block,
+    ordered by decreasing score.
+    """
+    top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(block, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _top_k_rows(vectors, transposed, start, stop, k, max_block_elements):
+    n = vectors.shape[0]
+    indices = np.zeros((stop - start, k), dtype=np.int64)
+    scores = np.zeros((stop - start, k), dtype=np.float32)
+    block_rows = max(1, max_block_elements // n)
+    for block_start in range(start, stop, block_rows):
+        block_stop = min(stop, block_start + block_rows)
+        block = (vectors[block_start:block_stop] @ transposed).toarray()
+        rows = np.arange(block_stop - block_start)
+        block[rows, rows + block_start] = -np.inf  # mask each row's match with itself
+        indices[block_start - start:block_stop - start], scores[block_start - start:block_stop - start] = select_top_k(block, k)
+    return indices, scores
+
+
+def top_k_similar(vectors, k: int = SIMILARITY_TOP_K,
+                  max_block_elements: int = SIMILARITY_BLOCK_ELEMENTS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k cosine neighbours of every row of a sparse matrix, excluding the row itself.
+
+    Rows are L2-normalised so a block of cosine scores is a single sparse product
+    X[block] @ X.T. Blocks are sized so at most `max_block_elements` scores are
+    held at once, and the N x N matrix is never materialised.
+
+    Returns (indices, scores), both N x k, ordered by decreasing score.
+    """
+    n = vectors.shape[0]
+    k = max(0, min(k, n - 1))
+    if k == 0:
+        return np.zeros((n, 0), dtype=np.int64), np.zeros((n, 0), dtype=np.float32)
+    vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32), norm='l2', copy=False)
+    return _top_k_rows(vectors, vectors.T.tocsr(), 0, n, k, max_block_elements)
+
+
+def tfidf_to_shared(texts):
+    """
+    Process-pool task: vectorise texts and hand the normalised matrix and its
+    transpose back through shared memory instead of pickling them.
+    """
+    vectors = normalize(TfidfVectorizer(dtype=np.float32).fit_transform(texts), norm='l2', copy=False)
+    shared_vectors, vector_blocks = share_csr(vectors)
+    shared_transposed, transposed_blocks = share_csr(vectors.T.tocsr())
+    release_shared(vector_blocks + transposed_blocks)  # the caller unlinks them
+    return shared_vectors, shared_transposed
+
+
+def top_k_rows_shared(shared_vectors, shared_transposed, start, stop, k, max_block_elements=SIMILARITY_BLOCK_ELEMENTS):
+    """
+    Process-pool task: top-k neighbours of rows [start, stop) of a shared matrix.
+    """
+    vectors, vector_blocks = attach_csr(shared_vectors)
+    transposed, transposed_blocks = attach_csr(shared_transposed)
+    try:
+        return _top_k_rows(vectors, transposed, start, stop, k, max_block_elements)
+    finally:
+        del vectors, transposed
+        release_shared(vector_blocks + transposed_blocks)
+
+
+async def parallel_top_k_similar(texts, k: int = SIMILARITY_TOP_K, workers: int = ANALYSIS_PROCESS_WORKERS):
+    """
+    TF-IDF top-k neighbours with vectorising and scoring in the process pool.
+    The matrix is shared with the workers, each of which scores a range of rows.
+    """
+    n = len(texts)
+    k = max(0, min(k, n - 1))
+    shared_vectors, shared_transposed = await run_in_process(tfidf_to_shared, texts)
+    try:
+        if k == 0:
+            return np.zeros((n, 0), dtype=np.int64), np.zeros((n, 0), dtype=np.float32)
+        bounds = np.linspace(0, n, max(1, workers) * 2 + 1, dtype=int)
+        parts = await asyncio.gather(*(run_in_process(top_k_rows_shared, shared_vectors, shared_transposed, int(start), int(stop), k)
+                                       for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start))
+        return np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts])
+    finally:
+        unlink_shared(shared_vectors)
+        unlink_shared(shared_transposed)
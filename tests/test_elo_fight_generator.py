@@ -0,0 +1,270 @@
+import json
+import asyncio
+import numpy as np
+import pytest
+
+from fast_llm_api.helpers import async_llm_helpers
+from fast_llm_api.services.models import OneStudentEntry
+from fast_llm_api.services.content_rank import elo_fight_generator
+from fast_llm_api.services.content_rank.pairing import swiss_pairings, pair_key
+from fast_llm_api.services.content_rank.elo_state import ELO_DIMENSIONS, EloRatingStore, outcome_scores
+from fast_llm_api.services.content_rank.fold_scheduler import FoldScheduler
+from fast_llm_api.services.content_rank.checkpoint import JobCheckpoint
+
+
+def fake_llm(calls, broken_combined=False):
+    async def call(prompt, **kwargs):
+        calls.append(prompt)
+        if "four dimensions" in prompt and "Evaluate" in prompt:
+            if broken_combined:
+                return "creativity: 7"
+            return json.dumps({"creativity": 7, "depth": 6, "coherence": 4, "grammar_mistakes": []})
+        if "four dimensions" in prompt:
+            return json.dumps({"creativity": "A", "depth": "b", "coherence": "DRAW", "grammar": "A"})
+        if "grammatical mistakes" in prompt:
+            return "[]"
+        if "Compare" in prompt:
+            return "A"
+        return "5"
+    return call
+
+
+def make_entries(n):
+    return [OneStudentEntry(id=str(i), answer=f"essay number {i}") for i in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_combined_evaluation_uses_one_call_per_entry(monkeypatch):
+    calls = []
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", fake_llm(calls))
+    entries = await elo_fight_generator.evaluate_all_entries(make_entries(3))
+    assert len(calls) == 3
+    assert entries[0]['creativity_score'] == 7
+    assert entries[0]['elo_coherence'] == 900
+    assert entries[0]['grammar_mistake_count'] == 0
+
+
+@pytest.mark.asyncio
+async def test_unparseable_combined_evaluation_falls_back(monkeypatch):
+    calls = []
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", fake_llm(calls, broken_combined=True))
+    entries = await elo_fight_generator.evaluate_all_entries(make_entries(2))
+    assert len(calls) == 2 + 2 * 4
+    assert entries[1]['depth_score'] == 5
+
+
+def test_parse_rubric_comparison_normalises_case():
+    comparison = async_llm_helpers.parse_rubric_comparison('```json\n{"creativity": "a", "depth": "B", "coherence": "draw", "grammar": "A"}\n```')
+    assert (comparison.creativity, comparison.coherence) == ("A", "DRAW")
+    assert async_llm_helpers.parse_rubric_comparison('{"creativity": "maybe"}') is None
+
+
+@pytest.mark.asyncio
+async def test_generate_elo_results_applies_combined_comparisons(monkeypatch):
+    calls = []
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", fake_llm(calls))
+    entries = await elo_fight_generator.generate_elo_results(make_entries(4), num_folds=2)
+    assert len(entries) == 4
+    # Elo updates are zero-sum, and every entry had identical starting ratings
+    assert sum(entry['elo_creativity'] for entry in entries) == pytest.approx(4 * 1200)
+    assert len({round(entry['elo_creativity'], 6) for entry in entries}) > 1
+    # 4 evaluations, then 2 pairs per fold
+    assert len(calls) == 4 + 2 * 2
+
+
+def test_swiss_pairings_match_each_entry_once_and_avoid_rematches():
+    ratings = [[1000 + 10 * i] * 4 for i in range(9)]
+    ids = [str(i) for i in range(9)]
+    played = set()
+    first = swiss_pairings(ratings, ids, played, fold=0)
+    assert first == [(0, 1), (2, 3), (4, 5), (6, 7)]
+
+    second = swiss_pairings(ratings, ids, played, fold=1)
+    seen = [i for pair in second for i in pair]
+    assert len(second) == 4 and len(seen) == len(set(seen))
+    assert not {pair_key(ids[i], ids[j]) for i, j in first} & {pair_key(ids[i], ids[j]) for i, j in second}
+    assert swiss_pairings([[1000] * 4], ["only"]) == []
+
+
+def test_vectorized_elo_matches_scalar_update_elo():
+    entries = make_entries(4)
+    for i, entry in enumerate(entries):
+        for d, score_type in enumerate(ELO_DIMENSIONS):
+            entry[score_type] = 1000.0 + 50 * i - 30 * d
+    store = EloRatingStore.from_entries(entries)
+    results = [("A", "B", "DRAW", "?"), ("B", "B", "A", "DRAW")]
+    store.apply_results([0, 2], [1, 3], outcome_scores(results))
+
+    for (a, b), outcomes in zip([(0, 1), (2, 3)], results):
+        for score_type, result in zip(ELO_DIMENSIONS, outcomes):
+            elo_fight_generator.update_elo(entries[a], entries[b], result, score_type)
+    for row, entry in enumerate(entries):
+        assert store.ratings[row] == pytest.approx([entry[score_type] for score_type in ELO_DIMENSIONS])
+
+
+def test_fold_scheduler_stops_once_ranks_settle():
+    ratings = np.array([[600.0 + 37 * i] * 4 for i in range(20)])
+    scheduler = FoldScheduler(max_folds=10, min_folds=2, window=2)
+    moved = ratings.copy()
+    moved[:2] += 30  # two entries still moving
+    scheduler.observe(ratings, moved)
+    assert scheduler.should_continue()
+    scheduler.observe(moved, moved)
+    assert scheduler.converged() and not scheduler.should_continue()
+
+
+def test_fold_scheduler_waits_for_a_full_window_without_raising_min_folds():
+    ratings = np.array([[600.0 + 37 * i] * 4 for i in range(20)])
+    scheduler = FoldScheduler(max_folds=10, min_folds=1, window=3)
+    assert scheduler.min_folds == 1
+    for _ in range(2):
+        scheduler.observe(ratings, ratings)
+        assert not scheduler.converged() and scheduler.active_rows() is None
+    scheduler.observe(ratings, ratings)
+    assert scheduler.converged()
+
+    with pytest.raises(ValueError):
+        FoldScheduler(max_folds=10, min_folds=0)
+
+def test_fold_scheduler_focuses_on_moving_neighbourhoods():
+    ratings = np.array([[600.0 + 37 * i] * 4 for i in range(20)])
+    scheduler = FoldScheduler(max_folds=10, min_folds=1, window=1)
+    moved = ratings.copy()
+    moved[10] += 12
+    scheduler.observe(ratings, moved)
+    rows = scheduler.active_rows()
+    assert {9, 10, 11} <= set(rows.tolist())
+    assert len(rows) < len(ratings)
+
+
+def rated_cohort(n, seed=0):
+    # Initial ratings are a noisy view of a hidden quality, like the rubric evaluation
+    rng = np.random.default_rng(seed)
+    quality = {str(i): q for i, q in enumerate(rng.normal(1000, 250, n))}
+    entries = make_entries(n)
+    for entry in entries:
+        for score_type, value in zip(ELO_DIMENSIONS, quality[entry['id']] + rng.normal(0, 150, len(ELO_DIMENSIONS))):
+            entry[score_type] = float(100 * round(value / 100))
+    return entries, quality
+
+
+def quality_comparator(quality):
+    async def compare(entry, opponent):
+        return tuple("A" if quality[entry['id']] + 30 * d > quality[opponent['id']] else "B" for d in range(len(ELO_DIMENSIONS)))
+    return compare
+
+
+def record_cohort_sizes(monkeypatch):
+    sizes = []
+
+    def pairings(ratings, ids, played, fold=0):
+        sizes.append(len(ids))
+        return swiss_pairings(ratings, ids, played, fold=fold)
+
+    monkeypatch.setattr(elo_fight_generator, "swiss_pairings", pairings)
+    return sizes
+
+
+@pytest.mark.asyncio
+async def test_adaptive_folds_stop_early_and_focus_in_the_elo_loop(monkeypatch):
+    entries, quality = rated_cohort(200)
+    monkeypatch.setattr(elo_fight_generator, "_compare_pair", quality_comparator(quality))
+    sizes = record_cohort_sizes(monkeypatch)
+    await elo_fight_generator.elo_fights(entries, num_folds=20)
+    assert len(sizes) < 20
+    assert sizes[0] == 200 and min(sizes) < 100
+
+
+@pytest.mark.asyncio
+async def test_resumed_job_keeps_its_fold_schedule(monkeypatch, tmp_path):
+    entries, quality = rated_cohort(200)
+    compare = quality_comparator(quality)
+    monkeypatch.setattr(elo_fight_generator, "_compare_pair", compare)
+    sizes = record_cohort_sizes(monkeypatch)
+    await elo_fight_generator.elo_fights([entry.model_copy() for entry in entries], num_folds=20)
+    uninterrupted = list(sizes)
+
+    async def crash_in_sixth_fold(entry, opponent):
+        if len(sizes) == 6:
+            raise RuntimeError("worker killed")
+        return await compare(entry, opponent)
+
+    sizes.clear()
+    monkeypatch.setattr(elo_fight_generator, "_compare_pair", crash_in_sixth_fold)
+    checkpoint = JobCheckpoint("job-1", {"num_folds": 20}, directory=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        await elo_fight_generator.elo_fights(entries, num_folds=20, checkpoint=checkpoint)
+    state = JobCheckpoint.load("job-1", directory=str(tmp_path))
+    assert state.fold == 5 and len(state.scheduler["history"]) == 5
+
+    sizes.clear()
+    monkeypatch.setattr(elo_fight_generator, "_compare_pair", compare)
+    await elo_fight_generator.generate_elo_results(state.entries, num_folds=20, checkpoint=checkpoint, resume_state=state)
+    # Same folds, same focus and the same stopping point as without the crash
+    assert sizes == uninterrupted[5:]
+
+
+@pytest.mark.asyncio
+async def test_resume_from_checkpoint_skips_finished_work(monkeypatch, tmp_path):
+    calls = []
+    llm = fake_llm(calls)
+
+    async def crash_in_second_fold(prompt, **kwargs):
+        if "Compare" in prompt and len(calls) >= 6 + 3:
+            raise RuntimeError("worker killed")
+        return await llm(prompt, **kwargs)
+
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", crash_in_second_fold)
+    checkpoint = JobCheckpoint("job-1", {"num_folds": 3}, directory=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        await elo_fight_generator.generate_elo_results(make_entries(6), num_folds=3, early_stopping=False, checkpoint=checkpoint)
+
+    state = JobCheckpoint.load("job-1", directory=str(tmp_path))
+    assert state.phase == "fold" and state.fold == 1
+    assert len(state.played) == 3
+    assert state.entries[0]['creativity_score'] == 7
+
+    calls.clear()
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", llm)
+    entries = await elo_fight_generator.generate_elo_results(state.entries, num_folds=3, early_stopping=False,
+                                                             checkpoint=checkpoint, resume_state=state)
+    assert len(entries) == 6
+    # No re-evaluation, only the two remaining folds of three pairs each
+    assert len(calls) == 2 * 3
+
+
+@pytest.mark.asyncio
+async def test_resume_of_a_queued_job_does_not_start_a_second_copy(monkeypatch, tmp_path):
+    from fast_llm_api.routes import content_rank
+    from fast_llm_api.services.content_rank import checkpoint as checkpoint_module
+    from fast_llm_api.helpers.job_executor import JobExecutor
+
+    calls = []
+    monkeypatch.setattr(async_llm_helpers, "async_openai_call", fake_llm(calls))
+    monkeypatch.setattr(checkpoint_module, "CHECKPOINT_DIR", str(tmp_path))
+    executor = JobExecutor(max_concurrent_jobs=1)
+    monkeypatch.setattr(content_rank, "job_executor", executor)
+    release = asyncio.Event()
+    executor.submit("blocker", release.wait)
+    await asyncio.sleep(0)
+
+    response = await content_rank.submit_job(content_rank.SubmitJobRequest(texts=make_entries(4), num_folds=1, early_stopping=False))
+    job_id = response["job_id"]
+    # The submitted checkpoint is on disk, but the queued job holds its lock
+    assert await content_rank.resume_from_checkpoint(job_id) is None
+    await content_rank.resume_pending_jobs()
+    assert executor.queued == 1
+
+    # A run that can't claim the lock returns without doing anything
+    await content_rank.process_job(job_id, make_entries(4), 1, early_stopping=False)
+    assert calls == []
+
+    release.set()
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if content_rank.jobs.get(job_id)['status'] == 'completed':
+            break
+    assert content_rank.jobs.get(job_id)['status'] == 'completed'
+    # 4 evaluations and one fold of 2 pairs, run once
+    assert len(calls) == 4 + 2
+    await executor.stop()
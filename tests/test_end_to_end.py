@@ -0,0 +1,110 @@
+import os
+import asyncio
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.mock_llm_server import MockLLMServer, MockConfig, classify, answer
+from benchmarks.run_benchmark import make_essays
+from fast_llm_api.helpers import async_llm_helpers
+from fast_llm_api.helpers.async_llm_helpers import (compare_all_dimensions_prompt, compare_grammar_prompt, evaluate_all_dimensions_prompt,
+                                                    parse_rubric_comparison, parse_rubric_evaluation)
+from fast_llm_api.helpers import profiling
+from fast_llm_api.helpers.llm_cache import llm_cache
+from fast_llm_api.main import app
+
+
+@pytest.fixture
+def mock_llm(tmp_path, monkeypatch):
+    # Checkpoints, job stores and the similarity corpus use relative paths
+    monkeypatch.chdir(tmp_path)
+    server = MockLLMServer(MockConfig(latency="uniform", latency_ms=5, rate_limit_rate=0.1, retry_after=0.01, seed=1))
+    base_url = server.start()
+    monkeypatch.setattr(async_llm_helpers, "OPENAI_CHAT_COMPLETIONS_URL", f"{base_url}/chat/completions")
+    monkeypatch.setattr(llm_cache, "enabled", False)
+    yield server
+    server.stop()
+
+
+def wait_for_job(client, endpoint, job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/{endpoint}/job-status/{job_id}").json()
+        if status["status"] in ("completed", "failed"):
+            return status
+        time.sleep(0.05)
+    raise TimeoutError(f"{endpoint} job {job_id} did not finish")
+
+
+def test_mock_answers_are_deterministic_and_parseable():
+    config = MockConfig()
+    evaluation = parse_rubric_evaluation(answer("evaluate_all", evaluate_all_dimensions_prompt("I went to the beach."), config))
+    assert evaluation is not None and 1 <= evaluation.coherence <= 5
+
+    prompt = compare_all_dimensions_prompt("text one", [], "text two", [])
+    assert classify(prompt) == "compare_all"
+    forward = parse_rubric_comparison(answer("compare_all", prompt, config))
+    backward = parse_rubric_comparison(answer("compare_all", compare_all_dimensions_prompt("text two", [], "text one", []), config))
+    flipped = {"A": "B", "B": "A", "DRAW": "DRAW"}
+    assert all(flipped[getattr(forward, name)] == getattr(backward, name) for name in ("creativity", "depth", "coherence", "grammar"))
+    assert answer(classify(compare_grammar_prompt("x", [], "y", [])), compare_grammar_prompt("x", [], "y", []), config) in ("A", "B", "DRAW")
+
+
+def test_jobs_complete_against_mock_provider(mock_llm):
+    essays = make_essays(12)
+    with TestClient(app) as client:
+        job_id = client.post("/content-rank/submit-job", json={"texts": essays, "num_folds": 2}).json()["job_id"]
+        assert wait_for_job(client, "content-rank", job_id)["status"] == "completed"
+        result = client.get(f"/content-rank/job-result/{job_id}", params={"sort_by": "elo_depth"}).json()
+        assert result["total"] == 12
+        assert all(entry["elo_depth"] is not None for entry in result["result"])
+
+        job_id = client.post("/additional-analysis/submit-job", json={"texts": essays}).json()["job_id"]
+        assert wait_for_job(client, "additional-analysis", job_id)["status"] == "completed"
+        result = client.get(f"/additional-analysis/job-result/{job_id}").json()["result"]
+        assert all(entry["plagiarism_score"] for entry in result)
+
+        usage = client.get(f"/additional-analysis/job-status/{job_id}").json()["llm_usage"]
+        assert usage["by_prompt_type"]["story"]["calls"] == 12
+        assert usage["prompt_tokens"] > 0 and usage["cost_usd"] > 0
+        metrics = client.get("/metrics").text
+        assert 'fast_llm_api_llm_calls_total{prompt_type="compare_all_dimensions",outcome="ok"}' in metrics
+        assert 'fast_llm_api_llm_call_latency_seconds_bucket{prompt_type="plagiarism",le="+Inf"}' in metrics
+
+    stats = mock_llm.snapshot()
+    assert stats["rate_limited"] > 0  # injected 429s were retried rather than failing the jobs
+    assert stats["kinds"]["plagiarism"] == 12 and stats["kinds"]["story"] == 12
+    assert "unknown" not in stats["kinds"]
+
+
+def test_profiled_job_reports_phases_and_sampled_stacks(mock_llm, monkeypatch):
+    with TestClient(app) as client:
+        assert client.post("/profiling/jobs/anything").status_code == 403
+
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(profiling, "PROFILE_ALL_JOBS", True)
+    monkeypatch.setattr(profiling.job_profiler, "directory", "profiles")
+    with TestClient(app) as client:
+        job_id = client.post("/content-rank/submit-job", json={"texts": make_essays(8), "num_folds": 2}).json()["job_id"]
+        assert wait_for_job(client, "content-rank", job_id)["status"] == "completed"
+        time.sleep(0.05)  # the profiler is stopped just after the status flips
+
+        report = client.get(f"/profiling/jobs/{job_id}").json()
+        assert {"job", "evaluation", "pairing", "llm_wait", "elo_update"} <= set(report["phases"]["totals"])
+        assert report["phases"]["totals"]["pairing"]["count"] == 2
+        assert report["profiling"] == "finished" and report["profile"]["samples"] > 0
+        assert client.get(f"/profiling/jobs/{job_id}/profile").status_code == 200
+        assert client.get("/profiling/loop-lag").json()["running"]
+    assert os.path.exists(f"profiles/{job_id}.folded")
+
+
+@pytest.mark.asyncio
+async def test_scheduled_profile_honours_its_time_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ENABLED", True)
+    profiler = profiling.JobProfiler(directory=str(tmp_path))
+    assert profiler.request("job-1", seconds=0.05) == "scheduled"
+    with profiler.job("job-1"):
+        assert profiler.state("job-1") == "profiling"
+        await asyncio.sleep(0.2)
+        assert profiler.state("job-1") == "finished"
+    assert os.path.exists(tmp_path / "job-1.folded")
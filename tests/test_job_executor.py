@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+
+from fast_llm_api.helpers.job_executor import JobExecutor, QueueFullError
+from fast_llm_api.helpers.progress import ProgressBroker
+
+
+@pytest.mark.asyncio
+async def test_jobs_run_by_priority_with_bounded_concurrency():
+    executor = JobExecutor(max_concurrent_jobs=1, max_queue_size=3)
+    started = []
+    release = asyncio.Event()
+
+    async def job(name):
+        started.append(name)
+        await release.wait()
+
+    executor.submit("blocker", job, "blocker")
+    await asyncio.sleep(0)  # let the worker pick up the first job
+    assert executor.submit("bulk", job, "bulk", priority=10) == 1
+    assert executor.submit("interactive", job, "interactive", priority=0) == 1
+    assert executor.queue_position("bulk") == 2
+    executor.submit("bulk-2", job, "bulk-2", priority=10)
+    with pytest.raises(QueueFullError):
+        executor.submit("overflow", job, "overflow")
+
+    release.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert started == ["blocker", "interactive", "bulk", "bulk-2"]
+    await executor.stop()
+
+
+@pytest.mark.asyncio
+async def test_progress_subscribers_get_snapshot_then_live_events_until_finished():
+    broker = ProgressBroker()
+    broker.publish("job", "status", status="running")
+    broker.publish("job", "fold", fold=1, num_folds=3)
+    received = []
+
+    async def listen():
+        async for event in broker.subscribe("job"):
+            received.append((event["type"], event.get("fold") or event.get("status")))
+
+    listener = asyncio.create_task(listen())
+    await asyncio.sleep(0)
+    broker.publish("job", "fold", fold=2, num_folds=3)
+    broker.publish("job", "status", status="completed")
+    await asyncio.wait_for(listener, timeout=1)
+    assert received == [("status", "running"), ("fold", 1), ("fold", 2), ("status", "completed")]
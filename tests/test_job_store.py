@@ -0,0 +1,75 @@
+import time
+import pytest
+from datetime import datetime, timedelta
+
+from fast_llm_api.helpers.job_store import InMemoryJobStore, SqliteJobStore, InvalidStatusTransition
+from fast_llm_api.helpers.result_pages import select_page, encode_page, ndjson_lines
+from fast_llm_api.services.models import OneStudentEntry
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteJobStore("content_rank", path=str(tmp_path / "jobs.sqlite3"), ttl=60)
+    return InMemoryJobStore(ttl=60)
+
+
+def test_job_lifecycle_round_trips_results(store):
+    store.create("job-1")
+    assert store.get("job-1")["status"] == "queued"
+    store.update("job-1", status="running", start_time=datetime.now())
+    result = [OneStudentEntry(id="a", answer="text", elo_depth=912.5)]
+    store.update("job-1", status="completed", result=result, end_time=datetime.now())
+
+    job = store.get("job-1")
+    assert job["status"] == "completed"
+    assert job["result"][0]["elo_depth"] == 912.5
+    assert isinstance(job["start_time"], datetime)
+    assert store.get("missing") is None
+
+    with pytest.raises(InvalidStatusTransition):
+        store.update("job-1", status="running")
+
+
+def test_listing_filters_by_status_and_orders_by_creation(store):
+    now = datetime.now()
+    for i, status in enumerate(["queued", "running", "queued"]):
+        store.create(f"job-{i}", created_at=now + timedelta(seconds=i))
+        if status == "running":
+            store.update(f"job-{i}", status="running")
+    assert list(store.list_jobs()) == ["job-0", "job-1", "job-2"]
+    assert list(store.list_jobs(status="queued")) == ["job-0", "job-2"]
+    assert list(store.list_jobs(created_after=now, limit=1)) == ["job-1"]
+
+
+def test_finished_jobs_are_evicted_after_ttl(store):
+    store.create("old")
+    store.update("old", status="failed", end_time=datetime.now() - timedelta(seconds=120))
+    store.create("fresh")
+    assert store.evict_expired(time.time()) == 1
+    assert store.get("old") is None and store.get("fresh") is not None
+
+
+def test_metadata_only_get_and_result_pages(store):
+    store.create("job-1")
+    store.update("job-1", status="running", start_time=datetime.now())
+    result = [OneStudentEntry(id=str(i), answer="text", elo_depth=float(i), elo_grammar=float(-i)) for i in range(5)]
+    store.update("job-1", status="completed", result=result, end_time=datetime.now())
+
+    assert "result" not in store.get("job-1", with_result=False)
+
+    items = store.get("job-1")["result"]
+    page, total = select_page(items, offset=1, limit=2, sort_by="elo_depth", descending=True)
+    assert total == 5
+    assert encode_page(page, ["id", "elo_depth"]) == [{"id": "3", "elo_depth": 3.0}, {"id": "2", "elo_depth": 2.0}]
+
+    page, _ = select_page(items, limit=1, sort_by="elo_grammar", descending=False)
+    assert list(ndjson_lines(page, ["id"])) == ['{"id": "4"}\n']
+
+
+@pytest.mark.asyncio
+async def test_async_accessors_match_sync_calls(store):
+    await store.acreate("job-1")
+    await store.aupdate("job-1", status="running", start_time=datetime.now())
+    assert (await store.aget("job-1"))["status"] == "running"
+    assert list(await store.alist_jobs(status="running")) == ["job-1"]
@@ -0,0 +1,295 @@
+import json
+import asyncio
+import pytest
+
+from fast_llm_api.helpers import async_llm_helpers, batch_backend
+from fast_llm_api.helpers.llm_cache import LLMResponseCache, make_cache_key
+from fast_llm_api.helpers.rate_limiter import LLMScheduler, TokenBucket, estimate_tokens
+from fast_llm_api.helpers.retry_policy import RetryPolicy, LLMRequestError, is_retryable_exception, parse_duration, parse_retry_after
+
+
+def test_estimate_tokens_counts_completion_budget():
+    assert estimate_tokens("abcd" * 10, max_tokens=100) == 111
+    # Multi-byte text is not underestimated
+    assert estimate_tokens("가나다라") > estimate_tokens("abcd")
+
+
+def test_token_bucket_waits_when_drained():
+    bucket = TokenBucket(per_minute=60)
+    assert bucket.time_until_available(60) == 0
+    bucket.consume(60)
+    assert bucket.time_until_available(1) == pytest.approx(1.0, abs=0.05)
+
+
+@pytest.mark.asyncio
+async def test_scheduler_caps_in_flight_requests():
+    scheduler = LLMScheduler(max_in_flight=3, requests_per_minute=0, tokens_per_minute=0)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with scheduler.slot():
+            peak = max(peak, scheduler.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(20)))
+    assert peak == 3
+    assert scheduler.in_flight == 0
+
+
+def test_parse_duration_handles_openai_reset_formats():
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+    assert parse_duration("2") == 2
+    assert parse_duration("soon") is None
+
+
+def test_parse_retry_after_prefers_exhausted_limit():
+    assert parse_retry_after({"retry-after": "3"}) == 3
+    headers = {
+        "x-ratelimit-remaining-requests": "10",
+        "x-ratelimit-reset-requests": "1s",
+        "x-ratelimit-remaining-tokens": "0",
+        "x-ratelimit-reset-tokens": "7s",
+    }
+    assert parse_retry_after(headers) == 7
+    assert parse_retry_after({}) is None
+
+
+def test_retry_classification():
+    assert is_retryable_exception(LLMRequestError("busy", status=503, retryable=True))
+    assert not is_retryable_exception(LLMRequestError("bad key", status=401))
+    assert is_retryable_exception(asyncio.TimeoutError())
+    assert not is_retryable_exception(ValueError())
+
+
+def test_next_delay_is_jittered_and_capped_but_honours_server_hints():
+    policy = RetryPolicy(base_delay=0.5, max_delay=10)
+    delays = {policy.next_delay(4) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(0.5 <= d <= 10 for d in delays)
+    assert 3 <= policy.next_delay(4, retry_after=3) <= 3.5
+    # A server hint is only bounded by the call deadline, not by max_delay
+    assert 30 <= policy.next_delay(4, retry_after=30) <= 30.5
+    assert 30 <= policy.next_delay(4, retry_after=30, remaining=30.2) < 30.2
+    assert policy.next_delay(4, retry_after=30, remaining=20) == 30
+
+
+@pytest.mark.asyncio
+async def test_cache_persists_to_disk_and_counts_hits(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    key = make_cache_key("gpt-4o-mini", "You are an evaluator.", "Text: hello", 1000)
+    cache = LLMResponseCache(path=path, ttl=60, memory_entries=10, disk_entries=100)
+    assert await cache.get(key) is None
+    await cache.set(key, "7")
+    assert await cache.get(key) == "7"
+    cache.close()
+
+    reopened = LLMResponseCache(path=path, ttl=60, memory_entries=10, disk_entries=100)
+    assert await reopened.get(key) == "7"
+    assert reopened.stats()["disk_hits"] == 1
+    reopened.close()
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_expires_and_bounds_memory():
+    cache = LLMResponseCache(path=None, ttl=0, memory_entries=2)
+    await cache.set("a", "1")
+    assert await cache.get("a") is None
+
+    cache = LLMResponseCache(path=None, ttl=60, memory_entries=2)
+    for key in ("a", "b", "c"):
+        await cache.set(key, key)
+    assert await cache.get("a") is None
+    assert await cache.get("c") == "c"
+
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_calls_share_one_request(monkeypatch):
+    calls = 0
+
+    async def fake_call(prompt, system_prompt, max_tokens, retries):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return f"answer to {prompt}"
+
+    monkeypatch.setattr(async_llm_helpers, "_call_with_retries", fake_call)
+    monkeypatch.setattr(async_llm_helpers, "llm_cache", LLMResponseCache(path=None, enabled=False))
+
+    results = await asyncio.gather(*(async_llm_helpers.async_openai_call(p) for p in ["x"] * 5 + ["y"] * 3))
+    assert calls == 2
+    assert results.count("answer to x") == 5
+    assert async_llm_helpers._inflight_calls == {}
+
+
+@pytest.mark.asyncio
+async def test_cancelled_leader_fails_followers_without_cancelling_them(monkeypatch):
+    async def slow_call(prompt, system_prompt, max_tokens, retries):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(async_llm_helpers, "_call_with_retries", slow_call)
+    monkeypatch.setattr(async_llm_helpers, "llm_cache", LLMResponseCache(path=None, enabled=False))
+
+    leader = asyncio.create_task(async_llm_helpers.async_openai_call("x"))
+    await asyncio.sleep(0)
+    follower = asyncio.create_task(async_llm_helpers.async_openai_call("x"))
+    await asyncio.sleep(0)
+    leader.cancel()
+
+    with pytest.raises(LLMRequestError):
+        await follower
+    assert leader.cancelled()
+    assert async_llm_helpers._inflight_calls == {}
+
+@pytest.mark.asyncio
+async def test_batch_mode_replays_jsonl_and_falls_back_to_realtime(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch_backend, "llm_cache", LLMResponseCache(path=None, enabled=False))
+    monkeypatch.setattr(batch_backend, "LLM_BATCH_WORK_DIR", str(tmp_path))
+    realtime_prompts = []
+
+    async def fake_realtime(prompt, **kwargs):
+        realtime_prompts.append(prompt)
+        return "realtime"
+
+    monkeypatch.setattr(batch_backend, "async_openai_call", fake_realtime)
+
+    replay_path = tmp_path / "replay.jsonl"
+    with open(replay_path, "w") as f:
+        for prompt, answer in [("p1", "A"), ("p2", "B")]:
+            key = make_cache_key(async_llm_helpers.OPENAI_MODEL, async_llm_helpers.SYSTEM_PROMPT, prompt, async_llm_helpers.MAX_TOKENS)
+            body = {"choices": [{"message": {"content": f" {answer} "}}]}
+            f.write(json.dumps({"custom_id": key, "response": {"status_code": 200, "body": body}}) + "\n")
+
+    backend = batch_backend.ReplayBatchBackend(str(replay_path))
+    results = await batch_backend.run_prompts_in_batch(["p1", "p2", "p1", "p3"], backend=backend)
+    assert results == ["A", "B", "A", "realtime"]
+    assert realtime_prompts == ["p3"]
+
+    with pytest.raises(ValueError, match="LLM_BATCH_REPLAY_PATH"):
+        batch_backend.ReplayBatchBackend("")
+
+
+@pytest.mark.asyncio
+async def test_telemetry_aggregates_calls_per_job_and_prompt_type(monkeypatch):
+    from fast_llm_api.helpers.job_context import current_job_id
+    from fast_llm_api.helpers.telemetry import Telemetry, Histogram
+
+    histogram = Histogram((1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == pytest.approx(1.5)
+    assert list(histogram.cumulative())[-1] == (float("inf"), 4)
+
+    telemetry = Telemetry()
+    attempts = 0
+
+    async def flaky_post(session, payload):
+        nonlocal attempts
+        attempts += 1
+        if attempts == 1:
+            raise LLMRequestError("HTTP 429", status=429, retryable=True, retry_after=0)
+        return {"choices": [{"message": {"content": "A"}}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 2, "prompt_tokens_details": {"cached_tokens": 64}}}
+
+    monkeypatch.setattr(async_llm_helpers, "telemetry", telemetry)
+    monkeypatch.setattr(async_llm_helpers, "_post_chat_completion", flaky_post)
+    monkeypatch.setattr(async_llm_helpers, "llm_cache", LLMResponseCache(path=None, enabled=True))
+    token = current_job_id.set("job-1")
+    try:
+        assert await async_llm_helpers.async_openai_call("p", prompt_type="compare_depth") == "A"
+        assert await async_llm_helpers.async_openai_call("p", prompt_type="compare_depth") == "A"
+    finally:
+        current_job_id.reset(token)
+
+    summary = telemetry.job_summary("job-1")["by_prompt_type"]["compare_depth"]
+    assert (summary["calls"], summary["retries"], summary["cache_hits"]) == (1, 1, 1)
+    assert (summary["prompt_tokens"], summary["cached_tokens"]) == (100, 64)
+    assert telemetry.job_summary("job-1")["cached_token_share"] == 0.64
+    assert 'fast_llm_api_llm_retries_total{prompt_type="compare_depth"} 1' in telemetry.render_prometheus()
+
+
+def test_prompts_share_a_static_prefix_and_end_with_the_texts():
+    from fast_llm_api.helpers.prompt_templates import COMPARE_ALL_DIMENSIONS, EVALUATE_ALL_DIMENSIONS, RUBRIC_SYSTEM_PROMPT
+
+    first = async_llm_helpers.evaluate_all_dimensions_prompt("One essay.")
+    second = async_llm_helpers.evaluate_all_dimensions_prompt("A different {essay}.")
+    assert first.startswith(EVALUATE_ALL_DIMENSIONS.prefix) and second.startswith(EVALUATE_ALL_DIMENSIONS.prefix)
+    assert second.endswith("Text: A different {essay}.")
+    assert not EVALUATE_ALL_DIMENSIONS.prefix.startswith((" ", "\n"))
+    # Every rubric call sends the same system message, long enough for the provider to cache
+    assert estimate_tokens(RUBRIC_SYSTEM_PROMPT) > 1024
+
+    mistakes = [{"start_idx": 0, "end_idx": 3, "original_text": "goed", "corrected_text": "went", "mistake_category": "Verb tense"}]
+    prompt = async_llm_helpers.compare_all_dimensions_prompt("Essay A.", mistakes, "Essay B.", [])
+    assert prompt == COMPARE_ALL_DIMENSIONS.prefix + (
+        'Text A: Essay A.\nMistakes A: [{"start_idx":0,"end_idx":3,"original_text":"goed","corrected_text":"went","mistake_category":"Verb tense"}]'
+        '\n\nText B: Essay B.\nMistakes B: []')
+
+
+def test_http_session_from_a_finished_loop_is_released():
+    from fast_llm_api.helpers import http_session
+
+    async def session():
+        return http_session.get_http_session()
+
+    first = asyncio.run(session())
+    second = asyncio.run(session())
+    try:
+        assert second is not first and first.closed and not second.closed
+    finally:
+        asyncio.run(http_session.close_http_session())
+
+
+@pytest.mark.asyncio
+async def test_batch_backend_retries_polls_and_resumes_a_submitted_batch(tmp_path, monkeypatch):
+    from fast_llm_api.helpers.job_context import current_batch_ledger
+    from fast_llm_api.services.content_rank.checkpoint import JobCheckpoint
+
+    calls, polls = [], []
+
+    async def fake_request_json(method, path, **kwargs):
+        calls.append((method, path))
+        if path == "/files":
+            return {"id": "file-1"}
+        if path == "/batches":
+            return {"id": f"batch-{sum(call == ('POST', '/batches') for call in calls)}"}
+        if path.endswith("/cancel"):
+            return {}
+        outcome = polls.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    async def fake_download(file_id, results):
+        results["key"] = {"custom_id": "key"}
+
+    backend = batch_backend.OpenAIBatchBackend(poll_interval=0)
+    monkeypatch.setattr(backend, "_request_json", fake_request_json)
+    monkeypatch.setattr(backend, "_download", fake_download)
+    checkpoint = JobCheckpoint("job-1", directory=str(tmp_path))
+    requests = tmp_path / "requests.jsonl"
+    requests.write_text("{}\n")
+    token = current_batch_ledger.set(checkpoint)
+    try:
+        # A transient 502 is retried; the worker is then stopped mid-wait
+        polls[:] = [LLMRequestError("HTTP 502", status=502, retryable=True, retry_after=0), {"status": "in_progress"},
+                    asyncio.CancelledError()]
+        with pytest.raises(asyncio.CancelledError):
+            await backend.run(str(requests), "chunk")
+        assert checkpoint.batch_id("chunk") == "batch-1"
+
+        # The resumed job collects the batch it already submitted
+        polls[:] = [{"status": "completed", "output_file_id": "out-1"}]
+        assert await backend.run(str(requests), "chunk") == {"key": {"custom_id": "key"}}
+        assert calls.count(("POST", "/batches")) == 1 and checkpoint.batch_id("chunk") is None
+
+        # A job that gives up cancels its batch
+        polls[:] = [LLMRequestError("HTTP 401", status=401)]
+        with pytest.raises(LLMRequestError):
+            await backend.run(str(requests), "other")
+        assert calls[-1] == ("POST", "/batches/batch-2/cancel") and checkpoint.batch_id("other") is None
+    finally:
+        current_batch_ledger.reset(token)
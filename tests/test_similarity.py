@@ -0,0 +1,179 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from fast_llm_api.services.similarity.top_k import top_k_similar, parallel_top_k_similar
+from fast_llm_api.helpers import executors
+from fast_llm_api.services.similarity.minhash import MinHashLSHIndex, PersistentMinHashIndex
+from fast_llm_api.services.similarity import corpus as corpus_module
+from fast_llm_api.services.similarity.corpus import TfidfCorpus
+from fast_llm_api.services import additional_analyis
+from fast_llm_api.services.additional_analyis import cross_check_similarity, minhash_neighbours, match_previous_submissions, run_analysis_pipeline
+
+
+def random_texts(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(60)]
+    return [" ".join(rng.choice(words, size=12)) for _ in range(n)]
+
+
+@pytest.fixture(autouse=True)
+def temporary_corpus(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpus_module, "SIMILARITY_CORPUS_DIR", str(tmp_path / "corpus"))
+    return corpus_module.get_corpus()
+
+
+def test_blocked_top_k_matches_dense_cosine():
+    vectors = TfidfVectorizer().fit_transform(random_texts(37))
+    dense = cosine_similarity(vectors)
+    np.fill_diagonal(dense, -np.inf)
+
+    # A tiny block budget forces many blocks, including a ragged last one
+    indices, scores = top_k_similar(vectors, k=3, max_block_elements=37 * 4)
+
+    assert indices.shape == (37, 3)
+    assert not (indices == np.arange(37)[:, None]).any()
+    expected = -np.sort(-dense, axis=1)[:, :3]
+    np.testing.assert_allclose(scores, expected, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(dense[np.arange(37)[:, None], indices], expected, rtol=1e-5, atol=1e-6)
+
+
+def test_cross_check_similarity_lists_top_k_neighbours():
+    entries = [{"id": "a", "answer": "the cat sat on the mat"},
+               {"id": "b", "answer": "the cat sat on the mat today"},
+               {"id": "c", "answer": "quantum fields and gauge symmetry"}]
+    asyncio.run(cross_check_similarity(entries, 0.2, top_k=2))
+
+    assert entries[0]["best_similarity_id"] == "b"
+    assert [item["id"] for item in entries[1]["similar_entries"]] == ["a", "c"]
+    assert entries[0]["best_similarity_score"] == entries[0]["similar_entries"][0]["score"]
+    assert len(top_k_similar(TfidfVectorizer().fit_transform(["only one"]))[0][0]) == 0
+
+
+def test_minhash_finds_near_duplicates_and_round_trips(tmp_path):
+    essay = "오늘 나는 학교에서 친구들과 함께 과학 실험을 했다. 실험은 어려웠지만 재미있었다. " * 3
+    texts = random_texts(20) + [essay, essay.replace("재미있었다", "즐거웠다"), ""]
+    neighbours, scores = minhash_neighbours(texts, top_k=2)
+    assert neighbours[20] == [21] and neighbours[21] == [20]
+    assert 0.5 < scores[20][0] <= 1.0
+    assert neighbours[22] == []
+
+    index = MinHashLSHIndex()
+    index.add("kept", essay)
+    index.save(str(tmp_path / "index.npz"))
+    loaded = MinHashLSHIndex.load(str(tmp_path / "index.npz"))
+    assert loaded.query(essay)[0] == ("kept", 1.0)
+
+
+def test_previous_submissions_are_matched_across_jobs(tmp_path):
+    directory = str(tmp_path / "previous")
+    essay = "the quick brown fox jumps over the lazy dog near the quiet river bank"
+    assert match_previous_submissions(["1"], [essay], "job-2023", directory=directory) == [[]]
+    # A later job reusing client id "1" for copied text still matches, and is indexed itself
+    matches = match_previous_submissions(["1", "2"], [essay, "nothing alike at all here"], "job-2024", directory=directory)
+    assert [(match["id"], match["job_id"]) for match in matches[0]] == [("1", "job-2023")]
+    assert matches[1] == []
+    matches = match_previous_submissions(["9"], [essay + "!"], "job-2025", directory=directory)
+    assert sorted(match["job_id"] for match in matches[0]) == ["job-2023", "job-2024"]
+    # Running the same job again does not match an entry against its own row
+    assert match_previous_submissions(["2"], ["nothing alike at all here"], "job-2024", directory=directory) == [[]]
+
+
+def test_persistent_minhash_index_is_shared_by_workers_and_appended_in_place(tmp_path):
+    essay = "the quick brown fox jumps over the lazy dog near the quiet river bank"
+    first, second = PersistentMinHashIndex(str(tmp_path)), PersistentMinHashIndex(str(tmp_path))
+    first.match_and_add(["a"], [essay], "job-1")
+    # Bytes of an append that died before committing meta.json
+    with open(tmp_path / "signatures.bin", "ab") as f:
+        f.write(b"\x01" * 12)
+
+    assert [key[1] for key, _ in second.match_and_add(["b"], [essay + "!"], "job-2")[0]] == ["a"]
+    index = first.index
+    assert [key[1] for key, _ in first.match_and_add(["c"], [essay + "?"], "job-3")[0]] == ["a", "b"]
+    assert first.index is index and len(index) == 3  # only the new rows were read
+    assert (tmp_path / "signatures.bin").stat().st_size == 3 * index.num_perm * 4
+
+
+def test_corpus_matches_refit_tfidf_and_respects_scopes(temporary_corpus):
+    first = random_texts(12, seed=1)
+    second = random_texts(8, seed=2) + [first[3] + " word1"]
+    temporary_corpus.add_documents([f"a{i}" for i in range(12)], first, job_id="job-a", school="north")
+    matches = temporary_corpus.neighbours([f"b{i}" for i in range(9)], second, k=2, scope="all", job_id="job-b", school="south")
+
+    # Same scores as refitting TfidfVectorizer on the concatenated corpus
+    dense = cosine_similarity(TfidfVectorizer().fit_transform(first + second))
+    assert matches[8][0]["id"] == "a3" and matches[8][0]["job_id"] == "job-a"
+    assert matches[8][0]["score"] == pytest.approx(dense[20, 3], rel=1e-5)
+
+    # A reloaded corpus sees both jobs; the school scope only matches that school's rows
+    reloaded = TfidfCorpus(temporary_corpus.directory)
+    school_matches = reloaded.neighbours(["c0"], [second[8]], k=3, scope="school", school="south")
+    assert reloaded.num_docs == 22
+    assert {match["id"] for match in school_matches[0]} <= {f"b{i}" for i in range(9)}
+    assert school_matches[0][0]["id"] == "b8"
+
+
+def test_corpus_keeps_reused_ids_from_other_jobs_apart(temporary_corpus):
+    temporary_corpus.add_documents(["1", "2", "3"], ["quantum field theory", "pizza recipes", "river fishing"], job_id="cohort-2023")
+    # The same job recording its texts again adds nothing
+    temporary_corpus.add_documents(["1"], ["quantum field theory"], job_id="cohort-2023")
+    assert temporary_corpus.num_docs == 3
+
+    matches = temporary_corpus.neighbours(["1"], ["quantum field theory notes"], k=1, job_id="cohort-2024")
+    assert temporary_corpus.num_docs == 4
+    assert (matches[0][0]["id"], matches[0][0]["job_id"]) == ("1", "cohort-2023")
+    assert matches[0][0]["score"] > 0.5
+
+
+def test_process_pool_top_k_matches_in_process_result(monkeypatch):
+    monkeypatch.setattr(executors, "ANALYSIS_PROCESS_WORKERS", 2)
+    texts = random_texts(40, seed=3)
+    try:
+        indices, scores = asyncio.run(parallel_top_k_similar(texts, k=4, workers=2))
+    finally:
+        executors.shutdown_executors()
+    vectors = TfidfVectorizer().fit_transform(texts)
+    expected_indices, expected_scores = top_k_similar(vectors, k=4)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5, atol=1e-6)
+
+    similarities = (vectors @ vectors.T).toarray()
+    np.fill_diagonal(similarities, -np.inf)
+    # Every returned neighbour has the score of its place, so tied rows are right too
+    np.testing.assert_allclose(np.take_along_axis(similarities, indices, axis=1), expected_scores, rtol=1e-5, atol=1e-6)
+    # Rows without tied scores among the best k + 1 have a single right answer
+    best = -np.sort(-similarities, axis=1)[:, :5]
+    untied = ~np.isclose(best[:, :-1], best[:, 1:], rtol=1e-5, atol=1e-6).any(axis=1)
+    assert untied.sum() > 30
+    np.testing.assert_array_equal(indices[untied], expected_indices[untied])
+
+
+def test_pipeline_overlaps_llm_checks_with_similarity(monkeypatch):
+    similarity_done = threading.Event()
+    real_neighbours = additional_analyis.similarity_neighbours
+
+    def neighbours(texts, top_k):
+        result = real_neighbours(texts, top_k)
+        similarity_done.set()
+        return result
+
+    async def fake_llm(prompt, **kwargs):
+        # Only answers once similarity has finished, so a sequential pipeline would time out
+        for _ in range(500):
+            if similarity_done.is_set():
+                return "LOW" if "plagiarized" in prompt else "10"
+            await asyncio.sleep(0.01)
+        raise TimeoutError("similarity did not run alongside the LLM checks")
+
+    monkeypatch.setattr(additional_analyis, "similarity_neighbours", neighbours)
+    monkeypatch.setattr(additional_analyis, "async_openai_call", fake_llm)
+    entries = [{"id": str(i), "answer": text} for i, text in enumerate(random_texts(6))]
+    asyncio.run(run_analysis_pipeline(entries))
+    assert entries[0]["plagiarism_score"] == "LOW" and entries[0]["story_score"] == "10"
+    assert len(entries[0]["similar_entries"]) == 5
+
+    story_only = [{"id": "x", "answer": "a story"}]
+    asyncio.run(run_analysis_pipeline(story_only, stages=["story"]))
+    assert story_only[0] == {"id": "x", "answer": "a story", "story_score": "10"}